@@ -0,0 +1,344 @@
+from PyQt6.QtCore import QRect
+import json
+import os
+import struct
+import time
+import zlib
+import numpy as np
+from settings import AutosaveSettings
+
+"""Это модуль автосохранения на случай сбоя
+Холст отмечает плитки, которые изменились (после отпускания мыши, отмены, фильтра), и раз в interval миллисекунд
+копирует их из истории изменений (там лежит последнее зафиксированное состояние каждого слоя). Копирование плиток -
+единственное, что происходит в потоке интерфейса: сжатие и запись в журнал идут в отдельном потоке.
+
+Журнал - файл, в который записи только дописываются. Запись: тип (4 байта), длина, данные и CRC32. Если программа
+упала посреди записи, хвост не сойдется по длине или CRC и будет отброшен, все записи до него остаются целыми.
+  BASE - с чего начинается журнал: размер изображения и исходный файл (None - чистый холст)
+  LAYR - состав слоев и их свойства, слои обозначаются номерами журнала
+  TILE - номер слоя, положение и размер плитки, сжатые пиксели
+Когда записей плиток становится в compact_ratio раз больше, чем разных плиток, журнал сжимается: остается BASE,
+последний LAYR и последняя версия каждой плитки, то есть полный снимок изменений относительно исходного файла.
+Новый файл пишется рядом и подменяет старый одной операцией, так что сбой во время сжатия ничего не портит.
+Если исходный файл перезаписан (изображение сохранили поверх него), изменения относительно него больше
+не восстановить, и журнал начинается заново со снимка: BASE без исходного файла и все плитки всех слоев.
+Журнал, который не удалось восстановить, не затирается новым, а откладывается под другим именем.
+Восстановление читает журнал один раз по порядку, поэтому его время пропорционально размеру журнала"""
+
+MAGIC = b"PAINTJ1\n"
+HEADER = struct.Struct(">4sI")
+CRC = struct.Struct(">I")
+TILE = struct.Struct(">IIIII")
+
+BASE = b"BASE"
+LAYR = b"LAYR"
+TILE_RECORD = b"TILE"
+
+
+def pack_record(kind: bytes, payload: bytes) -> bytes:
+    return HEADER.pack(kind, len(payload)) + payload + CRC.pack(zlib.crc32(kind + payload))
+
+
+def pack_json(kind: bytes, data: dict) -> bytes:
+    return pack_record(kind, json.dumps(data).encode("utf-8"))
+
+
+def tile_payload(layer_id: int, x: int, y: int, pixels: np.ndarray, level: int) -> bytes:
+    """Данные записи TILE, их же передает совместная работа (collab.py)"""
+    h, w = pixels.shape
+
+    return TILE.pack(layer_id, x, y, w, h) + zlib.compress(pixels.tobytes(), level)
+
+
+def pack_tile(layer_id: int, x: int, y: int, pixels: np.ndarray, level: int) -> bytes:
+    return pack_record(TILE_RECORD, tile_payload(layer_id, x, y, pixels, level))
+
+
+def layers_data(layers, layer_id) -> dict:
+    """Данные записи LAYR: состав стека и свойства слоев, layer_id(слой) дает номер слоя"""
+    return {
+        "layers": [{"id": layer_id(layer), "name": layer.name, "visible": layer.visible,
+                    "opacity": layer.opacity, "blend_mode": layer.blend_mode} for layer in layers.layers],
+        "active": layers.active,
+        "counter": layers.counter,
+    }
+
+
+def unpack_tile(payload: bytes) -> tuple[int, int, int, np.ndarray]:
+    """Номер слоя, x, y и пиксели плитки"""
+    layer_id, x, y, w, h = TILE.unpack_from(payload)
+    pixels = np.frombuffer(zlib.decompress(payload[TILE.size:]), np.uint32).reshape(h, w)
+
+    return layer_id, x, y, pixels
+
+
+def read_journal(path: str):
+    """Перебирает целые записи журнала (тип, данные) и останавливается на первой оборванной или испорченной"""
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            return
+
+        while True:
+            header = file.read(HEADER.size)
+
+            if len(header) < HEADER.size:
+                return
+
+            kind, length = HEADER.unpack(header)
+            payload = file.read(length)
+            crc = file.read(CRC.size)
+
+            if len(payload) < length or len(crc) < CRC.size or CRC.unpack(crc)[0] != zlib.crc32(kind + payload):
+                return
+
+            yield kind, payload
+
+
+def mirror_tiles(mirror, tile_size: int):
+    """Плитки копии слоя: x, y и пиксели. У плиточного хранилища нетронутые плитки пропускаются,
+    новое хранилище и так залито фоном"""
+    h, w = mirror.shape
+    materialized = getattr(mirror, "materialized", None)
+
+    for y in range(0, h, tile_size):
+        for x in range(0, w, tile_size):
+            if materialized is None or materialized[y // tile_size, x // tile_size]:
+                yield x, y, np.array(mirror[y:min(y + tile_size, h), x:min(x + tile_size, w)])
+
+
+def source_stat(path: str) -> dict:
+    """Размер и время изменения исходного файла, чтобы при восстановлении убедиться, что он тот же"""
+    stat = os.stat(path)
+
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+
+class Journal:
+    def __init__(self, settings: AutosaveSettings):
+        self.enabled = settings.enabled
+        self.interval = settings.interval
+        self.default_tile_size = self.tile_size = settings.tile_size
+        self.level = settings.compression
+        self.compact_ratio = settings.compact_ratio
+        self.compact_records = settings.compact_records
+
+        directory = settings.directory or os.path.join(os.path.expanduser("~"), ".paint", "autosave")
+        self.path = os.path.join(directory, "journal.bin")
+
+        # журнал начинает писаться только после того, как окно решило судьбу журнала прошлого запуска
+        self.active = False
+        self.dirty: set[tuple[object, int, int]] = set()
+        self.layers_dirty = False
+        self.ids: dict[object, int] = {}
+        self.next_id = 0
+
+        # эти поля трогает только поток записи
+        self.records = 0
+        self.keys: set[tuple[int, int, int]] = set()
+        self.error: str = None
+
+        # поток записи запускается с первой записью, до первого кадра окна он не нужен
+        self.executor: "ThreadPoolExecutor" = None
+
+    def exists(self) -> bool:
+        """Остался ли журнал от прошлого запуска, который завершился сбоем"""
+        return self.enabled and os.path.isfile(self.path) and os.path.getsize(self.path) > len(MAGIC)
+
+    def layer_id(self, layer) -> int:
+        if layer not in self.ids:
+            self.ids[layer] = self.next_id
+            self.next_id += 1
+
+        return self.ids[layer]
+
+    def layers_record(self, layers) -> bytes:
+        return pack_json(LAYR, layers_data(layers, self.layer_id))
+
+    def reset(self, base: dict, layers=None, tile_size: int = None, mirrors: dict = None):
+        """Начинает журнал заново с изображения base. layers - стек слоев или None для плиточного хранилища,
+        tile_size - размер плиток журнала (у плиточного хранилища он должен совпадать с его плитками).
+        mirrors - копии слоев истории: если заданы, в журнал пишется снимок всех их плиток. Поток записи читает
+        плитки прямо из копий, правки, сделанные тем временем, отмечены и будут дописаны после снимка"""
+        if not self.active:
+            return
+
+        self.dirty.clear()
+        self.ids = {}
+        self.next_id = 0
+        self.layers_dirty = False
+        self.tile_size = tile_size or self.default_tile_size
+
+        records = [pack_json(BASE, {**base, "tile_size": self.tile_size})]
+
+        if layers is not None:
+            records.append(self.layers_record(layers))
+
+        sources = []
+
+        for layer, mirror in (mirrors or {}).items():
+            if layers is None or layer in layers.layers:
+                sources.append((self.layer_id(layer), mirror))
+
+        self.submit(self.start, records, sources)
+
+    def mark(self, layer, rect: QRect):
+        """Отмечает плитки слоя, которые задел прямоугольник (в координатах изображения)"""
+        if not self.active or rect.isEmpty():
+            return
+
+        size = self.tile_size
+
+        for ty in range(max(rect.top(), 0) // size, rect.bottom() // size + 1):
+            for tx in range(max(rect.left(), 0) // size, rect.right() // size + 1):
+                self.dirty.add((layer, tx, ty))
+
+    def mark_layers(self):
+        if self.active:
+            self.layers_dirty = True
+
+    def checkpoint(self, mirrors: dict, layers=None):
+        """Копирует отмеченные плитки из копий слоев истории и отдает их потоку записи.
+        Плитки удаленных слоев пропускаются"""
+        if not self.active or not (self.dirty or self.layers_dirty):
+            return
+
+        records = []
+        tiles = []
+
+        if self.layers_dirty and layers is not None:
+            records.append(self.layers_record(layers))
+
+        for layer, tx, ty in sorted(self.dirty, key=lambda key: (self.layer_id(key[0]), key[2], key[1])):
+            mirror = mirrors.get(layer)
+
+            if mirror is None:
+                continue
+
+            h, w = mirror.shape
+            x, y = tx * self.tile_size, ty * self.tile_size
+
+            if x < w and y < h:
+                ys, xs = slice(y, min(y + self.tile_size, h)), slice(x, min(x + self.tile_size, w))
+                tiles.append((self.layer_id(layer), x, y, np.array(mirror[ys, xs])))
+
+        self.dirty.clear()
+        self.layers_dirty = False
+
+        self.submit(self.append, records, tiles)
+
+    def submit(self, function, *args):
+        if self.executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+
+            self.executor = ThreadPoolExecutor(1, thread_name_prefix="autosave")
+
+        self.executor.submit(self.guarded, function, *args)
+
+    def guarded(self, function, *args):
+        """Ошибка записи (например, нет места) не должна мешать рисованию, она запоминается для окна"""
+        try:
+            function(*args)
+        except OSError as error:
+            self.error = str(error)
+        else:
+            self.error = None
+
+    def sync(self, file):
+        file.flush()
+        os.fsync(file.fileno())
+
+    def start(self, records: list[bytes], sources: list[tuple[int, object]] = ()):
+        """Пишет новый журнал из записей records и всех плиток копий слоев sources (номер слоя, копия)"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = self.path + ".tmp"
+        keys = set()
+
+        with open(temp_path, "wb") as file:
+            file.write(MAGIC)
+            file.writelines(records)
+
+            for layer_id, mirror in sources:
+                for x, y, pixels in mirror_tiles(mirror, self.tile_size):
+                    file.write(pack_tile(layer_id, x, y, pixels, self.level))
+                    keys.add((layer_id, x, y))
+
+            self.sync(file)
+
+        os.replace(temp_path, self.path)
+
+        self.records = len(keys)
+        self.keys = keys
+
+    def append(self, records: list[bytes], tiles: list[tuple[int, int, int, np.ndarray]]):
+        """Сжимает плитки и дописывает записи в конец журнала"""
+        records = records + [pack_tile(*tile, self.level) for tile in tiles]
+
+        with open(self.path, "ab") as file:
+            file.writelines(records)
+            self.sync(file)
+
+        self.records += len(tiles)
+        self.keys.update(tile[:3] for tile in tiles)
+
+        if self.records >= self.compact_records and self.records > self.compact_ratio * len(self.keys):
+            self.compact()
+
+    def compact(self):
+        """Переписывает журнал, оставляя последнюю версию каждой плитки. Данные плиток не пересжимаются"""
+        base = None
+        layers = None
+        tiles: dict[tuple[int, int, int], bytes] = {}
+
+        for kind, payload in read_journal(self.path):
+            if kind == BASE:
+                base = payload
+            elif kind == LAYR:
+                layers = payload
+            elif kind == TILE_RECORD:
+                tiles[TILE.unpack_from(payload)[:3]] = payload
+
+        if base is None:
+            return
+
+        records = [pack_record(BASE, base)]
+
+        if layers is not None:
+            records.append(pack_record(LAYR, layers))
+            alive = {layer["id"] for layer in json.loads(layers)["layers"]}
+            tiles = {key: payload for key, payload in tiles.items() if key[0] in alive}
+
+        records.extend(pack_record(TILE_RECORD, payload) for payload in tiles.values())
+
+        self.start(records)
+
+        self.records = len(tiles)
+        self.keys = set(tiles)
+
+    def wait(self):
+        """Дожидается, пока поток запишет все отданные ему записи"""
+        if self.executor is not None:
+            self.executor.submit(lambda: None).result()
+
+    def close(self, remove: bool = True):
+        """При обычном выходе журнал удаляется: восстанавливать нечего"""
+        self.active = False
+
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+        if remove:
+            self.discard()
+
+    def set_aside(self) -> str:
+        """Переименовывает журнал, который не удалось восстановить, чтобы новый журнал его не затер.
+        Возвращает новый путь"""
+        path = f"{os.path.splitext(self.path)[0]}-{time.strftime('%Y%m%d-%H%M%S')}.bin"
+        os.replace(self.path, path)
+
+        return path
+
+    def discard(self):
+        for path in (self.path, self.path + ".tmp"):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,778 @@
+import os
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt6 import QtWidgets
+from PyQt6.QtGui import QImage, QColor, QMouseEvent, QPainter, QPen
+from PyQt6.QtCore import Qt, QPoint, QPointF, QRect, QEvent
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import drawing
+import fileio
+import floodfill
+import imagebuffer
+from regions import RegionCache
+from filters import FilterEngine, make_filter
+from vector import VectorLayer, SHAPE_KINDS
+from quantize import quantize
+from settings import Settings, VectorSettings, ExportSettings, FilterSettings
+from tiles import TiledImage
+
+"""Это набор замеров скорости инструментов и холста
+python benchmark.py [--suite tools canvas input vector export filters startup] [--sizes 600x400 1820x1820 2560x2560] [--save-baseline base.json]
+python benchmark.py --baseline base.json
+python benchmark.py --suite startup --launches 20 --startup-budget 250
+
+Набор tools вызывает методы инструментов напрямую на QImage, набор canvas отправляет события мыши в Canvas
+и после каждого разбирает очередь событий, поэтому в замер попадают и склейка движений, и перерисовки
+(изображения больше порога идут по плиточному пути).
+Каждый инструмент проходит синтетические траектории мыши, заливка дополнительно меряется на областях разной формы:
+сплошной, лабиринте и шахматной доске в один пиксель (при 8-связности это худший случай для заливки отрезками).
+Набор input присылает движения кисти в реальном времени с частотой 125-1000 в секунду и меряет задержку
+от события до кадра, который его показал, с ритмом кадров (frames.py) и без него.
+Набор vector меряет векторный слой со 100 тысячами фигур: добавление фигуры, поиск фигуры под курсором
+и сдвиг фигуры с растеризацией только измененного прямоугольника.
+Набор export меряет построение палитры (quantize.py) и сохранение в PNG, PNG с палитрой, GIF и JPEG
+на сплошной заливке с лабиринтом (мало цветов, палитра без потерь) и на рисунке из сглаженных линий (много цветов).
+Набор filters прогоняет каждый фильтр (filters.py) по всему рисунку в одном потоке и во всех, отношение их медиан -
+ускорение на этой машине, и размывает круглое выделение посреди рисунка.
+Набор startup запускает редактор в новых процессах и меряет холодный старт по этапам: запуск интерпретатора,
+импорт PyQt и создание приложения, импорт main, создание окна, показ до первого кадра холста и все вместе.
+Если медиана полного времени больше --startup-budget миллисекунд, программа завершается с кодом 1, а если
+до первого кадра загрузился модуль, который нужен только командам меню (DEFERRED_MODULES), замер прерывается.
+Случаи fill_repeat заливают подряд разные точки одного изображения: plain - обходом, cached - по карте связных
+областей, которая после каждой заливки размечается заново только в измененных плитках.
+
+Для каждого случая печатаются перцентили задержки одного события и пик памяти. Память меряется отдельным проходом
+через tracemalloc (он замедляет код и учитывает только выделения Python и NumPy, но не буферы Qt).
+Результаты можно сохранить как базовые и сравнивать с ними следующие запуски: случай, который стал медленнее
+или тяжелее больше чем на --threshold, помечается как регрессия, и программа завершается с кодом 1"""
+
+SIZES = ((600, 400), (1820, 1820), (2560, 2560))
+TRACES = ("line", "zigzag", "scribble")
+SHAPES = ("solid", "maze", "checkerboard")
+# число фигур на векторном слое в наборе vector
+SHAPE_COUNT = 100_000
+# частоты опроса мыши и планшета в наборе input
+INPUT_RATES = (125, 500, 1000)
+
+# цель для времени от запуска процесса до первого кадра холста, в миллисекундах
+STARTUP_BUDGET = 250
+STARTUP_PHASES = ("python", "qt", "import", "window", "show", "total")
+# модули команд меню, которые main импортирует при первой команде: до первого кадра их быть не должно
+DEFERRED_MODULES = ("fileio", "filters", "collab", "asyncio", "QtNetwork", "cProfile", "pstats")
+
+# процесс набора startup: окно закрывается сразу после первого кадра, журнал автосохранения пишется во временную
+# папку, иначе журнал прошлого запуска остановил бы замер вопросом о восстановлении
+STARTUP_SCRIPT = """
+import time
+start = time.time()
+import json, os, sys, tempfile
+sys.path.insert(0, os.getcwd())
+from PyQt6 import QtWidgets
+application = QtWidgets.QApplication(sys.argv[:1])
+qt = time.time()
+with tempfile.TemporaryDirectory() as directory:
+    import settings
+    settings.AutosaveSettings.directory = directory
+    import main
+    imported = time.time()
+    window = main.Window()
+    built = time.time()
+    paint = window.canvas.view.paintEvent
+
+    def first_frame(event):
+        paint(event)
+        window.canvas.view.paintEvent = paint
+        print(json.dumps({"start": start, "qt": qt, "import": imported, "window": built, "show": time.time(),
+                          "modules": [name.rpartition(".")[2] for name in sys.modules]}))
+        application.quit()
+
+    window.canvas.view.paintEvent = first_frame
+    window.show()
+    application.exec()
+    window.canvas.journal.close()
+"""
+
+# разница меньше этой (в миллисекундах) считается шумом, а не регрессией
+NOISE = 0.05
+
+
+def tool_classes() -> list[type]:
+    """Все конечные наследники BaseTool, промежуточные классы вроде Figure пропускаются"""
+    classes = []
+    stack = list(drawing.BaseTool.__subclasses__())
+
+    while stack:
+        tool_class = stack.pop(0)
+        subclasses = tool_class.__subclasses__()
+
+        if subclasses:
+            stack.extend(subclasses)
+        else:
+            classes.append(tool_class)
+
+    return classes
+
+
+def make_trace(name: str, width: int, height: int, count: int) -> list[QPoint]:
+    """Синтетическая траектория мыши из count точек внутри прямоугольника width x height"""
+    t = np.linspace(0, 1, count)
+    margin = 10
+    w, h = width - 2 * margin, height - 2 * margin
+
+    if name == "line":
+        xs, ys = t * w, t * h
+    elif name == "zigzag":
+        xs, ys = t * w, np.abs((t * 8) % 2 - 1) * h
+    else:
+        rng = np.random.default_rng(0)
+        steps = rng.normal(0, 12, (count, 2)).cumsum(axis=0)
+        xs = np.abs((steps[:, 0] + w / 2) % (2 * w) - w)
+        ys = np.abs((steps[:, 1] + h / 2) % (2 * h) - h)
+
+    return [QPoint(int(x) + margin, int(y) + margin) for x, y in zip(xs, ys)]
+
+
+def make_shape(name: str, width: int, height: int) -> tuple[QImage, QPoint]:
+    """Изображение с областью для заливки и точка, с которой ее заливать"""
+    image = QImage(width, height, QImage.Format.Format_RGB32)
+    pixels = imagebuffer.pixel_array(image)
+    white, black = 0xffffffff, 0xff000000
+
+    if name == "solid":
+        pixels[:] = white
+    elif name == "checkerboard":
+        ys, xs = np.indices((height, width))
+        pixels[:] = np.where((xs + ys) & 1, black, white)
+    else:
+        # лабиринт "двоичное дерево": каждая клетка соединяется с верхней или левой соседкой,
+        # получается связный лабиринт без циклов, который строится без цикла по клеткам
+        rows, cols = (height - 1) // 2, (width - 1) // 2
+        up = np.random.default_rng(0).integers(2, size=(rows, cols)).astype(bool)
+        up[0, :] = False
+        up[:, 0] = True
+        up[0, 0] = False
+
+        pixels[:] = black
+        pixels[1:2 * rows:2, 1:2 * cols:2] = white
+        pixels[0:2 * rows:2, 1:2 * cols:2][up] = white
+        left = ~up
+        left[:, 0] = False
+        pixels[1:2 * rows:2, 0:2 * cols:2][left] = white
+
+    return image, QPoint(1, 1)
+
+
+def stats(times: list[float], peak: int) -> dict:
+    ms = np.array(times) * 1000
+
+    return {
+        "events": len(times),
+        "p50": float(np.percentile(ms, 50)),
+        "p95": float(np.percentile(ms, 95)),
+        "p99": float(np.percentile(ms, 99)),
+        "max": float(ms.max()),
+        "peak_mb": peak / 2 ** 20,
+    }
+
+
+def measure(run, repeat: int, memory: bool = True) -> dict:
+    """run(repeat) возвращает время каждого события в секундах. Второй проход нужен только для пика памяти,
+    под tracemalloc код на Python работает в разы медленнее, поэтому в нем случай выполняется один раз"""
+    times = run(repeat)
+    peak = 0
+
+    if memory:
+        tracemalloc.start()
+        run(1)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return stats(times, peak)
+
+
+def run_tool(tool_class: type, image: QImage, points: list[QPoint]) -> list[float]:
+    """Проводит инструментом по точкам так же, как это делает холст, и меряет каждое событие"""
+    image = image.copy()
+    overlay = QImage(image.size(), QImage.Format.Format_ARGB32_Premultiplied)
+    overlay.fill(Qt.GlobalColor.transparent)
+
+    tool: drawing.BaseTool = tool_class(Settings())
+    tool.overlay = overlay
+    tool.set_seed(0)
+
+    times = []
+    clock = time.perf_counter
+
+    def target(result) -> QImage:
+        result = drawing.edit_result(tool, result)
+
+        return image if result.preview else result.surface
+
+    start = clock()
+    tool.begin_stroke(image)
+    image = target(tool.mouse_press_event(image, points[0]))
+    times.append(clock() - start)
+
+    last_point = points[0]
+
+    for point in points[1:-1]:
+        start = clock()
+        image = target(tool.mouse_move_points(image, last_point, [point]))
+
+        if tool.emission_rate:
+            image = target(tool.mouse_hold_event(image, point))
+
+        times.append(clock() - start)
+        last_point = point
+
+    start = clock()
+    image = target(tool.mouse_release_event(image, points[-1]))
+    tool.end_stroke()
+    times.append(clock() - start)
+
+    return times
+
+
+def run_repeated_fill(image: QImage, count: int, cached: bool) -> list[float]:
+    """Заливает count случайных точек по очереди двумя цветами, как это делает холст"""
+    image = image.copy()
+    points = np.random.default_rng(0).integers(0, (image.width(), image.height()), (count, 2))
+
+    tool = drawing.Fill(Settings())
+    tool.connectivity = 8
+    tool.regions = RegionCache(Settings().fill) if cached else None
+
+    times = []
+
+    for i, (x, y) in enumerate(points):
+        tool.color = QColor("#ff0000" if i % 2 else "#0000ff")
+
+        start = time.perf_counter()
+        result = tool.mouse_press_event(image, QPoint(int(x), int(y)))
+
+        if cached:
+            tool.regions.invalidate(result.dirty())
+
+        times.append(time.perf_counter() - start)
+
+    return times
+
+
+def make_vector_layer(width: int, height: int, count: int) -> tuple[VectorLayer, list[float]]:
+    """Векторный слой со случайными фигурами размером до 80 пикселей и время добавления каждой"""
+    rng = np.random.default_rng(0)
+    layer = VectorLayer(QRect(0, 0, width, height), VectorSettings())
+    starts = rng.integers(0, (width, height), (count, 2))
+    ends = starts + rng.integers(-80, 81, (count, 2))
+    widths = rng.integers(1, 6, count)
+    color = QColor("#000000")
+    times = []
+
+    for i in range(count):
+        start = time.perf_counter()
+        layer.add(SHAPE_KINDS[i % 3], QPoint(*starts[i].tolist()), QPoint(*ends[i].tolist()), color, int(widths[i]))
+        times.append(time.perf_counter() - start)
+
+    layer.take_edit()
+
+    return layer, times
+
+
+def run_vector(layer: VectorLayer, image: QImage, case: str, count: int) -> list[float]:
+    """hit - поиск фигуры под курсором, move - сдвиг случайной фигуры и растеризация измененного прямоугольника"""
+    rng = np.random.default_rng(1)
+    points = rng.integers(0, (image.width(), image.height()), (count, 2))
+    ids = rng.integers(0, len(layer), count)
+    times = []
+
+    for (x, y), shape_id in zip(points.tolist(), ids.tolist()):
+        start = time.perf_counter()
+
+        if case == "hit":
+            layer.shape_at(QPoint(x, y))
+        else:
+            layer.render(image, layer.move(layer.shapes[shape_id], 3, -2))
+
+        times.append(time.perf_counter() - start)
+
+    layer.take_edit()
+
+    return times
+
+
+def vector_suite(sizes, count: int):
+    for width, height in sizes:
+        yield f"vector/insert/{width}x{height}/{SHAPE_COUNT}", \
+            lambda repeat, width=width, height=height: make_vector_layer(width, height, SHAPE_COUNT)[1]
+
+        layer, _ = make_vector_layer(width, height, SHAPE_COUNT)
+        image = QImage(width, height, QImage.Format.Format_ARGB32)
+        layer.render(image, image.rect())
+
+        for case in ("hit", "move"):
+            yield f"vector/{case}/{width}x{height}/{SHAPE_COUNT}", \
+                lambda repeat, layer=layer, image=image, case=case: run_vector(layer, image, case, count)
+
+
+def make_drawing(width: int, height: int) -> QImage:
+    """Рисунок из сглаженных линий разных цветов и толщины: на краях линий тысячи промежуточных цветов"""
+    image = QImage(width, height, QImage.Format.Format_RGB32)
+    image.fill(Qt.GlobalColor.white)
+    rng = np.random.default_rng(0)
+
+    painter = QPainter(image)
+    painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+
+    for _ in range(300):
+        painter.setPen(QPen(QColor(*rng.integers(0, 256, 3).tolist()), int(rng.integers(1, 20))))
+        painter.drawLine(QPoint(*rng.integers(0, (width, height)).tolist()),
+                         QPoint(*rng.integers(0, (width, height)).tolist()))
+
+    painter.end()
+
+    return image
+
+
+def export_suite(sizes):
+    """quantize - только построение палитры, остальные случаи - сохранение файла целиком"""
+    settings = ExportSettings()
+    directory = tempfile.mkdtemp()
+
+    for width, height in sizes:
+        images = {"maze": make_shape("maze", width, height)[0], "drawing": make_drawing(width, height)}
+
+        for name, image in images.items():
+            def run(repeat, image=image):
+                times = []
+
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    quantize(imagebuffer.pixel_array(image, readonly=True), settings, image.hasAlphaChannel())
+                    times.append(time.perf_counter() - start)
+
+                return times
+
+            yield f"export/quantize/{width}x{height}/{name}", run
+
+        for case, extension, indexed in (("png", ".png", False), ("png8", ".png", True),
+                                         ("gif", ".gif", True), ("jpg", ".jpg", False)):
+            def run(repeat, extension=extension, indexed=indexed, image=images["drawing"]):
+                path = os.path.join(directory, "export" + extension)
+
+                return [fileio.write_image(image, path, settings=settings, indexed=indexed).seconds
+                        for _ in range(repeat)]
+
+            yield f"export/{case}/{width}x{height}/drawing", run
+
+
+def filters_suite(sizes):
+    """Каждый фильтр на всем изображении в одном потоке и во всех (t1 и tN, N - число ядер), чтобы видеть,
+    как он масштабируется по ядрам, и размытие небольшого выделения посреди изображения"""
+    threads = os.cpu_count() or 1
+    cases = (("blur", {"radius": 8}), ("sharpen", {}), ("brightness_contrast", {"brightness": 10, "contrast": 20}),
+             ("grayscale", {}), ("invert", {}))
+
+    for width, height in sizes:
+        source = imagebuffer.pixel_array(make_drawing(width, height), readonly=True)
+
+        for name, params in cases:
+            for count in sorted({1, threads}):
+                engine = FilterEngine(FilterSettings(threads=count))
+
+                def run(repeat, engine=engine, name=name, params=params):
+                    times = []
+
+                    for _ in range(repeat):
+                        pixels = source.copy()
+                        start = time.perf_counter()
+                        engine.run(make_filter(name, **params), pixels)
+                        times.append(time.perf_counter() - start)
+
+                    return times
+
+                yield f"filters/{name}/t{count}/{width}x{height}", run
+
+        # круг диаметром 200 пикселей: цена должна зависеть от выделения, а не от размера изображения
+        side = min(200, width, height)
+        y, x = np.ogrid[:side, :side]
+        mask = (y - side / 2) ** 2 + (x - side / 2) ** 2 < (side / 2) ** 2
+        top, left = (height - side) // 2, (width - side) // 2
+        engine = FilterEngine(FilterSettings())
+
+        def run(repeat, engine=engine, mask=mask, box=(top, top + side, left, left + side)):
+            times = []
+
+            for _ in range(repeat):
+                pixels = source.copy()
+                start = time.perf_counter()
+                engine.run(make_filter("blur", radius=8), pixels, mask, box)
+                times.append(time.perf_counter() - start)
+
+            return times
+
+        yield f"filters/blur_selection/{side}px/{width}x{height}", run
+
+
+def tools_suite(sizes, traces, count: int):
+    for width, height in sizes:
+        blank, _ = make_shape("solid", width, height)
+
+        for tool_class in tool_classes():
+            for trace in traces:
+                points = make_trace(trace, width, height, count)
+
+                yield f"tools/{tool_class.__name__}/{width}x{height}/{trace}", \
+                    lambda repeat, tool_class=tool_class, points=points: run_tool(tool_class, blank, points)
+
+        for shape in SHAPES:
+            image, seed = make_shape(shape, width, height)
+
+            def fill_runs(repeat, image=image, seed=seed):
+                times = []
+
+                for _ in range(repeat):
+                    target = image.copy()
+                    start = time.perf_counter()
+                    floodfill.flood_fill(target, seed.x(), seed.y(), QColor("#ff0000"), 0, 8)
+                    times.append(time.perf_counter() - start)
+
+                return times
+
+            yield f"tools/fill/{width}x{height}/{shape}", fill_runs
+
+            for cached in (False, True):
+                yield f"tools/fill_repeat/{'cached' if cached else 'plain'}/{width}x{height}/{shape}", \
+                    lambda repeat, image=image, cached=cached: run_repeated_fill(image, repeat * 10, cached)
+
+
+class CanvasDriver:
+    """Отправляет события мыши в холст и ждет, пока он их обработает и перерисуется"""
+
+    def __init__(self, application: QtWidgets.QApplication, frame_rate: float = None):
+        import main
+
+        self.application = application
+        self.canvas = main.Canvas()
+        self.canvas.resize(1000, 700)
+        self.canvas.show()
+        self.set_frame_rate(frame_rate)
+        self.application.processEvents()
+
+    def set_frame_rate(self, frame_rate: float):
+        """None - каждое событие обрабатывается и рисуется сразу, 0 - ритм кадров экрана, как в программе"""
+        self.canvas.input_frames.set_rate(frame_rate)
+        self.canvas.view.frames.set_rate(frame_rate)
+
+    def send(self, kind: QEvent.Type, point: QPoint, buttons: Qt.MouseButton) -> float:
+        viewport = self.canvas.viewport()
+        position = QPointF(point)
+        event = QMouseEvent(kind, position, QPointF(viewport.mapToGlobal(point)), Qt.MouseButton.LeftButton,
+                            buttons, Qt.KeyboardModifier.NoModifier)
+
+        start = time.perf_counter()
+        self.application.sendEvent(viewport, event)
+        self.application.processEvents()
+
+        return time.perf_counter() - start
+
+    def stroke(self, points: list[QPoint]) -> list[float]:
+        left, none = Qt.MouseButton.LeftButton, Qt.MouseButton.NoButton
+
+        times = [self.send(QEvent.Type.MouseButtonPress, points[0], left)]
+        times += [self.send(QEvent.Type.MouseMove, point, left) for point in points[1:-1]]
+        times.append(self.send(QEvent.Type.MouseButtonRelease, points[-1], none))
+
+        return times
+
+    def paced_stroke(self, points: list[QPoint], rate: int) -> list[float]:
+        """Присылает движения мыши с частотой rate в секунду по часам, не дожидаясь, пока холст их обработает,
+        как это делает мышь. Возвращает для каждого движения время от того момента, когда оно должно было прийти,
+        до конца кадра, который его показал: если холст не успевает, задержка копится"""
+        canvas, view = self.canvas, self.canvas.view
+        left = Qt.MouseButton.LeftButton
+        viewport = canvas.viewport()
+
+        flushes = []
+        paints = []
+        flush_points = canvas.input_frames.callback
+        paint_event = view.paintEvent
+
+        def counted_flush():
+            flush_points()
+            flushes.append(time.perf_counter())
+
+        def counted_paint(event):
+            paint_event(event)
+            paints.append((time.perf_counter(), len(flushes)))
+
+        canvas.input_frames.callback = counted_flush
+        view.paintEvent = counted_paint
+
+        def send(kind, point, buttons):
+            self.application.sendEvent(viewport, QMouseEvent(
+                kind, QPointF(point), QPointF(viewport.mapToGlobal(point)), left, buttons,
+                Qt.KeyboardModifier.NoModifier))
+
+        try:
+            send(QEvent.Type.MouseButtonPress, points[0], left)
+            self.application.processEvents()
+
+            arrivals = []
+            start = time.perf_counter()
+
+            for index, point in enumerate(points[1:-1]):
+                due = start + index / rate
+
+                while time.perf_counter() < due:
+                    self.application.processEvents()
+
+                send(QEvent.Type.MouseMove, point, left)
+                arrivals.append((due, len(flushes)))
+
+            # даем показать последние точки до отпускания кнопки
+            end = time.perf_counter() + 0.1
+            while time.perf_counter() < end:
+                self.application.processEvents()
+
+            send(QEvent.Type.MouseButtonRelease, points[-1], Qt.MouseButton.NoButton)
+            self.application.processEvents()
+        finally:
+            canvas.input_frames.callback = flush_points
+            del view.paintEvent
+
+        times = []
+        for due, flushed in arrivals:
+            shown = next((moment for moment, count in paints if count > flushed), None)
+
+            if shown is not None:
+                times.append(shown - due)
+
+        return times
+
+    def load(self, image: QImage):
+        if image.width() * image.height() > self.canvas.settings.tiles.threshold:
+            store = TiledImage(image.width(), image.height(), self.canvas.settings.tiles)
+            store.write(QPoint(), image)
+            self.canvas.set_opened(store)
+        else:
+            self.canvas.set_opened(image.copy())
+
+        self.application.processEvents()
+
+    def visible_size(self) -> tuple[int, int]:
+        viewport = self.canvas.viewport()
+
+        return min(viewport.width(), self.canvas.img_width), min(viewport.height(), self.canvas.img_height)
+
+
+def canvas_suite(application, sizes, traces, count: int):
+    driver = CanvasDriver(application)
+
+    for width, height in sizes:
+        blank, _ = make_shape("solid", width, height)
+
+        for tool_class in tool_classes():
+            driver.canvas.update_tool(tool_class)
+
+            for trace in traces:
+                def run(repeat, trace=trace):
+                    driver.load(blank)
+                    points = make_trace(trace, *driver.visible_size(), count)
+
+                    return driver.stroke(points)
+
+                yield f"canvas/{tool_class.__name__}/{width}x{height}/{trace}", run
+
+        driver.canvas.update_tool(drawing.Fill)
+        driver.canvas.tool.connectivity = 8
+
+        for shape in SHAPES:
+            image, seed = make_shape(shape, width, height)
+
+            def fill_runs(repeat, image=image, seed=seed):
+                times = []
+
+                for _ in range(repeat):
+                    driver.load(image)
+                    times += driver.stroke([seed, seed])
+
+                return times
+
+            yield f"canvas/fill/{width}x{height}/{shape}", fill_runs
+
+
+def input_suite(application, traces, count: int):
+    """Кисть при разной частоте мыши: paced - с ритмом кадров, unpaced - каждое событие обрабатывается сразу"""
+    driver = CanvasDriver(application)
+    blank, _ = make_shape("solid", *driver.visible_size())
+    driver.canvas.update_tool(drawing.Brush)
+
+    for mode, frame_rate in (("paced", 0), ("unpaced", None)):
+        for rate in INPUT_RATES:
+            for trace in traces:
+                def run(repeat, trace=trace, rate=rate, frame_rate=frame_rate):
+                    driver.set_frame_rate(frame_rate)
+                    driver.load(blank)
+
+                    return driver.paced_stroke(make_trace(trace, *driver.visible_size(), count), rate)
+
+                yield f"input/{mode}/{rate}hz/{trace}", run
+
+
+def launch_editor() -> dict[str, float]:
+    """Запускает редактор в новом процессе и возвращает длительность этапов старта в секундах"""
+    spawned = time.time()
+    output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    marks = json.loads(output.strip().splitlines()[-1])
+    early = [name for name in DEFERRED_MODULES if name in marks["modules"]]
+
+    if early:
+        raise RuntimeError(f"до первого кадра загружены модули команд меню: {', '.join(early)}")
+
+    return {
+        "python": marks["start"] - spawned,
+        "qt": marks["qt"] - marks["start"],
+        "import": marks["import"] - marks["qt"],
+        "window": marks["window"] - marks["import"],
+        "show": marks["show"] - marks["window"],
+        "total": marks["show"] - spawned,
+    }
+
+
+def startup_suite(launches: int):
+    """Все этапы берутся из одних и тех же запусков, поэтому процессы запускаются один раз, при первом случае"""
+    runs = []
+
+    for phase in STARTUP_PHASES:
+        def run(repeat, phase=phase):
+            if not runs:
+                runs.extend(launch_editor() for _ in range(launches))
+
+            return [launch[phase] for launch in runs]
+
+        yield f"startup/{phase}", run
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> dict[str, list[str]]:
+    """Возвращает для каждого случая список показателей, которые ухудшились по сравнению с базовыми"""
+    regressions = {}
+
+    for name, result in results.items():
+        base = baseline.get(name)
+
+        if base is None:
+            continue
+
+        flags = [key for key in ("p50", "p95")
+                 if result[key] > base[key] * (1 + threshold) and result[key] - base[key] > NOISE]
+
+        # пик 0 значит, что память в этом запуске не мерили
+        if result["peak_mb"] and base["peak_mb"] and result["peak_mb"] > base["peak_mb"] * (1 + threshold) and result["peak_mb"] - base["peak_mb"] > 1:
+            flags.append("memory")
+
+        if flags:
+            regressions[name] = flags
+
+    return regressions
+
+
+def parse_size(text: str) -> tuple[int, int]:
+    width, height = text.lower().split("x")
+
+    return int(width), int(height)
+
+
+def main(arguments: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Замеры скорости инструментов и холста")
+    parser.add_argument("--suite", nargs="+",
+                        choices=("tools", "canvas", "input", "vector", "export", "filters", "startup"),
+                        default=("tools", "canvas", "input", "vector", "export", "filters", "startup"))
+    parser.add_argument("--sizes", nargs="+", type=parse_size, default=SIZES, help="размеры холста, например 600x400")
+    parser.add_argument("--traces", nargs="+", choices=TRACES, default=TRACES)
+    parser.add_argument("--events", type=int, default=200, help="число точек в траектории")
+    parser.add_argument("--repeat", type=int, default=3, help="сколько раз повторять заливку области")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="не мерить память (быстрее)")
+    parser.add_argument("--filter", default="", help="запускать только случаи, в имени которых есть эта строка")
+    parser.add_argument("--baseline", help="файл с базовыми результатами для сравнения")
+    parser.add_argument("--save-baseline", help="сохранить результаты как базовые")
+    parser.add_argument("--threshold", type=float, default=0.25, help="допустимое ухудшение, 0.25 - на 25%%")
+    parser.add_argument("--launches", type=int, default=10, help="сколько раз запускать редактор в наборе startup")
+    parser.add_argument("--startup-budget", type=float, default=STARTUP_BUDGET,
+                        help="допустимая медиана времени до первого кадра в миллисекундах")
+    arguments = parser.parse_args(arguments)
+
+    application = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv[:1])
+
+    cases = []
+    if "tools" in arguments.suite:
+        cases.append(tools_suite(arguments.sizes, arguments.traces, arguments.events))
+    if "canvas" in arguments.suite:
+        cases.append(canvas_suite(application, arguments.sizes, arguments.traces, arguments.events))
+    if "input" in arguments.suite:
+        cases.append(input_suite(application, arguments.traces, arguments.events))
+    if "vector" in arguments.suite:
+        cases.append(vector_suite(arguments.sizes, arguments.events))
+    if "export" in arguments.suite:
+        cases.append(export_suite(arguments.sizes))
+    if "filters" in arguments.suite:
+        cases.append(filters_suite(arguments.sizes))
+    if "startup" in arguments.suite:
+        cases.append(startup_suite(arguments.launches))
+
+    baseline = {}
+    if arguments.baseline:
+        with open(arguments.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+
+    results = {}
+    print(f"{'случай':<44}{'событий':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}{'память':>9}")
+
+    for suite in cases:
+        for name, run in suite:
+            if arguments.filter not in name:
+                continue
+
+            result = results[name] = measure(run, arguments.repeat, arguments.memory)
+            flags = compare({name: result}, baseline, arguments.threshold).get(name, [])
+
+            print(f"{name:<44}{result['events']:>8}{result['p50']:>9.3f}{result['p95']:>9.3f}"
+                  f"{result['p99']:>9.3f}{result['max']:>9.3f}{result['peak_mb']:>8.1f}M"
+                  + (f"  РЕГРЕССИЯ: {', '.join(flags)}" if flags else ""), flush=True)
+
+    print("время в миллисекундах на одно событие, память - пик выделений Python и NumPy")
+
+    if arguments.save_baseline:
+        with open(arguments.save_baseline, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=1)
+
+    regressions = compare(results, baseline, arguments.threshold)
+
+    if regressions:
+        print(f"регрессий: {len(regressions)}", file=sys.stderr)
+
+        return 1
+
+    startup = results.get("startup/total")
+
+    if startup is not None:
+        if startup["p50"] > arguments.startup_budget:
+            print(f"старт {startup['p50']:.0f} мс дольше бюджета {arguments.startup_budget:.0f} мс", file=sys.stderr)
+
+            return 1
+
+        print(f"старт {startup['p50']:.0f} мс при бюджете {arguments.startup_budget:.0f} мс")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+from PyQt6.QtGui import QImage, QPainter, QColor
+from PyQt6.QtCore import QPoint, QRect
+from collections import OrderedDict
+import math
+import numpy as np
+import imagebuffer
+
+"""Это модуль штампующей кисти
+Штрих рисуется не пером, а отпечатками (дабами) кончика кисти, которые ставятся вдоль пути через равные
+промежутки spacing. Остаток пути между событиями мыши переносится на следующий отрезок, поэтому шаг не зависит
+от того, как часто приходят события. Кончик - заранее растеризованная картинка с мягким сглаженным краем:
+при жесткости 1 край размыт на один пиксель, при меньшей жесткости - на долю радиуса.
+
+Кончики хранятся в общем кэше с вытеснением давно не используемых (LRU) по ключу (ширина, жесткость, цвет),
+так что один отпечаток стоит одного переноса картинки, а ширина кисти влияет только на размер этой картинки"""
+
+
+def render_tip(width: int, hardness: float, color: QColor) -> QImage:
+    """Кончик кисти в формате с умноженной альфой: круг диаметром width, край которого плавно уходит в прозрачность"""
+    radius = width / 2
+    size = math.ceil(width) + 2
+
+    center = (size - 1) / 2
+    axis = np.arange(size, dtype=np.float32) - center
+    distance = np.sqrt(axis[:, None] ** 2 + axis[None, :] ** 2)
+
+    falloff = max(radius * (1 - hardness), 1.0)
+    coverage = np.clip((radius + 0.5 - distance) / falloff, 0, 1)
+    coverage = coverage * coverage * (3 - 2 * coverage)
+
+    alpha = coverage * color.alphaF()
+    channels = np.empty((size, size, 4), np.float32)
+    channels[:, :, 0] = color.blue()
+    channels[:, :, 1] = color.green()
+    channels[:, :, 2] = color.red()
+    channels[:, :, :3] *= alpha[:, :, None]
+    channels[:, :, 3] = alpha * 255
+
+    tip = QImage(size, size, QImage.Format.Format_ARGB32_Premultiplied)
+    imagebuffer.pixel_array(tip)[...] = (channels + 0.5).astype(np.uint8).view(np.uint32).reshape(size, size)
+
+    return tip
+
+
+class TipCache:
+    def __init__(self, size: int = 64):
+        self.size = size
+        self.tips: OrderedDict[tuple[int, float, int], QImage] = OrderedDict()
+
+    def get(self, width: int, hardness: float, color: QColor) -> QImage:
+        key = (width, hardness, color.rgba())
+        tip = self.tips.get(key)
+
+        if tip is not None:
+            self.tips.move_to_end(key)
+
+            return tip
+
+        tip = self.tips[key] = render_tip(width, hardness, color)
+
+        while len(self.tips) > self.size:
+            self.tips.popitem(last=False)
+
+        return tip
+
+
+tip_cache = TipCache()
+
+
+class Stamper:
+    """Ставит отпечатки кончика вдоль ломаной. Состояние штриха - последняя точка пути и путь, пройденный
+    с последнего отпечатка"""
+
+    def __init__(self, tip: QImage, spacing: float):
+        self.tip = tip
+        self.spacing = spacing
+        self.offset = (tip.width() - 1) / 2
+        self.last: tuple[float, float] = None
+        self.travelled = 0.0
+
+    def dabs(self, painter: QPainter, xs: np.ndarray, ys: np.ndarray) -> QRect:
+        """Ставит отпечатки с центрами в точках (xs, ys) и возвращает занятый ими прямоугольник"""
+        lefts = np.floor(xs - self.offset + 0.5).astype(int)
+        tops = np.floor(ys - self.offset + 0.5).astype(int)
+
+        for left, top in zip(lefts.tolist(), tops.tolist()):
+            painter.drawImage(QPoint(left, top), self.tip)
+
+        return QRect(QPoint(int(lefts.min()), int(tops.min())),
+                     QPoint(int(lefts.max()) + self.tip.width() - 1, int(tops.max()) + self.tip.height() - 1))
+
+    def start(self, painter: QPainter, point: QPoint) -> QRect:
+        self.last = (point.x(), point.y())
+        self.travelled = 0.0
+
+        return self.dabs(painter, np.array([point.x()]), np.array([point.y()]))
+
+    def line_to(self, painter: QPainter, point: QPoint) -> QRect:
+        """Ставит отпечатки на отрезке от последней точки до point и возвращает занятый ими прямоугольник"""
+        x0, y0 = self.last
+        x1, y1 = point.x(), point.y()
+        length = math.hypot(x1 - x0, y1 - y0)
+        self.last = (x1, y1)
+
+        # расстояния от начала отрезка до отпечатков: первый добирает шаг, начатый на прошлом отрезке
+        positions = np.arange(self.spacing - self.travelled, length + 1e-6, self.spacing)
+
+        if not len(positions):
+            self.travelled += length
+
+            return QRect()
+
+        self.travelled = length - positions[-1]
+        t = positions / length
+
+        return self.dabs(painter, x0 + (x1 - x0) * t, y0 + (y1 - y0) * t)
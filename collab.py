@@ -0,0 +1,478 @@
+from PyQt6.QtCore import QObject, QRect, pyqtSignal
+from PyQt6.QtNetwork import QTcpSocket, QAbstractSocket
+from collections import deque
+import argparse
+import asyncio
+import json
+import struct
+import threading
+import zlib
+import numpy as np
+import autosave
+from settings import CollabSettings
+
+"""Это модуль совместной работы над одним изображением
+Клиенты подключаются по TCP к серверу-ретранслятору (python collab.py --port 8765, окно умеет запускать его у себя)
+и обмениваются теми же записями, что пишет журнал автосохранения (autosave.py):
+  BASE - размер холста, с него начинается общее изображение
+  LAYR - состав слоев и их свойства
+  TILE - сжатые пиксели плитки слоя
+После отпускания мыши, отмены или фильтра отправляются только измененные плитки размером tile_size, поэтому
+штрих кистью стоит килобайты, а не все изображение.
+
+Кадр: тип (4 байта), номер и длина данных. Сервер нумерует все записи по порядку прихода и рассылает их остальным
+клиентам, а отправителю отвечает подтверждением ACKN с номером. Каждый клиент получает каждый номер ровно один раз,
+поэтому пропуск или перестановка сразу видны. Одновременные правки одной плитки разрешаются порядком сервера:
+побеждает последняя. Пока своя плитка не подтверждена, чужие версии этой плитки, пришедшие раньше подтверждения,
+пропускаются: сервер поставил их раньше, и свою версию он все равно разошлет поверх них.
+
+Сервер держит последнюю версию каждой плитки (как сжатие журнала), и новый участник сначала получает снимок:
+BASE, LAYR и все плитки, затем SNAP с номером снимка и дальше обычные записи. Если общего холста еще нет, его
+публикует первый подключившийся. Слои обозначаются общими номерами: старшие биты - номер клиента, который создал слой.
+Векторные слои передаются пикселями, у других участников они становятся обычными слоями.
+Большие изображения в плиточном хранилище совместно не редактируются.
+
+Сервер никого не проверяет: любой, кто может к нему подключиться, может переписать общий холст. Поэтому
+по умолчанию он слушает только этот компьютер (CollabSettings.host), а для локальной сети его нужно открыть явно
+(--host 0.0.0.0 или «Начать сеанс в локальной сети»). Участник, который не успевает читать рассылку, отключается,
+когда у сервера копится больше MAX_BACKLOG неотправленных байт: при повторном подключении он получит снимок.
+Запись, которую не удалось разобрать, не получает номера и никуда не рассылается, а ее отправитель отключается"""
+
+FRAME = struct.Struct(">4sII")
+# кадры больше этого считаются испорченным потоком
+MAX_FRAME = 64 * 2 ** 20
+# столько неотправленных байт сервер держит для одного участника
+MAX_BACKLOG = 128 * 2 ** 20
+
+HELLO = b"HELO"
+SNAPSHOT = b"SNAP"
+ACK = b"ACKN"
+RECORDS = (autosave.BASE, autosave.LAYR, autosave.TILE_RECORD)
+# поля слоя в записи LAYR (autosave.layers_data)
+LAYER_FIELDS = frozenset({"id", "name", "visible", "opacity", "blend_mode"})
+# чем заканчивается разбор испорченной записи, отправитель такой записи отключается
+BAD_RECORD = (ValueError, TypeError, KeyError, struct.error, zlib.error)
+
+
+def pack_frame(kind: bytes, seq: int, payload: bytes = b"") -> bytes:
+    return FRAME.pack(kind, seq, len(payload)) + payload
+
+
+def record_key(kind: bytes, payload: bytes):
+    """Что заменяет запись: плитку слоя, состав слоев или весь холст"""
+    if kind == autosave.TILE_RECORD:
+        return autosave.TILE.unpack_from(payload)[:3]
+
+    return kind
+
+
+class FrameReader:
+    """Собирает кадры из кусков, в которых приходит поток"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data: bytes) -> list[tuple[bytes, int, bytes]]:
+        self.buffer += data
+        frames = []
+        start = 0
+
+        while len(self.buffer) - start >= FRAME.size:
+            kind, seq, length = FRAME.unpack_from(self.buffer, start)
+
+            if length > MAX_FRAME:
+                raise ValueError(f"Слишком большой кадр: {length} байт")
+
+            end = start + FRAME.size + length
+
+            if end > len(self.buffer):
+                break
+
+            frames.append((kind, seq, bytes(self.buffer[start + FRAME.size:end])))
+            start = end
+
+        del self.buffer[:start]
+
+        return frames
+
+
+class Relay:
+    """Сервер: нумерует записи, рассылает их и хранит снимок для новых участников"""
+
+    def __init__(self):
+        self.seq = 0
+        self.base: bytes = None
+        self.layers: bytes = None
+        self.tiles: dict[tuple[int, int, int], bytes] = {}
+        self.clients: set[asyncio.StreamWriter] = set()
+        self.next_client = 1
+
+    def apply(self, kind: bytes, payload: bytes):
+        """Запоминает запись для снимка. Запись сначала разбирается так же, как ее разберут клиенты:
+        испорченная поднимает исключение из BAD_RECORD и ничего не меняет"""
+        if kind == autosave.BASE:
+            base = json.loads(payload)
+
+            if not (isinstance(base["width"], int) and isinstance(base["height"], int)
+                    and base["width"] > 0 and base["height"] > 0):
+                raise ValueError("неверный размер холста")
+
+            self.base = payload
+            self.layers = None
+            self.tiles = {}
+        elif kind == autosave.LAYR:
+            data = json.loads(payload)
+
+            for layer in data["layers"]:
+                missing = LAYER_FIELDS.difference(layer)
+
+                if missing:
+                    raise KeyError(f"у слоя нет полей {sorted(missing)}")
+
+            if not isinstance(data["counter"], int):
+                raise ValueError("неверный счетчик слоев")
+
+            alive = {layer["id"] for layer in data["layers"]}
+            self.layers = payload
+            self.tiles = {key: tile for key, tile in self.tiles.items() if key[0] in alive}
+        else:
+            autosave.unpack_tile(payload)
+            self.tiles[record_key(kind, payload)] = payload
+
+    def snapshot(self) -> list[bytes]:
+        if self.base is None:
+            return []
+
+        frames = [pack_frame(autosave.BASE, self.seq, self.base)]
+
+        if self.layers is not None:
+            frames.append(pack_frame(autosave.LAYR, self.seq, self.layers))
+
+        frames.extend(pack_frame(autosave.TILE_RECORD, self.seq, tile) for tile in self.tiles.values())
+
+        return frames
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        client = self.next_client
+        self.next_client += 1
+
+        # снимок и добавление в рассылку идут без ожидания между ними, так что новый участник не пропустит записей
+        writer.write(pack_frame(HELLO, self.seq, json.dumps({"client": client}).encode("utf-8")))
+        writer.writelines(self.snapshot())
+        writer.write(pack_frame(SNAPSHOT, self.seq))
+        self.clients.add(writer)
+
+        try:
+            while True:
+                kind, _, length = FRAME.unpack(await reader.readexactly(FRAME.size))
+
+                if kind not in RECORDS or length > MAX_FRAME:
+                    break
+
+                payload = await reader.readexactly(length)
+
+                # номер получает только целая запись: пропуск номера отключил бы всех остальных участников
+                try:
+                    self.apply(kind, payload)
+                except BAD_RECORD:
+                    break
+
+                self.seq += 1
+
+                frame = pack_frame(kind, self.seq, payload)
+
+                for other in list(self.clients):
+                    if other is writer:
+                        other.write(pack_frame(ACK, self.seq))
+                        continue
+
+                    other.write(frame)
+
+                    # ждать отстающего значило бы задержать всех, поэтому его соединение обрывается
+                    if other.transport.get_write_buffer_size() > MAX_BACKLOG:
+                        self.clients.discard(other)
+                        other.transport.abort()
+
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+
+
+class RelayThread(threading.Thread):
+    """Сервер в фоновом потоке окна, чтобы начать сеанс без отдельного процесса"""
+
+    def __init__(self, host: str, port: int):
+        super().__init__(name="relay", daemon=True)
+
+        self.host = host
+        self.port = port
+        self.relay = Relay()
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        self.error: OSError = None
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+
+        try:
+            server = self.loop.run_until_complete(asyncio.start_server(self.relay.handle, self.host, self.port))
+        except OSError as error:
+            self.error = error
+            self.ready.set()
+
+            return
+
+        # порт 0 - любой свободный, окну и тестам нужен настоящий
+        self.port = server.sockets[0].getsockname()[1]
+        self.ready.set()
+        self.loop.run_forever()
+
+        # остановка: соединения закрываются, чтобы участники увидели конец сеанса, а обработчики вышли сами
+        server.close()
+
+        for writer in list(self.relay.clients):
+            writer.close()
+
+        self.loop.run_until_complete(asyncio.gather(*asyncio.all_tasks(self.loop), return_exceptions=True))
+        self.loop.close()
+
+    def serve(self):
+        """Запускает сервер и ждет, пока он начнет слушать порт. Ошибка (порт занят) поднимается здесь"""
+        self.start()
+        self.ready.wait()
+
+        if self.error is not None:
+            raise self.error
+
+    def stop(self):
+        if self.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+class Session(QObject):
+    """Клиент в окне. Холст отмечает измененные плитки (mark), а отправляет их flush"""
+    message = pyqtSignal(str)
+    # на сервере еще нет холста, его должен опубликовать этот клиент
+    empty = pyqtSignal()
+    # записи (тип, данные) по порядку сервера, которые нужно применить к холсту
+    received = pyqtSignal(list)
+    closed = pyqtSignal()
+
+    def __init__(self, settings: CollabSettings, parent: QObject = None):
+        super().__init__(parent)
+
+        self.tile_size = settings.tile_size
+        self.level = settings.compression
+
+        self.socket = QTcpSocket(self)
+        self.socket.readyRead.connect(self.read)
+        self.socket.errorOccurred.connect(self.failed)
+        self.socket.disconnected.connect(self.closed)
+
+        self.reader = FrameReader()
+        self.client: int = None
+        self.seq = 0
+        self.joining = True
+        self.snapshot: list[tuple[bytes, bytes]] = []
+
+        # общие номера слоев, этот словарь заполняет и Canvas.restore_layers
+        self.layers: dict[int, object] = {}
+        self.next_id = 0
+
+        self.dirty: set[tuple[object, int, int]] = set()
+        self.layers_dirty = False
+
+        # свои записи, которые сервер еще не подтвердил
+        self.sent: deque = deque()
+        self.pending: dict[object, int] = {}
+        self.sent_bytes = 0
+
+    def open(self, host: str, port: int):
+        self.socket.connectToHost(host, port)
+
+    def close(self):
+        self.socket.abort()
+
+    def failed(self, error: QAbstractSocket.SocketError):
+        if error != QAbstractSocket.SocketError.RemoteHostClosedError:
+            self.message.emit(f"Совместная работа: {self.socket.errorString()}")
+
+        self.socket.abort()
+        self.closed.emit()
+
+    def layer_id(self, layer) -> int:
+        for layer_id, known in self.layers.items():
+            if known is layer:
+                return layer_id
+
+        layer_id = self.client << 16 | self.next_id
+        self.next_id += 1
+        self.layers[layer_id] = layer
+
+        return layer_id
+
+    def mark(self, layer, rect: QRect):
+        """Отмечает плитки слоя, которые задел прямоугольник (в координатах изображения)"""
+        if self.joining or rect.isEmpty():
+            return
+
+        size = self.tile_size
+
+        for ty in range(max(rect.top(), 0) // size, rect.bottom() // size + 1):
+            for tx in range(max(rect.left(), 0) // size, rect.right() // size + 1):
+                self.dirty.add((layer, tx, ty))
+
+    def mark_layers(self):
+        if not self.joining:
+            self.layers_dirty = True
+
+    def send(self, kind: bytes, payload: bytes):
+        frame = pack_frame(kind, 0, payload)
+        key = record_key(kind, payload)
+
+        self.socket.write(frame)
+        self.sent.append(key)
+        self.pending[key] = self.pending.get(key, 0) + 1
+        self.sent_bytes += len(frame)
+
+    def send_layers(self, layers):
+        """Состав слоев. Слои, которых больше нет в стеке, забываются"""
+        for layer_id, layer in list(self.layers.items()):
+            if layer not in layers.layers:
+                del self.layers[layer_id]
+
+        self.send(autosave.LAYR, json.dumps(autosave.layers_data(layers, self.layer_id)).encode("utf-8"))
+
+    def send_tile(self, layer, mirror: np.ndarray, tx: int, ty: int):
+        h, w = mirror.shape
+        x, y = tx * self.tile_size, ty * self.tile_size
+
+        if x < w and y < h:
+            tile = mirror[y:min(y + self.tile_size, h), x:min(x + self.tile_size, w)]
+            self.send(autosave.TILE_RECORD, autosave.tile_payload(self.layer_id(layer), x, y, tile, self.level))
+
+    def flush(self, mirrors: dict, layers):
+        """Отправляет отмеченные плитки из копий слоев истории (в них последнее зафиксированное состояние)"""
+        if self.joining or not (self.dirty or self.layers_dirty):
+            return
+
+        if self.layers_dirty:
+            self.send_layers(layers)
+
+        for layer, tx, ty in sorted(self.dirty, key=lambda key: (self.layer_id(key[0]), key[2], key[1])):
+            mirror = mirrors.get(layer)
+
+            if mirror is not None:
+                self.send_tile(layer, mirror, tx, ty)
+
+        self.dirty.clear()
+        self.layers_dirty = False
+
+    def publish(self, width: int, height: int, mirrors: dict, layers):
+        """Делает общим весь холст: BASE, состав слоев и все плитки всех слоев"""
+        if self.joining:
+            return
+
+        self.dirty.clear()
+        self.layers_dirty = False
+
+        self.send(autosave.BASE, json.dumps({"width": width, "height": height}).encode("utf-8"))
+        self.send_layers(layers)
+
+        for layer in layers.layers:
+            for ty in range(-(-height // self.tile_size)):
+                for tx in range(-(-width // self.tile_size)):
+                    self.send_tile(layer, mirrors[layer], tx, ty)
+
+    def read(self):
+        try:
+            frames = self.reader.feed(bytes(self.socket.readAll()))
+            records = [record for record in map(self.accept, frames) if record is not None]
+        except ValueError as error:
+            self.message.emit(f"Совместная работа: {error}")
+            self.close()
+            self.closed.emit()
+
+            return
+
+        if records:
+            self.received.emit(records)
+
+    def accept(self, frame: tuple[bytes, int, bytes]) -> tuple[bytes, bytes]:
+        """Проверяет номер кадра и возвращает запись, которую нужно применить, или None"""
+        kind, seq, payload = frame
+
+        if kind == HELLO:
+            self.client = json.loads(payload)["client"]
+            self.seq = seq
+
+            return None
+
+        if self.joining:
+            if seq != self.seq:
+                raise ValueError(f"снимок {seq} не совпадает с подключением {self.seq}")
+
+            if kind != SNAPSHOT:
+                self.snapshot.append((kind, payload))
+
+                return None
+
+            self.joining = False
+            self.message.emit(f"Совместная работа: подключено, участник {self.client}")
+
+            if not self.snapshot:
+                self.empty.emit()
+
+                return None
+
+            records, self.snapshot = self.snapshot, []
+            self.received.emit(records)
+
+            return None
+
+        if seq != self.seq + 1:
+            raise ValueError(f"ожидалась запись {self.seq + 1}, а пришла {seq}")
+
+        self.seq = seq
+
+        if kind == ACK:
+            key = self.sent.popleft()
+            self.pending[key] -= 1
+
+            if not self.pending[key]:
+                del self.pending[key]
+
+            return None
+
+        # пока свой холст или своя версия записи не подтверждены, более ранние чужие записи устарели
+        if self.pending.get(autosave.BASE) or self.pending.get(record_key(kind, payload)):
+            return None
+
+        return kind, payload
+
+
+def main(arguments: list[str] = None):
+    parser = argparse.ArgumentParser(description="Сервер совместной работы")
+    parser.add_argument("--host", default=CollabSettings.host,
+                        help="адрес, на котором слушать подключения (0.0.0.0 - вся локальная сеть)")
+    parser.add_argument("--port", type=int, default=CollabSettings.port)
+    arguments = parser.parse_args(arguments)
+
+    async def serve():
+        server = await asyncio.start_server(Relay().handle, arguments.host, arguments.port)
+        print(f"Сервер совместной работы слушает {arguments.host}:{arguments.port}", flush=True)
+
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,156 @@
 from PyQt6.QtGui import QPainter, QPen, QImage, QPixmap
-from PyQt6.QtCore import Qt, QPoint, QRect, QPointF
-import random
+from PyQt6.QtCore import Qt, QPoint, QRect
 from settings import Settings
+from regions import RegionCache, Selection
+from brushes import Stamper, tip_cache
+from vector import VectorLayer, shape_pen, draw_shape
+import floodfill
+import imagebuffer
+import numpy as np
 
 """В этом модуле можно создать свои инструменты для рисования
-Для этого нужно реализовать методы: 
-        __init__ (принимает настройки), 
-        mouse_press_event (принимает ссылку на изображение и текущую точку) -> ссылку на изображение
-        mouse_move_event (принимает ссылку на изображение, старую точку и текущую точку) -> ссылку на изображение
-        mouse_release_event (принимает ссылку на изображение и текущую точку) -> ссылку на изображение
+Для этого нужно реализовать методы:
+        __init__ (принимает настройки),
+        mouse_press_event (принимает ссылку на изображение и текущую точку) -> EditResult
+        mouse_move_event (принимает ссылку на изображение, старую точку и текущую точку) -> EditResult
+        mouse_release_event (принимает ссылку на изображение и текущую точку) -> EditResult
 
-Если нужно нарисовать фигуру, то можно создать копию текущего изображения и рисовать на ней то, как изменяется размер фигуры,
-сохранив при этом исходное, затем при отпускании в методе mouse_release_event можно нарисовать итоговую фигуру"""
+Перед mouse_press_event холст вызывает begin_stroke, а после mouse_release_event - end_stroke.
+Если инструмент возвращает перо из get_pen, то на время штриха открывается один QPainter на изображении (self.painter),
+его и нужно использовать в методах вместо создания нового.
+Перемещения мыши, которые накопились в очереди, передаются разом в mouse_move_points (по умолчанию он вызывает
+mouse_move_event для каждой точки)
+Если у инструмента задан emission_rate, то пока кнопка мыши зажата, холст emission_rate раз в секунду вызывает
+mouse_hold_event с текущей точкой, даже если мышь не двигается
+
+Каждый метод возвращает EditResult: какую поверхность он изменил, в каком прямоугольнике и является ли изменение
+предпросмотром. Холст перерисовывает, записывает в историю и сохраняет только этот прямоугольник,
+а предпросмотр только перерисовывает. Если прямоугольник не указан, считается, что изменилась вся поверхность
+
+Старые инструменты, которые возвращают изображение и сообщают прямоугольник через self.mark_dirty, тоже работают:
+их ответ переводится в EditResult функцией edit_result
+
+Если нужно показать, как изменяется фигура, то рисовать ее нужно на прозрачном слое предпросмотра self.overlay,
+который холст накладывает поверх изображения, и возвращать EditResult(self.overlay, rect, preview=True),
+а итоговую фигуру нарисовать на изображении в методе mouse_release_event (см. класс Figure)
+
+Инструмент выделения не меняет изображение, а передает холсту новое выделение в EditResult(selection=...).
+Холст дает инструментам карту связных областей текущего изображения self.regions (regions.py), если ее нет
+(например, при воспроизведении журнала), области ищутся обходом floodfill.find_region"""
+
+
+class EditResult:
+    """surface - измененное изображение (или слой предпросмотра), rect - измененный прямоугольник
+    (None - вся поверхность, пустой - ничего не изменилось), preview - изменение только на слое предпросмотра,
+    repaint - дополнительная область, которую нужно перерисовать, но которая не изменилась на surface
+    (например, стертый предпросмотр), selection - новое выделение"""
+    __slots__ = ("surface", "rect", "preview", "repaint", "selection")
+
+    def __init__(self, surface: QImage, rect: QRect = None, preview: bool = False, repaint: QRect = None,
+                 selection: Selection = None):
+        self.surface = surface
+        self.rect = rect
+        self.preview = preview
+        self.repaint = repaint
+        self.selection = selection
+
+    def dirty(self) -> QRect:
+        return self.surface.rect() if self.rect is None else self.rect
+
+
+def edit_result(tool: "BaseTool", result: "EditResult | QImage") -> EditResult:
+    """Переходник для старых инструментов: изображение и прямоугольник из mark_dirty превращаются в EditResult"""
+    if isinstance(result, EditResult):
+        return result
+
+    return EditResult(result, tool.dirty_rect)
+
+
+def stroke_rect(rect: QRect, width: int) -> QRect:
+    """Прямоугольник, который занимает линия толщиной width, проведенная по rect"""
+    margin = width // 2 + 1
+
+    return rect.normalized().adjusted(-margin, -margin, margin, margin)
 
 
 class BaseTool:
     settings_field = None
+    # можно ли пользоваться инструментом на векторном слое (там работают только фигуры и перемещение фигур)
+    vector = False
+    # можно ли пользоваться инструментом в плиточном хранилище, где ему видно только окно у видимой части холста
+    tiled = True
 
     def __init__(self):
         self.color = None
         self.width = None
         self.range = None
+        self.dirty_rect = None
+        self.overlay: QImage = None
+        self.regions: RegionCache = None
+        self.shapes: VectorLayer = None
+        self.painter: QPainter = None
+        self.pen: QPen = None
+        self.emission_rate = 0
+
+    def mark_dirty(self, rect: QRect):
+        """Для старых инструментов, которые возвращают изображение, а не EditResult"""
+        if self.dirty_rect is None:
+            self.dirty_rect = QRect(rect)
+        else:
+            self.dirty_rect = self.dirty_rect.united(rect)
+
+    def get_pen(self) -> QPen:
+        return None
+
+    def set_seed(self, seed: int):
+        """Задает зерно случайных чисел для следующего штриха, чтобы его можно было воспроизвести"""
+        pass
+
+    def begin_stroke(self, image: QImage):
+        self.end_stroke()
+
+        self.pen = self.get_pen()
+
+        if self.pen is not None:
+            self.painter = QPainter(image)
+            self.painter.setPen(self.pen)
+
+    def end_stroke(self):
+        if self.painter is not None:
+            self.painter.end()
+            self.painter = None
+
+    def mouse_press_event(self, image: QImage, point: QPoint) -> EditResult:
+        return EditResult(image, QRect())
+
+    def mouse_move_event(self, image: QImage, last_point: QPoint, point: QPoint) -> EditResult:
+        return EditResult(image, QRect())
+
+    def mouse_move_points(self, image: QImage, last_point: QPoint, points: list[QPoint]) -> EditResult:
+        """Объединяет прямоугольники mouse_move_event по всем точкам"""
+        rect = QRect()
+        result = EditResult(image, rect)
+
+        for point in points:
+            result = edit_result(self, self.mouse_move_event(image, last_point, point))
+            rect = rect.united(result.dirty())
+
+            if not result.preview:
+                image = result.surface
+
+            last_point = point
 
-    def mouse_press_event(self, image: QImage, point: QPoint) -> QImage:
-        return image
+        return EditResult(result.surface, rect, result.preview, result.repaint)
 
-    def mouse_move_event(self, image: QImage, last_point: QPoint, point: QPoint) -> QImage:
-        return image
+    def mouse_hold_event(self, image: QImage, point: QPoint) -> EditResult:
+        return EditResult(image, QRect())
 
-    def mouse_release_event(self, image: QImage, point: QPoint) -> QImage:
-        return image
+    def mouse_release_event(self, image: QImage, point: QPoint) -> EditResult:
+        return EditResult(image, QRect())
 
 
 class Brush(BaseTool):
+    """Штампующая кисть (brushes.py): отпечатки кончика ставятся вдоль пути через spacing долей ширины"""
     settings_field = "brush"
 
     def __init__(self, settings: Settings):
@@ -41,80 +159,93 @@ class Brush(BaseTool):
         self.color = settings.primary_color
         self.width = settings.brush.width
         self.range = settings.brush.width_range
+        self.hardness = settings.brush.hardness
 
-    def mouse_press_event(self, image: QImage, point: QPoint) -> QImage:
-        painter = QPainter(image)
-        painter.setPen(QPen(self.color, self.width, Qt.PenStyle.SolidLine,
-                       Qt.PenCapStyle.RoundCap, Qt.PenJoinStyle.RoundJoin))
+        tip = tip_cache.get(self.width, self.hardness, self.color)
+        self.stamper = Stamper(tip, max(self.width * settings.brush.spacing, 1.0))
 
-        painter.drawPoint(point)
+    def begin_stroke(self, image: QImage):
+        super().begin_stroke(image)
 
-        return image
+        self.painter = QPainter(image)
 
-    def mouse_move_event(self, image: QImage, last_point: QPoint, point: QPoint) -> QImage:
-        painter = QPainter(image)
-        painter.setPen(QPen(self.color, self.width, Qt.PenStyle.SolidLine,
-                            Qt.PenCapStyle.RoundCap, Qt.PenJoinStyle.RoundJoin))
+    def mouse_press_event(self, image: QImage, point: QPoint) -> EditResult:
+        return EditResult(image, self.stamper.start(self.painter, point))
 
-        painter.drawLine(last_point, point)
+    def mouse_move_event(self, image: QImage, last_point: QPoint, point: QPoint) -> EditResult:
+        return self.mouse_move_points(image, last_point, [point])
 
-        return image
+    def mouse_move_points(self, image: QImage, last_point: QPoint, points: list[QPoint]) -> EditResult:
+        rect = QRect()
+
+        for point in points:
+            rect = rect.united(self.stamper.line_to(self.painter, point))
+
+        return EditResult(image, rect)
 
 
 class Fill(BaseTool):
+    # область заливки может уходить за окно, загруженное из плиточного хранилища
+    tiled = False
+
     def __init__(self, settings: Settings):
         super().__init__()
 
         self.color = settings.primary_color
+        self.tolerance = settings.fill.tolerance
+        self.connectivity = settings.fill.connectivity
+
+    def mouse_press_event(self, image: QImage, point: QPoint) -> EditResult:
+        if not image.rect().contains(point):
+            return EditResult(image, QRect())
 
-    def mouse_press_event(self, image: QImage, point: QPoint) -> QImage:
-        painter = QPainter(image)
-        painter.setPen(QPen(self.color, 1))
+        if self.regions is None or self.tolerance:
+            return EditResult(image, floodfill.flood_fill(image, point.x(), point.y(), self.color,
+                                                          self.tolerance, self.connectivity))
 
-        if self.color == image.pixel(point):
-            return image
+        # сначала доступ на запись: если данные изображения разделены, они скопируются до поиска по карте
+        pixels = imagebuffer.pixel_array(image)
+        value = imagebuffer.pixel_value(image, self.color)
 
-        w, h = image.width(), image.height()
-        x, y = point.x(), point.y()
-        s = image.bits().asstring(w * h * 4)
+        if int(pixels[point.y(), point.x()]) == value:
+            return EditResult(image, QRect())
 
-        def get_pixel(x, y):
-            i = (x + (y * w)) * 4
-            return s[i:i+3]
+        region, rect = self.regions.find_region(image, point.x(), point.y(), self.connectivity)
+        Selection(region, rect).crop(pixels)[region] = value
 
-        target_color = get_pixel(x, y)
+        return EditResult(image, rect)
 
-        def get_cardinal_points(have_seen, center_pos):
-            points = []
-            cx, cy = center_pos
-            for x, y in [(1, 0), (0, 1), (-1, 0), (0, -1)]:
-                xx, yy = cx + x, cy + y
-                if (
-                    xx >= 0
-                    and xx < w
-                    and yy >= 0
-                    and yy < h
-                    and (xx, yy) not in have_seen
-                ):
-                    points.append((xx, yy))
-                    have_seen.add((xx, yy))
 
-            return points
+class MagicWand(BaseTool):
+    """Выделяет связную область цвета под курсором с допуском и связностью заливки. Изображение не меняется"""
+    tiled = False
+
+    def __init__(self, settings: Settings):
+        super().__init__()
+
+        self.tolerance = settings.fill.tolerance
+        self.connectivity = settings.fill.connectivity
 
-        have_seen = set()
-        queue = [(x, y)]
+    def mouse_press_event(self, image: QImage, point: QPoint) -> EditResult:
+        if not image.rect().contains(point):
+            return EditResult(image, QRect())
 
-        while queue:
-            x, y = queue.pop()
-            if get_pixel(x, y) == target_color:
-                painter.drawPoint(QPoint(x, y))
-                queue.extend(get_cardinal_points(have_seen, (x, y)))
+        if self.regions is None or self.tolerance:
+            region, rect = floodfill.find_region(imagebuffer.pixel_array(image, readonly=True), point.x(), point.y(),
+                                                 self.tolerance, self.connectivity)
+        else:
+            region, rect = self.regions.find_region(image, point.x(), point.y(), self.connectivity)
 
-        return image
+        return EditResult(image, QRect(), selection=Selection(region, rect))
 
 
-class Rectangle(BaseTool):
+class Figure(BaseTool):
+    """Общий класс для фигур. Пока кнопка мыши зажата, фигура рисуется на прозрачном слое предпросмотра self.overlay,
+    который холст накладывает поверх изображения. Само изображение изменяется один раз в mouse_release_event.
+    На векторном слое (self.shapes) фигура еще и добавляется в его список фигур"""
     settings_field = "figure"
+    vector = True
+    kind: str = None
 
     def __init__(self, settings: Settings):
         super().__init__()
@@ -123,107 +254,121 @@ class Rectangle(BaseTool):
         self.width = settings.figure.width
         self.range = settings.figure.width_range
         self.start_point = QPoint()
+        self.preview_rect = QRect()
 
-    def mouse_press_event(self, image: QImage, point: QPoint) -> QImage:
-        self.start_point = point
+    def draw_figure(self, painter: QPainter, point: QPoint):
+        draw_shape(painter, self.kind, self.start_point, point)
 
-        return image
+    def get_pen(self) -> QPen:
+        return shape_pen(self.kind, self.color, self.width)
 
-    def mouse_move_event(self, image: QImage, last_point: QPoint, point: QPoint) -> QImage:
-        """Мы делаем копию изображения для того чтобы на нем показывать, что изменяется размер фигуры. 
-            А само оригинальное изображения измениться только в методе self.mouse_release_event"""
-        image = QImage(image)
-        painter = QPainter(image)
-        painter.setPen(QPen(self.color, self.width, Qt.PenStyle.SolidLine,
-                       Qt.PenCapStyle.SquareCap, Qt.PenJoinStyle.MiterJoin))
+    def clear_preview(self, painter: QPainter):
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Clear)
+        painter.fillRect(self.preview_rect, Qt.GlobalColor.transparent)
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_SourceOver)
 
-        painter.drawRect(QRect(self.start_point, point))
+    def mouse_press_event(self, image: QImage, point: QPoint) -> EditResult:
+        self.start_point = point
 
-        return image
+        return EditResult(image, QRect())
 
-    def mouse_release_event(self, image: QImage, point: QPoint) -> QImage:
-        painter = QPainter(image)
-        painter.setPen(QPen(self.color, self.width, Qt.PenStyle.SolidLine,
-                       Qt.PenCapStyle.SquareCap, Qt.PenJoinStyle.MiterJoin))
+    def mouse_move_event(self, image: QImage, last_point: QPoint, point: QPoint) -> EditResult:
+        """Со слоя предпросмотра стирается только прямоугольник прошлой фигуры, перерисовать нужно его и новую фигуру"""
+        if self.overlay is None:
+            return EditResult(image, QRect(), preview=True)
 
-        painter.drawRect(QRect(self.start_point, point))
+        painter = QPainter(self.overlay)
+        self.clear_preview(painter)
+        painter.setPen(self.pen)
+        self.draw_figure(painter, point)
+        painter.end()
 
-        return image
+        rect = stroke_rect(QRect(self.start_point, point), self.width)
+        result = EditResult(self.overlay, rect.united(self.preview_rect), preview=True)
+        self.preview_rect = rect
 
+        return result
 
-class Ellipse(BaseTool):
-    settings_field = "figure"
+    def mouse_move_points(self, image: QImage, last_point: QPoint, points: list[QPoint]) -> EditResult:
+        """Для предпросмотра важна только последняя точка"""
+        return self.mouse_move_event(image, last_point, points[-1])
 
-    def __init__(self, settings: Settings):
-        super().__init__()
+    def mouse_release_event(self, image: QImage, point: QPoint) -> EditResult:
+        """Изображение меняется только под фигурой, а стертый предпросмотр нужно лишь перерисовать"""
+        if self.overlay is not None:
+            painter = QPainter(self.overlay)
+            self.clear_preview(painter)
+            painter.end()
 
-        self.color = settings.primary_color
-        self.width = settings.figure.width
-        self.range = settings.figure.width_range
-        self.point_start = QPoint()
+        # новая фигура лежит поверх всех, поэтому ее достаточно дорисовать, а не растеризовать слой заново
+        if self.shapes is not None:
+            self.shapes.add(self.kind, self.start_point, point, self.color, self.width)
 
-    def mouse_press_event(self, image: QImage, point: QPoint) -> QImage:
-        self.point_start = point
+        self.draw_figure(self.painter, point)
 
-        return image
+        result = EditResult(image, stroke_rect(QRect(self.start_point, point), self.width), repaint=self.preview_rect)
+        self.preview_rect = QRect()
 
-    def mouse_move_event(self, image: QImage, last_point: QPoint, point: QPoint) -> QImage:
-        image = QImage(image)
-        painter = QPainter(image)
-        painter.setPen(QPen(self.color, self.width, Qt.PenStyle.SolidLine,
-                       Qt.PenCapStyle.SquareCap, Qt.PenJoinStyle.MiterJoin))
+        return result
 
-        painter.drawEllipse(QRect(self.point_start, point))
 
-        return image
+class Rectangle(Figure):
+    kind = "rectangle"
 
-    def mouse_release_event(self, image: QImage, point: QPoint) -> QImage:
-        painter = QPainter(image)
-        painter.setPen(QPen(self.color, self.width, Qt.PenStyle.SolidLine,
-                       Qt.PenCapStyle.SquareCap, Qt.PenJoinStyle.MiterJoin))
 
-        painter.drawEllipse(QRect(self.point_start, point))
+class Ellipse(Figure):
+    kind = "ellipse"
 
-        return image
 
+class Line(Figure):
+    kind = "line"
 
-class Line(BaseTool):
-    settings_field = "figure"
+
+class ShapeMover(BaseTool):
+    """Перетаскивает фигуру векторного слоя, которая оказалась под курсором при нажатии. Слой растеризуется заново
+    только в прямоугольнике, который фигура занимала и занимает теперь"""
+    vector = True
 
     def __init__(self, settings: Settings):
         super().__init__()
 
-        self.color = settings.primary_color
-        self.width = settings.figure.width
-        self.range = settings.figure.width_range
-        self.point_start = QPoint()
+        self.shape = None
+        self.last_point = QPoint()
 
-    def mouse_press_event(self, image: QImage, point: QPoint) -> QImage:
-        self.point_start = point
+    def drag(self, image: QImage, point: QPoint) -> EditResult:
+        if self.shape is None or point == self.last_point:
+            return EditResult(image, QRect())
 
-        return image
+        rect = self.shapes.move(self.shape, point.x() - self.last_point.x(), point.y() - self.last_point.y())
+        self.last_point = point
+        self.shapes.render(image, rect)
 
-    def mouse_move_event(self, image: QImage, last_point: QPoint, point: QPoint) -> QImage:
-        image = QImage(image)
-        painter = QPainter(image)
-        painter.setPen(QPen(self.color, self.width, Qt.PenStyle.SolidLine,
-                       Qt.PenCapStyle.RoundCap, Qt.PenJoinStyle.MiterJoin))
+        return EditResult(image, rect)
 
-        painter.drawLine(self.point_start, point)
+    def mouse_press_event(self, image: QImage, point: QPoint) -> EditResult:
+        self.shape = self.shapes.shape_at(point) if self.shapes is not None else None
+        self.last_point = point
 
-        return image
+        return EditResult(image, QRect())
 
-    def mouse_release_event(self, image: QImage, point: QPoint) -> QImage:
-        painter = QPainter(image)
-        painter.setPen(QPen(self.color, self.width, Qt.PenStyle.SolidLine,
-                       Qt.PenCapStyle.RoundCap, Qt.PenJoinStyle.MiterJoin))
+    def mouse_move_event(self, image: QImage, last_point: QPoint, point: QPoint) -> EditResult:
+        return self.drag(image, point)
 
-        painter.drawLine(self.point_start, point)
+    def mouse_move_points(self, image: QImage, last_point: QPoint, points: list[QPoint]) -> EditResult:
+        """Фигура сдвигается сразу в последнюю точку пачки"""
+        return self.drag(image, points[-1])
 
-        return image
+    def mouse_release_event(self, image: QImage, point: QPoint) -> EditResult:
+        result = self.drag(image, point)
+        self.shape = None
+
+        return result
 
 
 class Spray(BaseTool):
+    """Точки генерируются разом через NumPy и записываются напрямую в буфер изображения.
+    Если задан emission_rate, то краска распыляется по таймеру холста с постоянной частотой,
+    а перемещения мыши только меняют точку распыления"""
     settings_field = "spray"
 
     def __init__(self, settings: Settings):
@@ -233,22 +378,38 @@ class Spray(BaseTool):
         self.width = settings.spray.width
         self.range = settings.spray.width_range
         self.density = settings.spray.density
+        self.emission_rate = settings.spray.emission_rate
+        self.rng = np.random.default_rng(settings.spray.seed)
+
+    def set_seed(self, seed: int):
+        self.rng = np.random.default_rng(seed)
+
+    def spray(self, image: QImage, point: QPoint) -> EditResult:
+        radius = self.width // 2
+        count_points = int(3.14 * radius ** 2 * self.density)
+
+        dots = np.rint(self.rng.normal((point.x(), point.y()), radius, (count_points, 2))).astype(np.intp)
+        xs, ys = dots[:, 0], dots[:, 1]
+
+        inside = (xs >= 0) & (xs < image.width()) & (ys >= 0) & (ys < image.height())
+        xs, ys = xs[inside], ys[inside]
+
+        if not len(xs):
+            return EditResult(image, QRect())
 
-    def mouse_press_event(self, image: QImage, point: QPoint) -> QImage:
-        painter = QPainter(image)
-        painter.setPen(QPen(self.color, 1, cap=Qt.PenCapStyle.RoundCap))
+        pixels = imagebuffer.pixel_array(image)
+        pixels[ys, xs] = imagebuffer.pixel_value(image, self.color)
 
-        square = 3.14 * (self.width // 2) ** 2
-        count_points = int(square * self.density)
+        return EditResult(image, QRect(QPoint(int(xs.min()), int(ys.min())), QPoint(int(xs.max()), int(ys.max()))))
 
-        for _ in range(count_points):
-            x = random.gauss(0, self.width//2)
-            y = random.gauss(0, self.width//2)
+    def mouse_press_event(self, image: QImage, point: QPoint) -> EditResult:
+        return self.spray(image, point)
 
-            pointn = QPointF(point.x() + x, point.y() + y)
-            painter.drawPoint(pointn)
+    def mouse_move_event(self, image: QImage, last_point: QPoint, point: QPoint) -> EditResult:
+        if self.emission_rate:
+            return EditResult(image, QRect())
 
-        return image
+        return self.spray(image, point)
 
-    def mouse_move_event(self, image: QImage, last_point: QPoint, point: QPoint) -> QImage:
-        return self.mouse_press_event(image, point)
+    def mouse_hold_event(self, image: QImage, point: QPoint) -> EditResult:
+        return self.spray(image, point)
@@ -0,0 +1,442 @@
+from PyQt6.QtGui import QImage, QImageReader, QImageIOHandler
+from PyQt6.QtCore import QObject, QRunnable, QRect, QSize, pyqtSignal
+import os
+import struct
+import time
+import zlib
+import numpy as np
+from settings import TileSettings, ExportSettings
+from tiles import TiledImage
+from quantize import quantize, sample_palette, map_pixels
+import imagebuffer
+
+"""Это модуль открытия и сохранения изображений в фоновом потоке (QThreadPool)
+Задача сообщает о прогрессе сигналом progress и может быть отменена методом cancel.
+Сохраняется снимок изображения: QImage копируется лениво, данные разделяются с холстом, пока тот их не изменит.
+PNG кодируется полосами через zlib (он отпускает GIL), поэтому прогресс и отмена работают и во время кодирования.
+PNG с палитрой и GIF сохраняются после уменьшения числа цветов (quantize.py). Qt не умеет писать GIF, поэтому
+GIF и его сжатие LZW записываются здесь же.
+
+Плиточное хранилище сохраняется только в PNG (обычный или с палитрой): он пишется полосами, и изображение
+целиком в памяти не собирается. JPEG и другие форматы Qt пишет только из целого QImage, а GIF сжимается
+на Python, поэтому для изображений такого размера они не годятся
+
+Большое изображение открывается в два шага: сначала декодируется уменьшенная копия (JPEG умеет декодировать сразу
+в меньшем масштабе, это в десятки раз быстрее полного декодирования), задача отдает ее сигналом preview, и холст
+показывает ее, пока в том же потоке декодируется все изображение. Форматы, которые не умеют уменьшать при
+декодировании, открываются в один шаг: для них копия стоила бы почти столько же, сколько само изображение"""
+
+
+class Canceled(Exception):
+    pass
+
+
+def read_image(path: str, settings: TileSettings, progress=lambda value: None) -> QImage | TiledImage:
+    """Большие изображения загружаются в плиточное хранилище, остальные - в QImage общего формата (imagebuffer.py).
+    Формат приводится здесь, в фоновом потоке открытия, а не в потоке интерфейса"""
+    reader = QImageReader(path)
+    size = reader.size()
+
+    if size.width() * size.height() > settings.threshold:
+        return TiledImage.open(path, settings, progress)
+
+    image = reader.read()
+
+    if image.isNull():
+        raise OSError(reader.errorString())
+
+    image = imagebuffer.canonical(image)
+    progress(100)
+
+    return image
+
+
+def read_preview(path: str, settings: TileSettings) -> tuple[QImage, QSize]:
+    """Уменьшенная копия изображения и его полный размер или None, если копия не нужна или ее не получить быстро"""
+    reader = QImageReader(path)
+    size = reader.size()
+
+    if size.width() * size.height() <= settings.preview_threshold:
+        return None
+
+    if not reader.supportsOption(QImageIOHandler.ImageOption.ScaledSize):
+        return None
+
+    scale = settings.preview_size / max(size.width(), size.height())
+    reader.setScaledSize(QSize(max(round(size.width() * scale), 1), max(round(size.height() * scale), 1)))
+    preview = reader.read()
+
+    if preview.isNull():
+        return None
+
+    return imagebuffer.canonical(preview), size
+
+
+def write_chunk(file, name: bytes, data: bytes):
+    file.write(struct.pack(">I", len(data)))
+    file.write(name)
+    file.write(data)
+    file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(name))))
+
+
+def write_png_data(path: str, width: int, height: int, depth: int, color_type: int, stripes, chunks=(),
+                   progress=lambda value: None, level: int = 6):
+    """Пишет PNG из готовых полос: stripes выдает пары (первая строка полосы, отфильтрованные строки байтами),
+    chunks - блоки (имя, данные) перед данными изображения, например палитра"""
+    compressor = zlib.compressobj(level)
+
+    with open(path, "wb") as file:
+        file.write(b"\x89PNG\r\n\x1a\n")
+        write_chunk(file, b"IHDR", struct.pack(">IIBBBBB", width, height, depth, color_type, 0, 0, 0))
+
+        for name, data in chunks:
+            write_chunk(file, name, data)
+
+        for top, data in stripes:
+            progress(top * 100 // height)
+
+            compressed = compressor.compress(data)
+
+            if compressed:
+                write_chunk(file, b"IDAT", compressed)
+
+        write_chunk(file, b"IDAT", compressor.flush())
+        write_chunk(file, b"IEND", b"")
+
+    progress(100)
+
+
+def write_png(path: str, rows, width: int, height: int, alpha: bool,
+              progress=lambda value: None, level: int = 6, stripe: int = 64):
+    """Кодирует PNG полосами по stripe строк. rows(top, bottom) возвращает строки в виде массива uint32 (0xAARRGGBB).
+    Для каждой строки используется фильтр Up (разность с предыдущей строкой), он хорошо сжимает рисунки"""
+    channels = 4 if alpha else 3
+
+    def stripes():
+        previous = np.zeros((width, channels), np.uint8)
+
+        for top in range(0, height, stripe):
+            pixels = rows(top, min(top + stripe, height))
+            count = len(pixels)
+
+            rgb = np.empty((count, width, channels), np.uint8)
+            rgb[:, :, 0] = (pixels >> 16).astype(np.uint8)
+            rgb[:, :, 1] = (pixels >> 8).astype(np.uint8)
+            rgb[:, :, 2] = pixels.astype(np.uint8)
+
+            if alpha:
+                rgb[:, :, 3] = (pixels >> 24).astype(np.uint8)
+
+            data = np.empty((count, 1 + width * channels), np.uint8)
+            data[:, 0] = 2
+            data[:, 1:] = (rgb - np.concatenate([previous[None], rgb[:-1]])).reshape(count, -1)
+            previous = rgb[-1]
+
+            yield top, data.tobytes()
+
+    write_png_data(path, width, height, 8, 6 if alpha else 2, stripes(), progress=progress, level=level)
+
+
+def palette_depth(count: int) -> int:
+    """Наименьшая глубина PNG с палитрой (1, 2, 4 или 8 бит на пиксель), в которую помещается count цветов"""
+    for depth in (1, 2, 4):
+        if count <= 1 << depth:
+            return depth
+
+    return 8
+
+
+def write_indexed_png(path: str, rows, width: int, height: int, palette: np.ndarray,
+                      progress=lambda value: None, level: int = 6, stripe: int = 64):
+    """Кодирует PNG с палитрой полосами по stripe строк: rows(top, bottom) возвращает номера цветов строк uint8,
+    palette - цвета uint32. Маленькие палитры упаковываются по несколько пикселей в байт. Строки идут без фильтра:
+    для номеров цветов разности бессмысленны, а одинаковые строки zlib и так находит"""
+    depth = palette_depth(len(palette))
+    per_byte = 8 // depth
+    padded = -(-width // per_byte) * per_byte
+    shifts = (8 - depth - depth * np.arange(per_byte)).astype(np.uint8)
+
+    channels = palette.view(np.uint8).reshape(-1, 4)
+    chunks = [(b"PLTE", channels[:, [2, 1, 0]].tobytes())]
+    transparent = np.flatnonzero(channels[:, 3] < 255)
+
+    if len(transparent):
+        chunks.append((b"tRNS", channels[:transparent[-1] + 1, 3].tobytes()))
+
+    def stripes():
+        for top in range(0, height, stripe):
+            indices = rows(top, min(top + stripe, height))
+            count = len(indices)
+
+            if depth < 8:
+                values = np.zeros((count, padded), np.uint8)
+                values[:, :width] = indices
+                indices = np.bitwise_or.reduce(values.reshape(count, -1, per_byte) << shifts, axis=2)
+
+            data = np.zeros((count, 1 + indices.shape[1]), np.uint8)
+            data[:, 1:] = indices
+
+            yield top, data.tobytes()
+
+    write_png_data(path, width, height, depth, 3, stripes(), chunks, progress, level)
+
+
+def lzw_encode(data: bytes, min_size: int, progress=lambda value: None, chunk: int = 1 << 18) -> bytes:
+    """Сжатие LZW для GIF. Коды переменной длины пишутся младшими битами вперед, когда таблица
+    из 4096 кодов заполняется, пишется код очистки и таблица начинается заново"""
+    clear = 1 << min_size
+    end = clear + 1
+    size = min_size + 1
+    next_code = end + 1
+    table: dict[int, int] = {}
+
+    output = bytearray()
+    buffer, bits = clear, size
+    prefix = data[0]
+    view = memoryview(data)
+
+    for start in range(1, len(data), chunk):
+        progress(start * 100 // len(data))
+
+        for byte in view[start:start + chunk]:
+            key = prefix << 8 | byte
+            code = table.get(key)
+
+            if code is not None:
+                prefix = code
+                continue
+
+            buffer |= prefix << bits
+            bits += size
+
+            if next_code < 4096:
+                table[key] = next_code
+                next_code += 1
+
+                # декодер добавляет коды на шаг позже, поэтому длина растет, когда код уже не помещается в прошлую
+                if next_code > 1 << size and size < 12:
+                    size += 1
+            else:
+                buffer |= clear << bits
+                bits += size
+                table = {}
+                next_code = end + 1
+                size = min_size + 1
+
+            while bits >= 8:
+                output.append(buffer & 0xff)
+                buffer >>= 8
+                bits -= 8
+
+            prefix = byte
+
+    for code in (prefix, end):
+        buffer |= code << bits
+        bits += size
+
+    while bits > 0:
+        output.append(buffer & 0xff)
+        buffer >>= 8
+        bits -= 8
+
+    return bytes(output)
+
+
+def write_gif(path: str, indices: np.ndarray, palette: np.ndarray, progress=lambda value: None):
+    """Кодирует GIF. В GIF прозрачным может быть только один цвет, поэтому все цвета палитры с альфой меньше
+    половины сводятся к первому из них"""
+    height, width = indices.shape
+    channels = palette.view(np.uint8).reshape(-1, 4)
+    transparent = np.flatnonzero(channels[:, 3] < 128)
+
+    if len(transparent) > 1:
+        remap = np.arange(len(palette), dtype=np.uint8)
+        remap[transparent] = transparent[0]
+        indices = remap[indices]
+
+    bits = max(int(len(palette) - 1).bit_length(), 1)
+    colors = np.zeros((1 << bits, 3), np.uint8)
+    colors[:len(palette)] = channels[:, [2, 1, 0]]
+
+    with open(path, "wb") as file:
+        file.write(b"GIF89a")
+        file.write(struct.pack("<HHBBB", width, height, 0x80 | (bits - 1) << 4 | (bits - 1), 0, 0))
+        file.write(colors.tobytes())
+
+        if len(transparent):
+            file.write(struct.pack("<BBBBHBB", 0x21, 0xf9, 4, 1, 0, int(transparent[0]), 0))
+
+        file.write(struct.pack("<BHHHHB", 0x2c, 0, 0, width, height, 0))
+
+        min_size = max(bits, 2)
+        data = lzw_encode(np.ascontiguousarray(indices).tobytes(), min_size, progress)
+
+        file.write(bytes([min_size]))
+
+        for start in range(0, len(data), 255):
+            block = data[start:start + 255]
+            file.write(bytes([len(block)]))
+            file.write(block)
+
+        file.write(b"\x00;")
+
+    progress(100)
+
+
+class ExportReport:
+    """Итог сохранения: размер файла, полное время и время построения палитры (colors - цветов в ней, 0 - без палитры)"""
+
+    def __init__(self, path: str, size: int, seconds: float, quantize_seconds: float = 0.0, colors: int = 0):
+        self.path = path
+        self.size = size
+        self.seconds = seconds
+        self.quantize_seconds = quantize_seconds
+        self.colors = colors
+
+    def __str__(self) -> str:
+        text = f"{self.path}: {self.size / 1024:.0f} КБ за {self.seconds:.2f} с"
+
+        if self.colors:
+            text += f", палитра из {self.colors} цветов за {self.quantize_seconds:.2f} с"
+
+        return text
+
+
+def write_image(image: QImage | TiledImage, path: str, progress=lambda value: None,
+                settings: ExportSettings = ExportSettings, indexed: bool = False) -> ExportReport:
+    """Сохраняет изображение или плиточное хранилище. Файл сначала пишется рядом, а при успехе заменяет старый.
+    indexed - сохранить PNG с палитрой, GIF сохраняется с палитрой всегда"""
+    temp_path = path + ".part"
+    extension = os.path.splitext(path)[1].lower()
+    start = time.perf_counter()
+    quantize_seconds = 0.0
+    palette = ()
+
+    if isinstance(image, TiledImage) and extension != ".png":
+        raise OSError("Большое изображение можно сохранить только в PNG")
+
+    try:
+        if isinstance(image, TiledImage):
+            def rows(top: int, bottom: int) -> np.ndarray:
+                return imagebuffer.pixel_array(image.read(QRect(0, top, image.width, bottom - top)))
+
+            if indexed:
+                progress(0)
+                quantize_start = time.perf_counter()
+                palette = sample_palette(image.sample(settings.quantize_sample, np.random.default_rng(0)),
+                                         settings, alpha=False)
+                quantize_seconds = time.perf_counter() - quantize_start
+
+                write_indexed_png(temp_path, lambda top, bottom: map_pixels(rows(top, bottom), palette, alpha=False),
+                                  image.width, image.height, palette, progress, settings.png_compression)
+            else:
+                write_png(temp_path, rows, image.width, image.height, False, progress, settings.png_compression)
+        elif extension == ".gif" or extension == ".png" and indexed:
+            image = imagebuffer.canonical(image)
+
+            progress(0)
+            quantize_start = time.perf_counter()
+            indices, palette = quantize(imagebuffer.pixel_array(image, readonly=True), settings,
+                                        image.hasAlphaChannel())
+            quantize_seconds = time.perf_counter() - quantize_start
+
+            if extension == ".gif":
+                write_gif(temp_path, indices, palette, progress)
+            else:
+                write_indexed_png(temp_path, lambda top, bottom: indices[top:bottom], image.width(), image.height(),
+                                  palette, progress, settings.png_compression)
+        elif extension == ".png":
+            image = imagebuffer.canonical(image)
+            pixels = imagebuffer.pixel_array(image, readonly=True)
+
+            write_png(temp_path, lambda top, bottom: pixels[top:bottom], image.width(), image.height(),
+                      image.hasAlphaChannel(), progress, settings.png_compression)
+        else:
+            progress(0)
+
+            quality = settings.jpeg_quality if extension in (".jpg", ".jpeg") else -1
+
+            if not image.save(temp_path, extension[1:] or None, quality):
+                raise OSError(f"Не удалось сохранить {path}")
+
+            progress(100)
+
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    return ExportReport(path, os.path.getsize(path), time.perf_counter() - start, quantize_seconds, len(palette))
+
+
+class Task(QRunnable):
+    """Фоновая задача. Результат приходит сигналом finished, ошибка - failed, отмена - canceled"""
+
+    class Signals(QObject):
+        progress = pyqtSignal(int)
+        # уменьшенная копия открываемого изображения и его полный размер
+        preview = pyqtSignal(QImage, QSize)
+        finished = pyqtSignal(object)
+        failed = pyqtSignal(str)
+        canceled = pyqtSignal()
+
+    def __init__(self):
+        super().__init__()
+
+        self.setAutoDelete(False)
+
+        self.signals = Task.Signals()
+        self.is_canceled = False
+
+    def cancel(self):
+        self.is_canceled = True
+
+    def report(self, value: int):
+        """Вызывается из работы задачи, здесь же она и прерывается при отмене"""
+        if self.is_canceled:
+            raise Canceled
+
+        self.signals.progress.emit(value)
+
+    def work(self):
+        pass
+
+    def run(self):
+        try:
+            result = self.work()
+        except Canceled:
+            self.signals.canceled.emit()
+        except Exception as error:
+            self.signals.failed.emit(str(error))
+        else:
+            self.signals.finished.emit(result)
+
+
+class OpenTask(Task):
+    def __init__(self, path: str, settings: TileSettings):
+        super().__init__()
+
+        self.path = path
+        self.settings = settings
+
+    def work(self) -> QImage | TiledImage:
+        preview = read_preview(self.path, self.settings)
+
+        if preview is not None:
+            self.signals.preview.emit(*preview)
+
+        return read_image(self.path, self.settings, self.report)
+
+
+class SaveTask(Task):
+    def __init__(self, image: QImage | TiledImage, path: str, settings: ExportSettings = ExportSettings,
+                 indexed: bool = False):
+        super().__init__()
+
+        self.image = image
+        self.path = path
+        self.settings = settings
+        self.indexed = indexed
+
+    def work(self) -> ExportReport:
+        return write_image(self.image, self.path, self.report, self.settings, self.indexed)
@@ -0,0 +1,194 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import numpy as np
+from imagebuffer import channel_array
+from settings import FilterSettings
+
+"""Это модуль фильтров изображения
+Фильтр работает с массивом пикселей uint32 (0xAARRGGBB), который смотрит прямо в буфер QImage (imagebuffer.pixel_array).
+Изображение делится на плитки, и плитки обрабатываются параллельно в пуле потоков: операции NumPy над большими
+массивами отпускают GIL, поэтому потоки действительно работают на разных ядрах.
+Фильтрам со свертками (размытие, резкость) нужны соседние пиксели, поэтому каждая плитка читается с запасом
+в halo пикселей с каждой стороны из копии изображения, дополненной по краям повтором крайних пикселей.
+Так плитки не зависят друг от друга, и результат совпадает с обработкой изображения целиком.
+Выделение обрабатывается только в своем габаритном прямоугольнике: запас для него берется из настоящих соседних
+пикселей изображения, поэтому край выделения выглядит так же, как при обработке всего изображения"""
+
+
+def to_pixels(values: np.ndarray) -> np.ndarray:
+    """Обратно из каналов float в uint32 с округлением и обрезкой до 0..255"""
+    result = np.empty(values.shape, np.uint8)
+    np.clip(values + 0.5, 0, 255, out=values)
+    result[...] = values
+
+    return result.view(np.uint32).reshape(values.shape[:2])
+
+
+def gaussian_kernel(radius: int) -> np.ndarray:
+    sigma = max(radius / 2, 0.5)
+    x = np.arange(-radius, radius + 1, dtype=np.float32)
+    kernel = np.exp(-x ** 2 / (2 * sigma ** 2))
+
+    return kernel / kernel.sum()
+
+
+def convolve(values: np.ndarray, kernel: np.ndarray, axis: int) -> np.ndarray:
+    """Свертка вдоль оси, результат короче на len(kernel) - 1 (только пиксели, у которых есть все соседи)"""
+    size = values.shape[axis] - len(kernel) + 1
+    result = np.zeros(values.shape[:axis] + (size,) + values.shape[axis + 1:], np.float32)
+
+    for i, weight in enumerate(kernel):
+        result += weight * (values[i:i + size] if axis == 0 else values[:, i:i + size])
+
+    return result
+
+
+def blur(pixels: np.ndarray, radius: int) -> np.ndarray:
+    """Гауссово размытие плитки с запасом radius, возвращает каналы float без запаса.
+    Если в плитке есть прозрачность, цвет размывается с учетом альфа-канала, чтобы не было каймы"""
+    values = channel_array(pixels).astype(np.float32)
+    alpha = values[:, :, 3:]
+    transparent = bool((alpha < 255).any())
+
+    if transparent:
+        values[:, :, :3] *= alpha / 255
+
+    kernel = gaussian_kernel(radius)
+    values = convolve(convolve(values, kernel, 0), kernel, 1)
+
+    if transparent:
+        alpha = values[:, :, 3:]
+        values[:, :, :3] *= np.divide(255, alpha, out=np.zeros_like(alpha), where=alpha > 0)
+
+    return values
+
+
+class Filter:
+    """halo - сколько соседних пикселей нужно фильтру с каждой стороны плитки"""
+    halo = 0
+
+    def apply(self, pixels: np.ndarray) -> np.ndarray:
+        """Получает плитку с запасом halo и возвращает обработанную плитку без запаса"""
+        return pixels
+
+
+class Invert(Filter):
+    def apply(self, pixels: np.ndarray) -> np.ndarray:
+        return pixels ^ np.uint32(0x00ffffff)
+
+
+class Grayscale(Filter):
+    def apply(self, pixels: np.ndarray) -> np.ndarray:
+        values = channel_array(pixels)
+        gray = (values[:, :, 2] * np.float32(0.299) + values[:, :, 1] * np.float32(0.587)
+                + values[:, :, 0] * np.float32(0.114) + np.float32(0.5)).astype(np.uint32)
+
+        return (pixels & np.uint32(0xff000000)) | (gray << 16) | (gray << 8) | gray
+
+
+class BrightnessContrast(Filter):
+    def __init__(self, brightness: int = 0, contrast: int = 0):
+        """brightness и contrast от -100 до 100"""
+        levels = np.arange(256, dtype=np.float32)
+        factor = (100 + contrast) / 100 if contrast <= 0 else 100 / (100 - min(contrast, 99))
+        levels = (levels - 128) * factor + 128 + brightness * 255 / 100
+
+        # таблица на все 256 значений канала, альфа не меняется
+        self.table = np.clip(levels + 0.5, 0, 255).astype(np.uint8)
+
+    def apply(self, pixels: np.ndarray) -> np.ndarray:
+        result = channel_array(pixels).copy()
+        result[:, :, :3] = self.table[result[:, :, :3]]
+
+        return result.view(np.uint32).reshape(pixels.shape)
+
+
+class Blur(Filter):
+    def __init__(self, radius: int = 3):
+        self.radius = self.halo = max(int(radius), 1)
+
+    def apply(self, pixels: np.ndarray) -> np.ndarray:
+        return to_pixels(blur(pixels, self.radius))
+
+
+class Sharpen(Filter):
+    """Нерезкое маскирование: к изображению добавляется его разница с размытой копией"""
+
+    def __init__(self, amount: float = 1.0, radius: int = 2):
+        self.amount = amount
+        self.radius = self.halo = max(int(radius), 1)
+
+    def apply(self, pixels: np.ndarray) -> np.ndarray:
+        r = self.radius
+        original = channel_array(pixels[r:-r, r:-r]).astype(np.float32)
+        blurred = blur(pixels, r)
+
+        values = original + self.amount * (original - blurred)
+        values[:, :, 3] = original[:, :, 3]
+
+        return to_pixels(values)
+
+
+FILTERS = {
+    "invert": Invert,
+    "grayscale": Grayscale,
+    "brightness_contrast": BrightnessContrast,
+    "blur": Blur,
+    "sharpen": Sharpen,
+}
+
+
+class FilterEngine:
+    def __init__(self, settings: FilterSettings):
+        self.tile_size = settings.tile_size
+        self.threads = settings.threads or os.cpu_count() or 1
+        self.executor: ThreadPoolExecutor = None
+
+    def tiles(self, height: int, width: int):
+        for top in range(0, height, self.tile_size):
+            for left in range(0, width, self.tile_size):
+                yield top, min(top + self.tile_size, height), left, min(left + self.tile_size, width)
+
+    def run(self, image_filter: Filter, pixels: np.ndarray, mask: np.ndarray = None,
+            box: tuple[int, int, int, int] = None):
+        """Применяет фильтр к массиву пикселей на месте. box - прямоугольник (top, bottom, left, right), который
+        нужно обработать, по умолчанию весь массив. mask - выделение размером с box: пиксели вне него
+        остаются прежними"""
+        height, width = pixels.shape
+        top, bottom, left, right = box or (0, height, 0, width)
+        region = pixels[top:bottom, left:right]
+        before = None if mask is None else region[~mask]
+        halo = image_filter.halo
+
+        if halo:
+            # запас из соседних пикселей изображения, а за его краем - повтор крайних
+            y0, y1 = max(top - halo, 0), min(bottom + halo, height)
+            x0, x1 = max(left - halo, 0), min(right + halo, width)
+            source = np.pad(pixels[y0:y1, x0:x1], ((halo - (top - y0), halo - (y1 - bottom)),
+                                                   (halo - (left - x0), halo - (x1 - right))), mode="edge")
+        else:
+            # фильтрам без соседей хватает самого изображения: каждая плитка читает только свои пиксели
+            source = region
+
+        def process(tile: tuple[int, int, int, int]):
+            top, bottom, left, right = tile
+            region[top:bottom, left:right] = image_filter.apply(source[top:bottom + 2 * halo, left:right + 2 * halo])
+
+        tiles = list(self.tiles(*region.shape))
+
+        if self.threads == 1 or len(tiles) == 1:
+            for tile in tiles:
+                process(tile)
+        else:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(self.threads, thread_name_prefix="filter")
+
+            # list дожидается всех плиток и передает сюда исключение, если оно случилось в потоке
+            list(self.executor.map(process, tiles))
+
+        if mask is not None:
+            region[~mask] = before
+
+
+def make_filter(name: str, **params) -> Filter:
+    return FILTERS[name](**params)
@@ -0,0 +1,103 @@
+from PyQt6.QtGui import QImage, QColor
+from PyQt6.QtCore import QRect
+import bisect
+import numpy as np
+from imagebuffer import pixel_array, pixel_value, channel_array
+
+"""Это модуль заливки
+Заливка идет не по отдельным пикселям, а по горизонтальным отрезкам (спанам) подходящего цвета:
+сначала одним векторным проходом NumPy изображение разбивается на отрезки, затем обход идет по отрезкам,
+а закраска записывается в буфер изображения целыми строками"""
+
+
+def match_mask(pixels: np.ndarray, target: int, tolerance: int = 0) -> np.ndarray:
+    """Маска пикселей, у которых каждый канал отличается от target не больше чем на tolerance"""
+    if tolerance <= 0:
+        return pixels == target
+
+    channels = channel_array(pixels)
+    target_channels = np.array([target], np.uint32).view(np.uint8)
+
+    mask = np.ones(pixels.shape, bool)
+    for i, value in enumerate(target_channels):
+        mask &= np.abs(channels[:, :, i].astype(np.int16) - int(value)) <= tolerance
+
+    return mask
+
+
+def find_runs(mask: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Разбивает маску на горизонтальные отрезки.
+    Возвращает строки, начала и концы (не включительно) отрезков, а также индекс первого отрезка каждой строки"""
+    h, w = mask.shape
+
+    padded = np.zeros((h, w + 2), np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+    row_ptr = np.searchsorted(rows, np.arange(h + 1))
+
+    return rows, starts, ends, row_ptr
+
+
+def flood_fill(image: QImage, x: int, y: int, color: QColor, tolerance: int = 0, connectivity: int = 4) -> QRect:
+    """Заливает область вокруг точки (x, y) и возвращает прямоугольник, который был изменен"""
+    pixels = pixel_array(image)
+    value = pixel_value(image, color)
+
+    if int(pixels[y, x]) == value:
+        return QRect()
+
+    region, rect = find_region(pixels, x, y, tolerance, connectivity)
+    pixels[rect.top():rect.bottom() + 1, rect.left():rect.right() + 1][region] = value
+
+    return rect
+
+
+def find_region(pixels: np.ndarray, x: int, y: int, tolerance: int = 0, connectivity: int = 4) -> tuple[np.ndarray, QRect]:
+    """Связная область вокруг точки (x, y): маска внутри габаритного прямоугольника и сам прямоугольник"""
+    h, w = pixels.shape
+    target = int(pixels[y, x])
+
+    rows, starts, ends, row_ptr = find_runs(match_mask(pixels, target, tolerance))
+    starts_list, ends_list, ptr = starts.tolist(), ends.tolist(), row_ptr.tolist()
+
+    # при 8-связности соседними считаются и отрезки, которые касаются только по диагонали
+    reach = 1 if connectivity == 8 else 0
+
+    seed = bisect.bisect_right(starts_list, x, ptr[y], ptr[y + 1]) - 1
+    seen = bytearray(len(starts_list))
+    seen[seed] = 1
+    stack = [(seed, y)]
+    filled = []
+
+    while stack:
+        run, row = stack.pop()
+        filled.append(run)
+
+        left, right = starts_list[run] - reach, ends_list[run] + reach
+
+        for next_row in (row - 1, row + 1):
+            if 0 <= next_row < h:
+                first = bisect.bisect_right(ends_list, left, ptr[next_row], ptr[next_row + 1])
+                last = bisect.bisect_left(starts_list, right, ptr[next_row], ptr[next_row + 1])
+
+                for i in range(first, last):
+                    if not seen[i]:
+                        seen[i] = 1
+                        stack.append((i, next_row))
+
+    filled = np.array(filled)
+    fill_rows, fill_starts, fill_ends = rows[filled], starts[filled], ends[filled]
+
+    top, bottom = int(fill_rows.min()), int(fill_rows.max()) + 1
+    left, right = int(fill_starts.min()), int(fill_ends.max())
+
+    # отрезки переводятся в маску внутри габаритного прямоугольника через накопленную сумму границ
+    marks = np.zeros((bottom - top, right - left + 1), np.int8)
+    marks[fill_rows - top, fill_starts - left] = 1
+    marks[fill_rows - top, fill_ends - left] = -1
+    region = np.cumsum(marks, axis=1, dtype=np.int8)[:, :-1].astype(bool)
+
+    return region, QRect(left, top, right - left, bottom - top)
@@ -0,0 +1,60 @@
+from PyQt6.QtGui import QGuiApplication
+from PyQt6.QtCore import Qt, QObject, QTimer
+import math
+import time
+
+"""Это модуль ритма кадров
+Мышь с высокой частотой опроса или планшет присылают 500-1000 событий в секунду, а экран показывает 60-144 кадра.
+Если на каждое событие вызывать инструмент и перерисовку, очередь событий растет быстрее, чем разбирается,
+и задержка от движения руки до кадра копится. Поэтому холст только складывает точки, а инструмент и перерисовку
+вызывает FrameScheduler - не чаще одного раза за кадр экрана.
+
+Первый запрос после паузы выполняется сразу, как только будет разобрана очередь событий (пачка соберет все уже
+пришедшие события), следующий - не раньше, чем через кадр после предыдущего. Так задержка не больше одного кадра
+при любой частоте событий, а работа за секунду не зависит от частоты мыши"""
+
+
+def screen_rate(default: int = 60) -> float:
+    """Частота обновления основного экрана"""
+    screen = QGuiApplication.primaryScreen()
+    rate = screen.refreshRate() if screen is not None else 0
+
+    return rate if rate > 0 else default
+
+
+class FrameScheduler(QObject):
+    def __init__(self, callback, parent: QObject = None, rate: float = 0):
+        super().__init__(parent)
+
+        self.callback = callback
+        self.interval = 0
+        self.last = -math.inf
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self.timer.timeout.connect(self.fire)
+
+        self.set_rate(rate)
+
+    def set_rate(self, rate: float):
+        """rate - кадров в секунду, 0 - частота экрана, None - без ограничения"""
+        if rate is None:
+            self.interval = 0
+        else:
+            self.interval = 1 / (rate or screen_rate())
+
+    def request(self):
+        """Просит вызвать callback в ближайшем кадре, повторные запросы до него ничего не делают"""
+        if self.timer.isActive():
+            return
+
+        wait = max(self.last + self.interval - time.perf_counter(), 0)
+        self.timer.start(math.ceil(wait * 1000))
+
+    def cancel(self):
+        self.timer.stop()
+
+    def fire(self):
+        self.last = time.perf_counter()
+        self.callback()
@@ -0,0 +1,255 @@
+from PyQt6.QtGui import QImage
+from PyQt6.QtCore import QRect, QPoint
+import zlib
+import numpy as np
+from settings import HistorySettings
+import imagebuffer
+
+"""Это модуль истории изменений (отмена и повтор)
+Изображение делится на квадратные плитки, и каждый шаг истории хранит только те плитки, которые изменились.
+Чтобы узнать старое содержимое плиток, история держит копию изображения на момент последнего шага (self.mirror)
+и обновляет в ней только измененные плитки, поэтому время записи, отмены и повтора шага пропорционально числу его плиток.
+Для плиточного хранилища (tiles.TiledImage) копией служит само хранилище, а изображение, на котором рисуют инструменты,
+является окном в него с началом в точке origin.
+Если изображение состоит из слоев, копия хранится для каждого слоя, а шаг помнит, к какому слою он относится.
+Шаг векторного слоя хранит еще и изменения фигур (edit - объект с методом swap), они меняются местами вместе с плитками.
+
+Плитка шага хранит не старое содержимое, а разность старого и нового (XOR): отмена и повтор - одно и то же
+наложение разности, а пиксели, которые шаг не менял, остаются нулями и не трогаются. Поэтому чужие пиксели,
+записанные мимо истории (write - плитки других участников совместной работы), отмена не стирает: в шагах
+их слоя разность в этих пикселях обнуляется, и побеждает чужая правка"""
+
+
+class Step:
+    def __init__(self, tiles: dict[tuple[int, int], bytes], rect: QRect, layer=None, edit=None):
+        self.tiles = tiles
+        self.rect = rect
+        self.layer = layer
+        self.edit = edit
+        self.compressed = False
+
+    @property
+    def size(self) -> int:
+        return sum(len(data) for data in self.tiles.values())
+
+    def compress(self):
+        if not self.compressed:
+            self.tiles = {key: zlib.compress(data, 1) for key, data in self.tiles.items()}
+            self.compressed = True
+
+    def get_tile(self, key: tuple[int, int]) -> bytes:
+        data = self.tiles[key]
+
+        return zlib.decompress(data) if self.compressed else data
+
+    def forget(self, key: tuple[int, int], mask: np.ndarray):
+        """Убирает из плитки шага разность в пикселях mask"""
+        delta = np.frombuffer(self.get_tile(key), np.uint32).reshape(mask.shape).copy()
+        delta[mask] = 0
+        data = delta.tobytes()
+
+        self.tiles[key] = zlib.compress(data, 1) if self.compressed else data
+
+
+class History:
+    def __init__(self, settings: HistorySettings):
+        self.tile_size = settings.tile_size
+        self.budget = settings.budget
+        self.compress = settings.compress
+        self.raw_steps = settings.raw_steps
+
+        self.undo_steps: list[Step] = []
+        self.redo_steps: list[Step] = []
+        self.size = 0
+        self.mirrors: dict[object, np.ndarray] = {}
+        self.layer = None
+
+    @property
+    def mirror(self) -> np.ndarray:
+        return self.mirrors[self.layer]
+
+    def reset(self, mirror: np.ndarray, layer=None):
+        """Начинает историю заново. mirror - пиксели изображения (копия) или плиточное хранилище,
+        layer - слой, к которому относятся следующие шаги"""
+        self.undo_steps.clear()
+        self.redo_steps.clear()
+        self.size = 0
+        self.mirrors = {layer: mirror}
+        self.layer = layer
+
+    def add_layer(self, layer, mirror: np.ndarray):
+        self.mirrors[layer] = mirror
+
+    def remove_layer(self, layer):
+        """Удаляет копию слоя и все его шаги"""
+        del self.mirrors[layer]
+
+        for steps in (self.undo_steps, self.redo_steps):
+            for step in [step for step in steps if step.layer is layer]:
+                steps.remove(step)
+                self.size -= step.size
+
+    def select(self, layer):
+        self.layer = layer
+
+    def undo_layer(self):
+        """Слой, к которому относится шаг, который будет отменен"""
+        return self.undo_steps[-1].layer if self.undo_steps else None
+
+    def redo_layer(self):
+        return self.redo_steps[-1].layer if self.redo_steps else None
+
+    def can_undo(self) -> bool:
+        return bool(self.undo_steps)
+
+    def can_redo(self) -> bool:
+        return bool(self.redo_steps)
+
+    def tiles(self, rect: QRect, mirror: np.ndarray = None):
+        """Перебирает номера плиток и их срезы внутри прямоугольника (по размеру копии mirror, по умолчанию текущей)"""
+        h, w = (self.mirror if mirror is None else mirror).shape
+        rect = rect.intersected(QRect(0, 0, w, h))
+
+        if rect.isEmpty():
+            return
+
+        size = self.tile_size
+
+        for ty in range(rect.top() // size, rect.bottom() // size + 1):
+            for tx in range(rect.left() // size, rect.right() // size + 1):
+                yield (tx, ty), (slice(ty * size, min((ty + 1) * size, h)), slice(tx * size, min((tx + 1) * size, w)))
+
+    def tile_rect(self, key: tuple[int, int]) -> QRect:
+        tx, ty = key
+        h, w = self.mirror.shape
+
+        return QRect(tx * self.tile_size, ty * self.tile_size, self.tile_size, self.tile_size).intersected(QRect(0, 0, w, h))
+
+    def window(self, image: QImage, origin: QPoint):
+        """Пиксели изображения, сдвинутые так, чтобы их можно было брать по срезам плиток"""
+        pixels = imagebuffer.pixel_array(image)
+        x, y = origin.x(), origin.y()
+
+        def get(ys: slice, xs: slice) -> np.ndarray:
+            return pixels[ys.start - y:ys.stop - y, xs.start - x:xs.stop - x]
+
+        return get, QRect(origin, image.size())
+
+    def commit(self, image: QImage, rect: QRect, origin: QPoint = QPoint(), edit=None):
+        """Записывает шаг истории: сохраняет разность старого и нового содержимого плиток внутри rect, которые
+        действительно изменились. rect задается в координатах image, edit - изменения фигур векторного слоя"""
+        pixels, window = self.window(image, origin)
+        tiles = {}
+        changed = QRect()
+
+        for key, (ys, xs) in self.tiles(rect.translated(origin).intersected(window)):
+            if not np.array_equal(pixels(ys, xs), self.mirror[ys, xs]):
+                tiles[key] = (self.mirror[ys, xs] ^ pixels(ys, xs)).tobytes()
+                self.mirror[ys, xs] = pixels(ys, xs)
+                changed = changed.united(self.tile_rect(key))
+
+        if not tiles and edit is None:
+            return
+
+        for step in self.redo_steps:
+            self.size -= step.size
+
+        self.redo_steps.clear()
+
+        step = Step(tiles, changed, self.layer, edit)
+        self.undo_steps.append(step)
+        self.size += step.size
+
+        self.shrink()
+
+    def swap(self, step: Step, image: QImage = None, origin: QPoint = QPoint()):
+        """Накладывает разность шага на копию, это и отмена, и повтор. Плитки, которые попадают в image,
+        записываются и в него. image должен быть изображением слоя шага"""
+        pixels, window = self.window(image, origin) if image is not None else (None, QRect())
+        mirror = self.mirrors[step.layer]
+
+        for key, (ys, xs) in self.tiles(step.rect, mirror):
+            if key not in step.tiles:
+                continue
+
+            current = mirror[ys, xs]
+            restored = current ^ np.frombuffer(step.get_tile(key), np.uint32).reshape(current.shape)
+            mirror[ys, xs] = restored
+
+            if window.contains(self.tile_rect(key)):
+                pixels(ys, xs)[...] = restored
+
+        if step.edit is not None:
+            step.edit.swap()
+
+    def write(self, layer, rect: QRect, pixels: np.ndarray):
+        """Записывает в копию слоя пиксели мимо истории (rect - их место). В шагах этого слоя разность
+        в переписанных пикселях обнуляется, чтобы отмена и повтор не стирали эту запись"""
+        mirror = self.mirrors[layer]
+        steps = [step for steps in (self.undo_steps, self.redo_steps) for step in steps if step.layer is layer]
+        x, y = rect.x(), rect.y()
+
+        for key, (ys, xs) in self.tiles(rect, mirror):
+            # часть плитки, которую занимают пиксели
+            part_ys = slice(max(ys.start, y), min(ys.stop, y + rect.height()))
+            part_xs = slice(max(xs.start, x), min(xs.stop, x + rect.width()))
+            new = pixels[part_ys.start - y:part_ys.stop - y, part_xs.start - x:part_xs.stop - x]
+            changed = None
+
+            for step in steps:
+                if key not in step.tiles:
+                    continue
+
+                if changed is None:
+                    changed = np.zeros((ys.stop - ys.start, xs.stop - xs.start), bool)
+                    changed[part_ys.start - ys.start:part_ys.stop - ys.start,
+                            part_xs.start - xs.start:part_xs.stop - xs.start] = mirror[part_ys, part_xs] != new
+
+                size = len(step.tiles[key])
+                step.forget(key, changed)
+                self.size += len(step.tiles[key]) - size
+
+            mirror[part_ys, part_xs] = new
+
+    def undo(self, image: QImage = None, origin: QPoint = QPoint()) -> QRect:
+        """Отменяет последний шаг и возвращает прямоугольник, который изменился"""
+        if not self.undo_steps:
+            return QRect()
+
+        step = self.undo_steps.pop()
+        self.swap(step, image, origin)
+        self.redo_steps.append(step)
+
+        self.shrink()
+
+        return step.rect
+
+    def redo(self, image: QImage = None, origin: QPoint = QPoint()) -> QRect:
+        if not self.redo_steps:
+            return QRect()
+
+        step = self.redo_steps.pop()
+        self.swap(step, image, origin)
+        self.undo_steps.append(step)
+
+        self.shrink()
+
+        return step.rect
+
+    def shrink(self):
+        """Сжимает старые шаги и удаляет самые дальние, пока история не уложится в бюджет памяти: сначала шаги
+        повтора с конца, до которого дольше всего идти (после долгой отмены почти вся история лежит в них),
+        затем самые старые шаги отмены. Следующий шаг отмены и следующий шаг повтора остаются всегда"""
+        if self.compress:
+            for steps in (self.undo_steps, self.redo_steps):
+                for step in steps[:max(len(steps) - self.raw_steps, 0)]:
+                    if not step.compressed:
+                        self.size -= step.size
+                        step.compress()
+                        self.size += step.size
+
+        while self.size > self.budget and len(self.redo_steps) > 1:
+            self.size -= self.redo_steps.pop(0).size
+
+        while self.size > self.budget and len(self.undo_steps) > 1:
+            self.size -= self.undo_steps.pop(0).size
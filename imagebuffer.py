@@ -0,0 +1,71 @@
+from PyQt6.QtGui import QImage, QColor
+import numpy as np
+
+"""Это модуль общего формата пикселей
+Инструменты, фильтры, история и автосохранение работают с пикселем как с одним числом uint32 0xAARRGGBB
+(в памяти байты B, G, R, A). В Qt этой раскладке соответствуют два формата: Format_ARGB32 для изображений
+с прозрачностью и Format_RGB32 для непрозрачных - та же раскладка, только альфа всегда 0xff (на нем QPainter рисует
+быстрее, а стертое на фоне остается белым). Любое изображение приводится к одному из них один раз - при открытии
+или создании (функция canonical), поэтому дальше никому не нужно проверять и конвертировать формат.
+
+pixel_array отдает буфер изображения как массив NumPy без копирования. Шаг строк берется из bytesPerLine, так что
+массив верен при любом выравнивании строк, а запись в него сразу меняет изображение. Массив сам держит изображение,
+поэтому можно брать буфер и у временного изображения"""
+
+PIXEL_FORMATS = (QImage.Format.Format_RGB32, QImage.Format.Format_ARGB32)
+
+
+def canonical(image: QImage) -> QImage:
+    """Приводит изображение к общему формату: с прозрачностью - к ARGB32, без нее - к RGB32.
+    Изображение, которое уже в общем формате, возвращается как есть"""
+    if image.isNull() or image.format() in PIXEL_FORMATS:
+        return image
+
+    return image.convertToFormat(QImage.Format.Format_ARGB32 if image.hasAlphaChannel()
+                                 else QImage.Format.Format_RGB32)
+
+
+class ImageBuffer:
+    """Описание буфера изображения для NumPy. Массив держит ссылку на этот объект, а он - на изображение,
+    поэтому изображение живет, пока жив массив, даже если его больше никто не хранит"""
+
+    def __init__(self, image: QImage, readonly: bool):
+        self.image = image
+        ptr = image.constBits() if readonly else image.bits()
+
+        self.__array_interface__ = {
+            "version": 3,
+            "shape": (image.height(), image.width()),
+            "typestr": "<u4",
+            "strides": (image.bytesPerLine(), 4),
+            "data": (int(ptr), readonly),
+        }
+
+
+def pixel_array(image: QImage, readonly: bool = False) -> np.ndarray:
+    """Возвращает буфер изображения как массив uint32 размером (высота, ширина) без копирования.
+    Подходит любой формат с 32 битами на пиксель. Массив только для чтения не отделяет
+    разделяемые данные изображения (не вызывает копирования при записи)"""
+    if image.isNull():
+        return np.zeros((0, 0), np.uint32)
+
+    if image.depth() != 32:
+        raise ValueError(f"Нужно изображение с 32 битами на пиксель, а не {image.format().name}")
+
+    return np.asarray(ImageBuffer(image, readonly))
+
+
+def channel_array(pixels: np.ndarray) -> np.ndarray:
+    """Каналы пикселей (высота, ширина, 4) в порядке B, G, R, A без копирования, в том числе для срезов"""
+    h, w = pixels.shape
+
+    return np.lib.stride_tricks.as_strided(pixels.view(np.uint8), (h, w, 4), (*pixels.strides, 1),
+                                           writeable=pixels.flags.writeable)
+
+
+def pixel_value(image: QImage, color: QColor) -> int:
+    """Значение пикселя для цвета: у непрозрачного формата альфа всегда 0xff"""
+    if image.format() == QImage.Format.Format_RGB32:
+        return color.rgb()
+
+    return color.rgba()
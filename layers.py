@@ -0,0 +1,231 @@
+from PyQt6.QtGui import QImage, QPainter
+from PyQt6.QtCore import Qt, QRect
+from vector import VectorLayer
+
+"""Это модуль слоев
+Инструменты рисуют только на активном слое, а на экран выводится готовая сборка (composite) всех видимых слоев.
+Сборка пересчитывается не целиком, а только внутри прямоугольника, который изменился. Чтобы ее цена не зависела
+от числа слоев, стек хранит два кэша: below - слои под активным вместе с белой подложкой, и above - слои над ним,
+уже сведенные в один (это возможно, только когда у всех верхних слоев обычный режим наложения, иначе они
+накладываются по одному). Изменение активного слоя стоит три переноса прямоугольника при любом числе слоев.
+Если слой один и обычный, сборкой служит само его изображение и никаких копий нет.
+У векторного слоя есть список фигур (shapes, vector.py), а его изображение - их растеризация"""
+
+# ключ режима наложения: (название для меню, режим QPainter)
+BLEND_MODES = {
+    "normal": ("Обычный", QPainter.CompositionMode.CompositionMode_SourceOver),
+    "multiply": ("Умножение", QPainter.CompositionMode.CompositionMode_Multiply),
+    "screen": ("Экран", QPainter.CompositionMode.CompositionMode_Screen),
+    "overlay": ("Перекрытие", QPainter.CompositionMode.CompositionMode_Overlay),
+    "darken": ("Затемнение", QPainter.CompositionMode.CompositionMode_Darken),
+    "lighten": ("Замена светлым", QPainter.CompositionMode.CompositionMode_Lighten),
+    "difference": ("Разница", QPainter.CompositionMode.CompositionMode_Difference),
+    "add": ("Сложение", QPainter.CompositionMode.CompositionMode_Plus),
+}
+
+
+class Layer:
+    def __init__(self, image: QImage, name: str):
+        self.image = image
+        self.name = name
+        self.visible = True
+        self.opacity = 1.0
+        self.blend_mode = "normal"
+        self.shapes: VectorLayer = None
+
+    def is_normal(self) -> bool:
+        return self.blend_mode == "normal"
+
+
+class LayerStack:
+    def __init__(self, image: QImage, name: str = "Фон"):
+        self.layers = [Layer(image, name)]
+        self.active = 0
+        self.counter = 1
+
+        self.composite = image
+        self.below: QImage = None
+        self.above: QImage = None
+
+    @property
+    def current(self) -> Layer:
+        return self.layers[self.active]
+
+    def rect(self) -> QRect:
+        return self.layers[0].image.rect()
+
+    def is_simple(self) -> bool:
+        """Один видимый непрозрачный слой показывается без сборки"""
+        layer = self.layers[0]
+
+        return len(self.layers) == 1 and layer.visible and layer.opacity == 1 and layer.is_normal()
+
+    def can_merge_above(self) -> bool:
+        return all(layer.is_normal() for layer in self.layers[self.active + 1:])
+
+    def new_image(self, format: QImage.Format) -> QImage:
+        image = QImage(self.rect().size(), format)
+        image.fill(Qt.GlobalColor.transparent)
+
+        return image
+
+    def draw_layers(self, painter: QPainter, layers: list[Layer], rect: QRect):
+        for layer in layers:
+            if layer.visible and layer.opacity > 0:
+                painter.setOpacity(layer.opacity)
+                painter.setCompositionMode(BLEND_MODES[layer.blend_mode][1])
+                painter.drawImage(rect.topLeft(), layer.image, rect)
+
+    def compose_below(self, rect: QRect):
+        painter = QPainter(self.below)
+        painter.fillRect(rect, Qt.GlobalColor.white)
+        self.draw_layers(painter, self.layers[:self.active], rect)
+        painter.end()
+
+    def compose_above(self, rect: QRect):
+        painter = QPainter(self.above)
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Source)
+        painter.fillRect(rect, Qt.GlobalColor.transparent)
+        self.draw_layers(painter, self.layers[self.active + 1:], rect)
+        painter.end()
+
+    def rebuild(self):
+        """Заново собирает кэши, нужно после смены активного слоя или состава стека"""
+        if self.is_simple():
+            self.composite = self.layers[0].image
+            self.below = self.above = None
+
+            return
+
+        if self.composite is self.layers[0].image or self.composite.size() != self.rect().size():
+            self.composite = self.new_image(QImage.Format.Format_RGB32)
+
+        self.below = self.new_image(QImage.Format.Format_RGB32)
+        self.compose_below(self.rect())
+
+        self.above = None
+
+        if self.active < len(self.layers) - 1 and self.can_merge_above():
+            self.above = self.new_image(QImage.Format.Format_ARGB32_Premultiplied)
+            self.compose_above(self.rect())
+
+        self.update(self.rect())
+
+    def update(self, rect: QRect):
+        """Пересобирает прямоугольник после того, как в нем изменился активный слой"""
+        if self.is_simple():
+            self.composite = self.layers[0].image
+
+            return
+
+        rect = rect.intersected(self.rect())
+
+        if rect.isEmpty():
+            return
+
+        painter = QPainter(self.composite)
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Source)
+        painter.drawImage(rect.topLeft(), self.below, rect)
+
+        self.draw_layers(painter, [self.current], rect)
+
+        if self.above is not None:
+            painter.setOpacity(1)
+            painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_SourceOver)
+            painter.drawImage(rect.topLeft(), self.above, rect)
+        else:
+            self.draw_layers(painter, self.layers[self.active + 1:], rect)
+
+        painter.end()
+
+    def refresh(self, index: int, rect: QRect = None):
+        """Пересобирает прямоугольник после изменения слоя index, которое прошло не через активный слой
+        (отмена шага на другом слое, видимость, непрозрачность или режим наложения)"""
+        rect = self.rect() if rect is None else rect.intersected(self.rect())
+
+        if self.is_simple() or self.below is None or (index > self.active and
+                                                      (self.above is not None) != self.can_merge_above()):
+            self.rebuild()
+        elif index < self.active:
+            self.compose_below(rect)
+            self.update(rect)
+        elif index > self.active and self.above is not None:
+            self.compose_above(rect)
+            self.update(rect)
+        else:
+            self.update(rect)
+
+    def index(self, layer: Layer) -> int:
+        return self.layers.index(layer)
+
+    def select(self, index: int):
+        if index != self.active and 0 <= index < len(self.layers):
+            self.active = index
+            self.rebuild()
+
+    def add_layer(self, name: str = None, shapes: VectorLayer = None) -> Layer:
+        """Добавляет прозрачный слой над активным и делает его активным. shapes - фигуры векторного слоя"""
+        self.counter += 1
+        default_name = f"Векторный слой {self.counter}" if shapes is not None else f"Слой {self.counter}"
+        layer = Layer(self.new_image(QImage.Format.Format_ARGB32), name or default_name)
+        layer.shapes = shapes
+
+        self.active += 1
+        self.layers.insert(self.active, layer)
+        self.rebuild()
+
+        return layer
+
+    def remove_layer(self, index: int) -> Layer:
+        if len(self.layers) == 1:
+            return None
+
+        layer = self.layers.pop(index)
+        self.active = min(self.active if index > self.active else max(self.active - 1, 0), len(self.layers) - 1)
+        self.rebuild()
+
+        return layer
+
+    def move_layer(self, index: int, offset: int):
+        """Сдвигает слой вверх (offset > 0) или вниз по стеку, активный слой остается активным"""
+        target = index + offset
+
+        if not 0 <= target < len(self.layers) or target == index:
+            return
+
+        current = self.current
+        self.layers.insert(target, self.layers.pop(index))
+        self.active = self.layers.index(current)
+        self.rebuild()
+
+    def restore(self, layers: list[Layer], active: int, counter: int):
+        """Заменяет состав стека целиком, этим пользуется восстановление после сбоя"""
+        self.layers = layers
+        self.active = min(max(active, 0), len(layers) - 1)
+        self.counter = counter
+        self.rebuild()
+
+    def set_visible(self, index: int, visible: bool):
+        self.layers[index].visible = visible
+        self.refresh(index)
+
+    def set_opacity(self, index: int, opacity: float):
+        self.layers[index].opacity = min(max(opacity, 0.0), 1.0)
+        self.refresh(index)
+
+    def set_blend_mode(self, index: int, blend_mode: str):
+        self.layers[index].blend_mode = blend_mode
+        self.refresh(index)
+
+    def flatten(self) -> QImage:
+        """Сводит видимые слои в одно изображение для сохранения. Прозрачность сохраняется, белой подложки нет"""
+        if self.is_simple():
+            return self.layers[0].image
+
+        image = self.new_image(QImage.Format.Format_ARGB32)
+
+        painter = QPainter(image)
+        self.draw_layers(painter, self.layers, image.rect())
+        painter.end()
+
+        return image
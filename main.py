@@ -1,10 +1,25 @@
 import sys
 import os
+import math
+import json
+import functools
 from PyQt6 import QtWidgets
-from PyQt6.QtGui import QMouseEvent, QPixmap, QImage, QColor, QIcon, QAction
-from PyQt6.QtCore import Qt, QPoint, QSize, pyqtSignal
+from PyQt6.QtGui import QMouseEvent, QWheelEvent, QPaintEvent, QPainter, QPixmap, QImage, QColor, QIcon, QAction, QActionGroup, QKeySequence
+from PyQt6.QtCore import Qt, QPoint, QRect, QRectF, QSize, QTimer, QThreadPool, pyqtSignal
 import typing
+import numpy as np
 import drawing
+import imagebuffer
+from history import History
+from tiles import TiledImage
+from mipmap import Mipmap
+from layers import LayerStack, BLEND_MODES
+from regions import RegionCache, Selection
+from vector import VectorLayer
+from profiler import profiler
+from frames import FrameScheduler
+import oplog
+import autosave
 from settings import Settings
 from style import style_sheet
 from icons.icon import icon
@@ -13,26 +28,247 @@ __author__ = "https://t.me/PyMapChannel"
 
 """Это главный модуль
 Для добавления нового инструмента из drawing.py, нужно:
-в классе ToolBar добавить кортеж из пути к иконке инструмента и класс нового инструмента"""
+в классе ToolBar добавить кортеж из пути к иконке инструмента и класс нового инструмента
 
-# УСТАНОВКА ЗАВИСЕМОСТЕЙ: pip install PyQt6
+Модули, которые нужны только командам меню (fileio - открытие и сохранение, filters, collab - совместная работа),
+импортируются при первой такой команде, а не до первого кадра: замер в python benchmark.py --suite startup"""
 
+# УСТАНОВКА ЗАВИСЕМОСТЕЙ: pip install PyQt6 numpy
+
+
+@functools.lru_cache(maxsize=None)
+def load_icon(path: str) -> QIcon:
+    """Иконки читаются и разбираются один раз, все кнопки с одной картинкой делят один QIcon"""
+    return QIcon(path)
+
+
+@functools.lru_cache(maxsize=1)
+def window_icon() -> QIcon:
+    """Иконка окна встроена в icons/icon.py байтами PNG, они декодируются при первом обращении"""
+    pixmap = QPixmap()
+    pixmap.loadFromData(icon)
+
+    return QIcon(pixmap)
+
+
+class CanvasView(QtWidgets.QWidget):
+    """Виджет, который рисует изображение сам: в paintEvent переносится только область, требующая перерисовки.
+    Для плиточного хранилища рисуются его плитки, а поверх них - окно image с началом в точке origin,
+    на котором сейчас рисует инструмент. В масштабе меньше 100% изображение берется из пирамиды mipmap"""
 
-class ScrollLabel(QtWidgets.QScrollArea):
     def __init__(self):
         super().__init__()
 
-        self.setWidgetResizable(True)
+        self.image = QImage()
+        self.overlay = QImage()
+        self.origin = QPoint()
+        self.store: TiledImage = None
+        self.mipmap: Mipmap = None
+        self.zoom = 1.0
+        self.drawing = False
+        self.selection = QImage()
+        self.selection_rect = QRect()
+        # уменьшенная копия открываемого изображения, она растягивается на его полный размер preview_size
+        self.preview = QImage()
+        self.preview_size = QSize()
+
+        # перерисовки копятся в dirty_rect и отдаются Qt не чаще раза за кадр экрана
+        self.dirty_rect = QRect()
+        self.frames = FrameScheduler(self.flush_update, self)
+
+        self.setAttribute(Qt.WidgetAttribute.WA_OpaquePaintEvent)
+
+    def set_image(self, image: QImage, overlay: QImage, origin: QPoint = QPoint(), store: TiledImage = None):
+        self.image = image
+        self.overlay = overlay
+        self.origin = origin
+        self.store = store
+
+        self.update_size()
+        self.update()
+
+    def image_size(self) -> QSize:
+        if not self.preview.isNull():
+            return self.preview_size
+
+        return self.store.size() if self.store is not None else self.image.size()
+
+    def set_preview(self, preview: QImage, size: QSize):
+        self.preview = preview
+        self.preview_size = size
+
+        self.update_size()
+        self.update()
+
+    def update_size(self):
+        size = self.image_size()
+
+        self.setFixedSize(math.ceil(size.width() * self.zoom), math.ceil(size.height() * self.zoom))
+
+    def set_zoom(self, zoom: float):
+        self.zoom = zoom
+
+        self.update_size()
+        self.update()
+
+    def to_image(self, rect: QRect) -> QRect:
+        """Переводит прямоугольник виджета в координаты изображения"""
+        return QRectF(rect.x() / self.zoom, rect.y() / self.zoom,
+                      rect.width() / self.zoom, rect.height() / self.zoom).toAlignedRect()
+
+    def update_image_rect(self, rect: QRect):
+        """Перерисовывает прямоугольник, заданный в координатах изображения, в ближайшем кадре"""
+        if rect.isEmpty():
+            return
+
+        self.dirty_rect = self.dirty_rect.united(
+            QRectF(rect.x() * self.zoom, rect.y() * self.zoom,
+                   rect.width() * self.zoom, rect.height() * self.zoom).toAlignedRect().adjusted(-1, -1, 1, 1))
+        self.frames.request()
+
+    def flush_update(self):
+        rect = self.dirty_rect
+        self.dirty_rect = QRect()
+
+        if not rect.isEmpty():
+            self.update(rect)
+
+    def paintEvent(self, event: QPaintEvent):
+        with profiler.span("CanvasView.paintEvent"):
+            self.paint(event)
+
+        profiler.frame()
+
+    def paint(self, event: QPaintEvent):
+        painter = QPainter(self)
+        painter.scale(self.zoom, self.zoom)
+
+        rect = self.to_image(event.rect()).intersected(QRect(QPoint(), self.image_size()))
+
+        if not self.preview.isNull():
+            painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+            painter.setClipRect(rect)
+            painter.drawImage(QRect(QPoint(), self.preview_size), self.preview)
+            painter.end()
+
+            return
+
+        level = self.mipmap.level_for(self.zoom) if self.mipmap is not None else 0
+
+        if self.zoom < 1:
+            painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+
+        if level:
+            self.draw_mipmap(painter, rect, level)
+        elif self.store is not None:
+            for tx, ty in self.store.tiles_in(rect):
+                tile_rect = self.store.tile_rect(tx, ty)
+                part = tile_rect.intersected(rect)
+
+                painter.drawImage(part, self.store.tile_image(tx, ty), part.translated(-tile_rect.topLeft()))
+        else:
+            painter.drawImage(rect, self.image, rect)
+
+        if self.drawing:
+            part = rect.intersected(QRect(self.origin, self.image.size()))
+
+            if not part.isEmpty():
+                if self.store is not None:
+                    painter.drawImage(part, self.image, part.translated(-self.origin))
+
+                painter.drawImage(part, self.overlay, part.translated(-self.origin))
+
+        part = rect.intersected(self.selection_rect)
+
+        if not part.isEmpty():
+            painter.drawImage(part, self.selection, part.translated(-self.selection_rect.topLeft()))
+
+        painter.end()
+
+    def draw_mipmap(self, painter: QPainter, rect: QRect, level: int):
+        """Рисует плитки уровня пирамиды, оставшееся уменьшение (не больше чем в 2 раза) делается сглаживанием"""
+        scale = 2 ** level
+
+        painter.save()
+        painter.scale(scale, scale)
+
+        level_rect = QRectF(rect.x() / scale, rect.y() / scale, rect.width() / scale, rect.height() / scale).toAlignedRect()
+
+        for tx, ty in self.mipmap.tiles_in(level, level_rect):
+            painter.drawImage(self.mipmap.tile_rect(level, tx, ty), self.mipmap.tile_image(level, tx, ty))
+
+        painter.restore()
 
-        self.label = QtWidgets.QLabel()
-        self.label.setAlignment(Qt.AlignmentFlag.AlignTop | Qt.AlignmentFlag.AlignLeft)
-        self.setWidget(self.label)
 
-    def setPixmap(self, pixmap: QPixmap):
-        self.label.setPixmap(pixmap)
+class ProfilerOverlay(QtWidgets.QLabel):
+    """Окно замеров поверх холста: кадры в секунду, задержка от события до кадра и самые долгие этапы"""
+
+    def __init__(self, parent: QtWidgets.QWidget):
+        super().__init__(parent)
+
+        self.setObjectName("profiler")
+        self.setAttribute(Qt.WidgetAttribute.WA_TransparentForMouseEvents)
+        self.move(8, 8)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.update_text)
+
+    def set_active(self, active: bool):
+        self.setVisible(active)
+
+        if active:
+            self.timer.start(250)
+            self.update_text()
+        else:
+            self.timer.stop()
+
+    def update_text(self):
+        profiler.tick()
+        summary = profiler.summary()
+
+        lines = [f"кадров/с: {profiler.fps()}"]
+
+        for name, item in sorted(summary.items(), key=lambda item: -item[1]["p95"])[:8]:
+            lines.append(f"{name:<26} {item['p50']:7.2f} {item['p95']:7.2f} мс")
+
+        self.setText("\n".join(lines))
+        self.adjustSize()
+        self.raise_()
+
+
+class ColorButton(QtWidgets.QPushButton):
+    """Круглая кнопка с цветом. Рамку рисует общая таблица стилей, а цвет кнопка заливает сама:
+    собственная таблица стилей у каждой кнопки заставляла Qt разбирать ее и заново оформлять кнопку
+    при создании и при каждой смене цвета"""
+
+    def __init__(self, color: QColor = None):
+        super().__init__()
+
+        self.color = QColor(color) if color is not None else QColor()
+
+    def set_color(self, color: QColor):
+        self.color = QColor(color)
 
         self.update()
 
+    def paintEvent(self, event: QPaintEvent):
+        super().paintEvent(event)
+
+        if not self.color.isValid():
+            return
+
+        # заливка внутри рамки и отступов из таблицы стилей
+        option = QtWidgets.QStyleOptionButton()
+        self.initStyleOption(option)
+        rect = self.style().subElementRect(QtWidgets.QStyle.SubElement.SE_PushButtonContents, option, self)
+
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setPen(Qt.PenStyle.NoPen)
+        painter.setBrush(self.color)
+        painter.drawEllipse(QRectF(rect))
+        painter.end()
+
 
 class Palette(QtWidgets.QWidget):
     colors = [
@@ -58,7 +294,7 @@ class Palette(QtWidgets.QWidget):
         self.grid_layout.setContentsMargins(0, 0, 0, 0)
         self.main_layout.addLayout(self.grid_layout)
 
-        self.primary_color_button = QtWidgets.QPushButton()
+        self.primary_color_button = ColorButton()
         self.primary_color_button.pressed.connect(self.choose_custom_color)
         self.primary_color_button.setObjectName("primary_color_button")
         self.primary_color_button.setFixedSize(34, 34)
@@ -84,39 +320,29 @@ class Palette(QtWidgets.QWidget):
         if color.isValid():
             self.primary_color = color
 
-            self.set_style_color_button()
+            self.primary_color_button.set_color(color)
 
             self.color_choosed.emit()
 
     def choose_new_color(self):
         self.primary_color = self.sender().color
 
-        self.set_style_color_button()
+        self.primary_color_button.set_color(self.primary_color)
 
         self.color_choosed.emit()
 
-    def set_style_color_button(self):
-        self.primary_color_button.setStyleSheet(f"""#primary_color_button {{
-            background-color: {self.primary_color.name()};
-        }}""")
-
-    class PaletteButton(QtWidgets.QPushButton):
+    class PaletteButton(ColorButton):
         color_choosed = pyqtSignal()
 
         def __init__(self, color: str):
-            super().__init__()
+            super().__init__(QColor(color))
 
-            self.color = QColor(color)
             self.str_color = color
 
             self.setFixedSize(QSize(22, 22))
             self.setObjectName("palette_button")
             self.clicked.connect(self._color_choosed)
 
-            self.setStyleSheet(f"""#palette_button {{
-                background-color: {self.str_color};
-            }}""")
-
         def _color_choosed(self):
             self.color_choosed.emit()
 
@@ -170,7 +396,9 @@ class ToolBar(QtWidgets.QWidget):
             (drawing.Spray, "./icons/spray.png"),
             (drawing.Line, "./icons/line.png"),
             (drawing.Rectangle, "./icons/rectangle.png"),
-            (drawing.Ellipse, "./icons/ellipse.png")
+            (drawing.Ellipse, "./icons/ellipse.png"),
+            (drawing.MagicWand, "./icons/wand.png"),
+            (drawing.ShapeMover, "./icons/move.png")
         ]
 
         self.init_button = None
@@ -205,7 +433,7 @@ class ToolBar(QtWidgets.QWidget):
             super().__init__()
 
             self.tool = tool
-            self.image = QIcon(image)
+            self.image = load_icon(image)
 
             self.setFixedSize(QSize(32, 32))
             self.setObjectName("tool_button")
@@ -213,24 +441,30 @@ class ToolBar(QtWidgets.QWidget):
             self.setIcon(self.image)
             self.clicked.connect(self._tool_choosed)
 
-            self.set_style_normal()
-
         def _tool_choosed(self):
             self.tool_choosed.emit()
 
         def set_style_normal(self):
-            self.setProperty("state", "normal")
-
-            self.setStyle(self.style())
+            self.set_state("normal")
 
         def set_style_selected(self):
-            self.setProperty("state", "selected")
+            self.set_state("selected")
+
+        def set_state(self, state: str):
+            """Правила для состояний уже есть в общей таблице стилей, кнопке достаточно заново применить их к себе"""
+            if self.property("state") == state:
+                return
 
-            self.setStyle(self.style())
+            self.setProperty("state", state)
+            self.style().unpolish(self)
+            self.style().polish(self)
+            self.update()
 
 
 class SizeCombobox(QtWidgets.QComboBox):
+    """Толщину можно выбрать из списка или ввести любую от 1 до max_width"""
     size_changed = pyqtSignal(int)
+    max_width = 500
 
     def __init__(self):
         super().__init__()
@@ -239,24 +473,58 @@ class SizeCombobox(QtWidgets.QComboBox):
         self.setSizePolicy(QtWidgets.QSizePolicy.Policy.Fixed, QtWidgets.QSizePolicy.Policy.Fixed)
         self.currentIndexChanged.connect(self.changed_size)
 
-        self.view().window().setWindowFlags(Qt.WindowType.Popup | Qt.WindowType.FramelessWindowHint | Qt.WindowType.NoDropShadowWindowHint)
-        self.view().window().setAttribute(Qt.WidgetAttribute.WA_TranslucentBackground)
+        self.setEditable(True)
+        self.setInsertPolicy(QtWidgets.QComboBox.InsertPolicy.NoInsert)
+        self.lineEdit().editingFinished.connect(self.entered_size)
+
+        self.popup_ready = False
+
+    def showPopup(self):
+        """Окно списка Qt создает только при первом обращении к нему, поэтому оно настраивается перед первым показом,
+        а не при запуске"""
+        if not self.popup_ready:
+            self.view().window().setWindowFlags(Qt.WindowType.Popup | Qt.WindowType.FramelessWindowHint | Qt.WindowType.NoDropShadowWindowHint)
+            self.view().window().setAttribute(Qt.WidgetAttribute.WA_TranslucentBackground)
+            self.popup_ready = True
 
-    def add_items(self, items: list[int], current_index: int):
+        super().showPopup()
+
+    def add_items(self, items: list[int], current: int):
+        """Заполняет список, current - текущая толщина, она добавляется в список, если ее там нет"""
         self.blockSignals(True)
         self.clear()
 
-        for i in items:
+        for i in sorted(set(items) | {current}):
             self.addItem(f"{i} пкс", i)
 
         self.blockSignals(False)
-        self.setCurrentIndex(current_index)
+        self.setCurrentIndex(self.findData(current))
 
     def changed_size(self, item: int):
-        self.size_changed.emit(self.itemData(item))
+        if item >= 0:
+            self.size_changed.emit(self.itemData(item))
+
+    def entered_size(self):
+        digits = "".join(char for char in self.currentText() if char.isdigit())
 
+        if not digits:
+            self.setEditText(self.itemText(self.currentIndex()))
+            return
+
+        width = min(max(int(digits), 1), self.max_width)
+        items = [self.itemData(i) for i in range(self.count())]
+
+        self.add_items(items, width)
+        self.size_changed.emit(width)
+
+
+class Canvas(QtWidgets.QScrollArea):
+    zoom_levels = (0.125, 0.25, 0.33, 0.5, 0.67, 1, 1.5, 2, 3, 4, 6, 8)
+    layers_changed = pyqtSignal()
+    selection_changed = pyqtSignal()
+    status_message = pyqtSignal(str)
+    session_changed = pyqtSignal()
 
-class Canvas(ScrollLabel):
     def __init__(self):
         super().__init__()
 
@@ -265,32 +533,631 @@ class Canvas(ScrollLabel):
 
         self.setObjectName("canvas")
         self.setSizePolicy(QtWidgets.QSizePolicy.Policy.Expanding, QtWidgets.QSizePolicy.Policy.Expanding)
+        self.setAlignment(Qt.AlignmentFlag.AlignTop | Qt.AlignmentFlag.AlignLeft)
 
-        self.new_image(self.img_width, self.img_height)
+        self.view = CanvasView()
+        self.setWidget(self.view)
 
         self.drawing = False
         self.settings = Settings()
         self.last_point = QPoint()
+        self.pending_points: list[QPoint] = []
+        self.stroke_rect = QRect()
         self.tool: drawing.BaseTool = None
+        self.history = History(self.settings.history)
+        # движок фильтров создается при первом фильтре
+        self.filters: FilterEngine = None
+        self.regions = RegionCache(self.settings.fill)
+        self.selection: Selection = None
+        self.store: TiledImage = None
+        self.layers: LayerStack = None
+        self.origin = QPoint()
+        self.locked = False
+        self.log = oplog.OperationLog(0, 0)
+        self.operation: oplog.Operation = None
+        self.seeds = np.random.default_rng(self.settings.spray.seed)
+        self.journal = autosave.Journal(self.settings.autosave)
+
+        # совместная работа (collab.py): записи с сервера, которые ждут конца штриха или разблокировки холста
+        self.session: collab.Session = None
+        self.remote_records: list[tuple[bytes, bytes]] = []
+
+        self.sync_timer = QTimer(self)
+        self.sync_timer.setSingleShot(True)
+        self.sync_timer.timeout.connect(self.sync)
+
+        self.autosave_timer = QTimer(self)
+        self.autosave_timer.timeout.connect(self.checkpoint)
+
+        self.emission_timer = QTimer(self)
+        self.emission_timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self.emission_timer.timeout.connect(self.emit_tool)
+
+        # точки движения мыши отдаются инструменту пачками, не чаще раза за кадр (frames.py)
+        self.input_frames = FrameScheduler(self.flush_points, self, self.settings.input.frame_rate)
+        self.view.frames.set_rate(self.settings.input.frame_rate)
+
+        self.profiler_overlay = ProfilerOverlay(self.viewport())
+        self.profiler_overlay.set_active(profiler.enabled)
+
+        self.new_image(self.img_width, self.img_height)
 
     def open_image(self, path: str):
-        self.image = QImage(path)
+        import fileio
+
+        self.set_opened(fileio.read_image(path, self.settings.tiles), path)
+
+    def set_preview(self, preview: QImage = None, size: QSize = None):
+        """Показывает уменьшенную копию открываемого изображения, пока оно декодируется целиком. До тех пор холст
+        заблокирован: правки уменьшенной копии нечем было бы перенести на полное изображение.
+        None - убрать копию (открытие отменено или не удалось)"""
+        if preview is None:
+            if not self.view.preview.isNull():
+                self.view.set_preview(QImage(), QSize())
+
+            return
+
+        self.locked = True
+        self.view.set_preview(preview, size)
+
+    def set_opened(self, image: QImage | TiledImage, source: str = None):
+        """Показывает изображение, загруженное fileio из файла source, в общем формате пикселей.
+        Путь к файлу записывается в журнал действий, чтобы воспроизведение начиналось с этого изображения"""
+        self.set_preview(None)
 
-        self.setPixmap(QPixmap.fromImage(self.image))
+        if source is not None:
+            source = os.path.abspath(source)
+
+        if isinstance(image, TiledImage):
+            self.set_store(image, source)
+
+            return
+
+        self.image = imagebuffer.canonical(image)
+        self.set_image(source)
 
     def new_image(self, width: int, height: int):
         self.img_width = width
         self.img_height = height
 
+        if width * height > self.settings.tiles.threshold:
+            self.set_store(TiledImage(width, height, self.settings.tiles))
+
+            return
+
         self.image = QImage(width, height, QImage.Format.Format_RGB32)
         self.image.fill(Qt.GlobalColor.white)
 
-        self.setPixmap(QPixmap.fromImage(self.image))
+        self.set_image()
+
+    def set_image(self, source: str = None):
+        """Создает прозрачный слой предпросмотра размером с изображение"""
+        self.store = None
+        self.origin = QPoint()
+
+        self.set_overlay()
+        self.set_selection(None)
+
+        self.layers = LayerStack(self.image)
+        self.history.reset(imagebuffer.pixel_array(self.image).copy(), self.layers.current)
+
+        self.view.mipmap = Mipmap(self.mipmap_source, self.image.width(), self.image.height(),
+                                  budget=self.settings.tiles.mipmap_budget)
+        self.view.set_image(self.layers.composite, self.overlay)
+
+        self.log = oplog.OperationLog(self.image.width(), self.image.height(), source)
+        self.reset_journal()
+        self.reset_session()
+        self.layers_changed.emit()
+
+    def set_store(self, store: TiledImage, source: str = None):
+        """Переключает холст на плиточное хранилище. Окно, на котором рисуют инструменты, загружается при нажатии мыши"""
+        self.store = store
+        self.layers = None
+        self.origin = QPoint()
+        self.image = QImage()
+
+        self.set_overlay()
+        self.set_selection(None)
+
+        self.history.reset(self.store)
+
+        self.view.mipmap = Mipmap(self.mipmap_source, self.store.width, self.store.height,
+                                  budget=self.settings.tiles.mipmap_budget)
+        self.view.set_image(self.image, self.overlay, self.origin, self.store)
+
+        self.log = oplog.OperationLog(self.store.width, self.store.height, source)
+        self.reset_journal()
+        self.reset_session()
+        self.layers_changed.emit()
+
+    def mipmap_source(self, rect: QRect) -> np.ndarray:
+        if self.store is not None:
+            return imagebuffer.pixel_array(self.store.read(rect))
+
+        pixels = imagebuffer.pixel_array(self.layers.composite, readonly=True)
+
+        return pixels[rect.top():rect.bottom() + 1, rect.left():rect.right() + 1]
+
+    def set_zoom(self, zoom: float, anchor: QPoint = None):
+        """Меняет масштаб так, чтобы точка изображения под anchor (координаты области просмотра) осталась на месте"""
+        if anchor is None:
+            anchor = self.viewport().rect().center()
+
+        old_zoom = self.view.zoom
+        x = (anchor.x() + self.horizontalScrollBar().value()) / old_zoom
+        y = (anchor.y() + self.verticalScrollBar().value()) / old_zoom
+
+        self.view.set_zoom(zoom)
+
+        self.horizontalScrollBar().setValue(round(x * zoom - anchor.x()))
+        self.verticalScrollBar().setValue(round(y * zoom - anchor.y()))
+
+    def zoom_in(self, anchor: QPoint = None):
+        larger = [zoom for zoom in Canvas.zoom_levels if zoom > self.view.zoom]
+
+        if larger:
+            self.set_zoom(larger[0], anchor)
+
+    def zoom_out(self, anchor: QPoint = None):
+        smaller = [zoom for zoom in Canvas.zoom_levels if zoom < self.view.zoom]
+
+        if smaller:
+            self.set_zoom(smaller[-1], anchor)
+
+    def wheelEvent(self, event: QWheelEvent):
+        if event.modifiers() & Qt.KeyboardModifier.ControlModifier:
+            if event.angleDelta().y() > 0:
+                self.zoom_in(event.position().toPoint())
+            elif event.angleDelta().y() < 0:
+                self.zoom_out(event.position().toPoint())
+        else:
+            super().wheelEvent(event)
+
+    def visible_rect(self) -> QRect:
+        """Видимая часть холста в координатах изображения"""
+        return self.view.to_image(QRect(self.horizontalScrollBar().value(), self.verticalScrollBar().value(),
+                                        self.viewport().width(), self.viewport().height()))
+
+    def set_overlay(self):
+        self.overlay = QImage(self.image.size(), QImage.Format.Format_ARGB32_Premultiplied)
+        self.overlay.fill(Qt.GlobalColor.transparent)
+
+        if self.tool is not None:
+            self.tool.overlay = self.overlay
+
+    def load_window(self):
+        """Загружает из хранилища окно по видимой части холста, выровненное по плиткам"""
+        rect = self.store.align(self.visible_rect())
+
+        self.origin = rect.topLeft()
+        self.image = self.store.read(rect)
+
+        self.set_overlay()
+
+        self.view.set_image(self.image, self.overlay, self.origin, self.store)
+
+    def close_window(self):
+        """Окно уже записано в хранилище историей изменений, дальше холст рисуется по плиткам"""
+        self.image = QImage()
+
+        self.set_overlay()
+
+        self.view.set_image(self.image, self.overlay, self.origin, self.store)
+
+    def snapshot(self) -> QImage | TiledImage:
+        """Снимок для сохранения в фоне. Копия QImage разделяет данные с холстом, пока он их не изменит.
+        Плиточное хранилище не копируется, поэтому до конца сохранения холст блокируется"""
+        if self.store is not None:
+            self.locked = True
+
+            return self.store
+
+        return QImage(self.export_image())
+
+    def export_image(self) -> QImage:
+        """Сведенное изображение, слои объединяются"""
+        if self.store is not None:
+            return self.store.to_image()
+
+        return self.layers.flatten()
+
+    def start_autosave(self):
+        """Включает журнал автосохранения, окно вызывает это после того, как решило судьбу прошлого журнала"""
+        if not self.journal.enabled:
+            return
+
+        self.journal.active = True
+        self.reset_journal()
+        self.autosave_timer.start(self.journal.interval)
+
+    def reset_journal(self, snapshot: bool = False):
+        """Начинает журнал заново с текущего изображения: исходного файла или чистого холста.
+        snapshot - записать в журнал все изображение, чтобы он не зависел от исходного файла"""
+        if not self.journal.active:
+            return
+
+        source = None if snapshot else self.log.source
+        base = {"width": self.log.width, "height": self.log.height, "source": source}
+        mirrors = self.history.mirrors if snapshot else None
+
+        if source is not None:
+            base.update(autosave.source_stat(source))
+
+        if self.store is not None:
+            # плитки журнала совпадают с плитками хранилища, чтобы при восстановлении писать в него срезами
+            self.journal.reset(base, tile_size=self.store.tile_size, mirrors=mirrors)
+        else:
+            self.journal.reset(base, self.layers, mirrors=mirrors)
+
+    def file_saved(self, path: str):
+        """Изображение сохранено в файл. Если им перезаписан исходный файл, журнал больше не может опираться
+        на него и начинается заново со снимка"""
+        source = self.log.source
+
+        if source is not None and os.path.normcase(os.path.abspath(path)) == os.path.normcase(source):
+            self.reset_journal(snapshot=True)
+
+    def mark_tiles(self, layer, rect: QRect):
+        """Отмечает измененные плитки слоя для журнала автосохранения и для участников совместной работы"""
+        self.journal.mark(layer, rect)
+
+        if self.session is not None:
+            self.session.mark(layer, rect)
+            self.sync_timer.start()
+
+    def mark_layers(self):
+        self.journal.mark_layers()
+
+        if self.session is not None:
+            self.session.mark_layers()
+            self.sync_timer.start()
+
+    def checkpoint(self):
+        """Записывает в журнал плитки, изменившиеся с прошлого раза. Незаконченный штрих подождет отпускания мыши"""
+        if not self.drawing:
+            with profiler.span("Journal.checkpoint"):
+                self.journal.checkpoint(self.history.mirrors, self.layers)
+
+    def recover(self):
+        """Восстанавливает изображение из журнала прошлого запуска: открывает исходный файл (или создает холст)
+        и по порядку применяет записи журнала. После этого журнал начинается заново с восстановленного состояния"""
+        records = iter(autosave.read_journal(self.journal.path))
+        kind, payload = next(records, (None, None))
+
+        if kind != autosave.BASE:
+            raise OSError("Журнал автосохранения поврежден")
+
+        base = json.loads(payload)
+        source = base["source"]
+
+        if source is None:
+            self.new_image(base["width"], base["height"])
+        else:
+            if not os.path.isfile(source):
+                raise OSError(f"Исходный файл не найден: {source}")
+
+            if autosave.source_stat(source) != {"size": base["size"], "mtime": base["mtime"]}:
+                raise OSError(f"Исходный файл изменился после сбоя: {source}")
+
+            self.open_image(source)
+
+        layers = {0: None if self.layers is None else self.layers.current}
+        changed: list[tuple[object, QRect]] = []
+
+        for kind, payload in records:
+            if kind == autosave.LAYR and self.layers is not None:
+                self.restore_layers(json.loads(payload), layers)
+            elif kind == autosave.TILE_RECORD:
+                layer_id, x, y, pixels = autosave.unpack_tile(payload)
+
+                if layer_id not in layers:
+                    continue
+
+                layer = layers[layer_id]
+                changed.append((layer, self.write_tile(layer, x, y, pixels)))
+
+        if self.layers is not None:
+            self.rebuild_layers()
+
+        self.regions.invalidate()
+        self.view.mipmap.invalidate(QRect(0, 0, self.log.width, self.log.height))
+        self.view.update()
+        self.layers_changed.emit()
+
+        self.start_autosave()
+        self.mark_layers()
+
+        for layer, rect in changed:
+            if layer is None or layer in self.history.mirrors:
+                self.mark_tiles(layer, rect)
+
+        self.checkpoint()
+
+    def write_tile(self, layer, x: int, y: int, pixels: np.ndarray) -> QRect:
+        """Записывает плитку в слой и в его копию в истории, мимо истории изменений. Отмена своих шагов
+        эти пиксели больше не трогает. Плитка попадает в журнал действий и отмечается для автосохранения
+        (но не для участников совместной работы: она либо пришла от них, либо восстановлена до подключения)"""
+        h, w = pixels.shape
+        rect = QRect(x, y, w, h)
+
+        self.history.write(layer, rect, pixels)
+
+        if layer is not None:
+            imagebuffer.pixel_array(layer.image)[y:y + h, x:x + w] = pixels
+
+        index = 0 if self.layers is None else self.layers.index(layer)
+        self.log.operations.append(oplog.tile_operation(index, x, y, pixels))
+        self.journal.mark(layer, rect)
+
+        return rect
+
+    def rebuild_layers(self):
+        self.layers.rebuild()
+        self.image = self.layers.current.image
+        self.view.image = self.layers.composite
+        self.history.select(self.layers.current)
+
+    def restore_layers(self, data: dict, layers: dict):
+        """Приводит стек к составу из записи LAYR. layers - слои по номерам журнала, новые слои создаются прозрачными.
+        Состав записывается в журнал действий как "restore_layers" и отмечается для автосохранения"""
+        entries = []
+
+        for entry in data["layers"]:
+            layer = layers.get(entry["id"])
+            index = self.layers.index(layer) if layer in self.layers.layers else None
+            entries.append({"index": index, **{key: entry[key] for key in ("name", "visible", "opacity", "blend_mode")}})
+
+        operation = oplog.Operation("restore_layers", params={"layers": entries, "active": data["active"],
+                                                              "counter": data["counter"]})
+        oplog.apply_layer_operation(self.layers, self.history, operation)
+
+        layers.clear()
+        layers.update((entry["id"], layer) for entry, layer in zip(data["layers"], self.layers.layers))
+
+        self.log.operations.append(operation)
+        self.journal.mark_layers()
+
+    def connect_session(self, host: str, port: int):
+        """Подключается к серверу совместной работы. Если общего холста там еще нет, публикуется этот"""
+        if self.store is not None:
+            self.refuse_session()
+            return
+
+        import collab
+
+        self.disconnect_session()
+
+        self.session = collab.Session(self.settings.collab, self)
+        self.session.message.connect(self.status_message)
+        self.session.empty.connect(self.reset_session)
+        self.session.received.connect(self.apply_remote)
+        self.session.closed.connect(self.session_closed)
+        self.session.open(host, port)
+
+        self.session_changed.emit()
+
+    def disconnect_session(self):
+        if self.session is not None:
+            session, self.session = self.session, None
+            session.closed.disconnect(self.session_closed)
+            session.close()
+            session.deleteLater()
+
+            self.remote_records.clear()
+            self.session_changed.emit()
+
+    def refuse_session(self):
+        self.disconnect_session()
+        self.status_message.emit("Большие изображения в плиточном хранилище нельзя редактировать совместно")
+
+    def session_closed(self):
+        if self.sender() is self.session:
+            self.disconnect_session()
+            self.status_message.emit("Совместная работа завершена")
+
+    def reset_session(self):
+        """Новое, открытое или восстановленное изображение становится общим холстом"""
+        if self.session is None:
+            return
+
+        if self.store is not None:
+            self.refuse_session()
+            return
+
+        self.remote_records.clear()
+        self.session.publish(self.image.width(), self.image.height(), self.history.mirrors, self.layers)
+
+    def sync(self):
+        """Отправляет отмеченные плитки участникам. Незаконченный штрих подождет отпускания мыши"""
+        if self.session is not None and not self.drawing:
+            self.session.flush(self.history.mirrors, self.layers)
+
+    def apply_remote(self, records: list[tuple[bytes, bytes]]):
+        """Применяет записи других участников мимо истории изменений. Во время штриха и пока холст заблокирован
+        они копятся и применяются потом"""
+        self.remote_records.extend(records)
+
+        if self.drawing or self.locked or self.session is None:
+            return
+
+        records, self.remote_records = self.remote_records, []
+        ids = self.session.layers
+        dirty = QRect()
+        restacked = False
+
+        for kind, payload in records:
+            if kind == autosave.BASE:
+                base = json.loads(payload)
+
+                # такой холст открылся бы плиточным хранилищем, а у него нет слоев
+                if base["width"] * base["height"] > self.settings.tiles.threshold:
+                    self.refuse_session()
+                    break
+
+                # свой холст заменяется общим, публиковать его обратно не нужно
+                session, self.session = self.session, None
+                self.new_image(base["width"], base["height"])
+                self.session = session
+
+                # прежний фон этого окна не входит в общий состав слоев и будет удален первой записью LAYR
+                ids.clear()
+                ids[-1] = self.layers.current
+                dirty = self.layers.rect()
+            elif kind == autosave.LAYR:
+                data = json.loads(payload)
+                current = next((layer_id for layer_id, layer in ids.items() if layer is self.layers.current), None)
+                order = [entry["id"] for entry in data["layers"]]
+
+                # активный слой у каждого участника свой
+                active = order.index(current) if current in order else min(self.layers.active, len(order) - 1)
+
+                self.restore_layers({**data, "active": active}, ids)
+                restacked = True
+                dirty = self.layers.rect()
+            elif kind == autosave.TILE_RECORD:
+                layer_id, x, y, pixels = autosave.unpack_tile(payload)
+                layer = ids.get(layer_id)
+
+                if layer is None:
+                    continue
+
+                rect = self.write_tile(layer, x, y, pixels)
+                dirty = dirty.united(rect)
+
+                if not restacked:
+                    self.layers.refresh(self.layers.index(layer), rect)
+
+        if restacked:
+            self.rebuild_layers()
+            self.layers_changed.emit()
+        else:
+            self.view.image = self.layers.composite
+
+        if not dirty.isEmpty():
+            self.regions.invalidate(dirty)
+            self.update_image_rect(dirty)
+
+    def undo(self):
+        if not self.drawing and not self.locked and self.history.can_undo():
+            self.apply_history(self.history.undo_layer(), self.history.undo)
+            self.log.operations.append(oplog.Operation("undo"))
+
+    def redo(self):
+        if not self.drawing and not self.locked and self.history.can_redo():
+            self.apply_history(self.history.redo_layer(), self.history.redo)
+            self.log.operations.append(oplog.Operation("redo"))
+
+    def apply_history(self, layer, action: typing.Callable):
+        """Отменяет или повторяет шаг истории, который может относиться и к неактивному слою"""
+        if self.layers is None:
+            rect = action(self.get_window(), self.origin)
+        else:
+            rect = action(layer.image)
+
+            self.layers.refresh(self.layers.index(layer), rect)
+            self.view.image = self.layers.composite
+
+        self.mark_tiles(layer, rect)
+        self.regions.invalidate(rect)
+        self.update_image_rect(rect)
+
+    def apply_filter(self, name: str, **params):
+        """Применяет фильтр из filters.py к выделению или, если его нет, ко всему активному слою.
+        Векторный слой фильтры не меняют"""
+        if self.layers is None or self.drawing or self.locked or self.current_shapes() is not None:
+            return
+
+        from filters import FilterEngine, make_filter
+
+        if self.filters is None:
+            self.filters = FilterEngine(self.settings.filters)
+
+        pixels = imagebuffer.pixel_array(self.image)
+
+        if self.selection is None:
+            self.filters.run(make_filter(name, **params), pixels)
+            rect = self.image.rect()
+        else:
+            self.filters.run(make_filter(name, **params), pixels, self.selection.mask, self.selection.box())
+            rect = self.selection.rect
+
+        self.log.operations.append(oplog.Operation("filter", params={"name": name, **params}))
+        self.commit_change(rect)
+
+    def commit_change(self, rect: QRect):
+        """Записывает в историю изменение активного слоя, которое прошло мимо инструмента, и показывает его"""
+        self.history.commit(self.image, rect)
+        self.mark_tiles(self.layers.current, rect)
+        self.regions.invalidate(rect)
+
+        self.layers.update(rect)
+        self.view.image = self.layers.composite
+        self.update_image_rect(rect)
+
+    def set_selection(self, selection: Selection):
+        """Показывает границу нового выделения (None - снять выделение)"""
+        self.view.update_image_rect(self.view.selection_rect)
+
+        self.selection = selection
+        self.view.selection = QImage() if selection is None else selection.outline()
+        self.view.selection_rect = QRect() if selection is None else selection.rect
+
+        self.view.update_image_rect(self.view.selection_rect)
+        self.selection_changed.emit()
+
+    def deselect(self):
+        if self.selection is not None and not self.drawing and not self.locked:
+            self.set_selection(None)
+            self.log.operations.append(oplog.Operation("deselect"))
+
+    def delete_selection(self):
+        """Стирает выделенные пиксели активного растрового слоя"""
+        if self.selection is None or self.layers is None or self.drawing or self.locked or self.current_shapes() is not None:
+            return
+
+        rect = self.selection.clear(self.image)
+
+        self.log.operations.append(oplog.Operation("delete_selection"))
+        self.commit_change(rect)
+
+    def change_layers(self, kind: str, **params):
+        """Выполняет действие со слоями: добавление, удаление, выбор, перемещение или изменение свойств.
+        Слои есть только у изображений в памяти, плиточное хранилище всегда однослойное"""
+        if self.layers is None or self.drawing or self.locked:
+            return
+
+        operation = oplog.Operation(kind, params=params)
+        oplog.apply_layer_operation(self.layers, self.history, operation)
+
+        self.image = self.layers.current.image
+        self.log.operations.append(operation)
+        self.mark_layers()
+
+        self.view.image = self.layers.composite
+        self.view.mipmap.invalidate(self.layers.rect())
+        self.view.update()
+
+        self.layers_changed.emit()
+
+    def update_image_rect(self, rect: QRect):
+        """Перерисовывает прямоугольник изображения, который изменился в обход инструмента"""
+        self.view.mipmap.invalidate(rect)
+        self.view.update_image_rect(rect)
+
+    def get_window(self) -> QImage:
+        return None if self.image.isNull() else self.image
 
     def update_tool(self, tool: type = None):
         tool = tool or self.tool.__class__
 
+        if self.tool is not None:
+            self.emission_timer.stop()
+            self.tool.end_stroke()
+
         self.tool = tool(self.settings)
+        self.tool.overlay = self.overlay
+        self.tool.regions = self.regions
     
     def update_tool_width(self, width: int):
         tool_class: drawing.BaseTool = self.tool.__class__
@@ -311,44 +1178,200 @@ class Canvas(ScrollLabel):
 
         self.update_tool()
 
+    def current_shapes(self) -> VectorLayer:
+        """Фигуры активного слоя или None, если слой растровый"""
+        return self.layers.current.shapes if self.layers is not None else None
+
     def mousePressEvent(self, event: QMouseEvent):
-        if event.button() == Qt.MouseButton.LeftButton:
+        if event.button() == Qt.MouseButton.LeftButton and not self.locked:
+            shapes = self.current_shapes()
+
+            # растровые инструменты испортили бы растеризацию фигур
+            if shapes is not None and not self.tool.vector:
+                self.status_message.emit("На векторном слое работают только фигуры и перемещение фигур")
+
+                return
+
+            # инструмент видел бы только загруженное окно, и область обрывалась бы на его краю
+            if self.store is not None and not self.tool.tiled:
+                self.status_message.emit("Заливка и выделение областей не работают в плиточном хранилище")
+
+                return
+
+            profiler.input_event()
+
+            if self.store is not None:
+                self.load_window()
+
             self.drawing = True
+            self.view.drawing = True
             self.last_point = self.get_point(event.pos())
+            self.pending_points.clear()
+            self.stroke_rect = QRect()
+
+            seed = int(self.seeds.integers(2 ** 32))
+            self.tool.set_seed(seed)
+            self.tool.shapes = shapes
+            self.tool.begin_stroke(self.image)
+
+            self.operation = oplog.Operation("stroke", self.tool.__class__.__name__,
+                                             oplog.settings_to_dict(self.settings), seed)
+            self.operation.add_event("press", [self.last_point], self.origin)
 
-            new_image = self.tool.mouse_press_event(self.image, self.last_point)
+            self.tool.dirty_rect = None
+            with profiler.span("tool.mouse_press_event"):
+                result = drawing.edit_result(self.tool, self.tool.mouse_press_event(self.image, self.last_point))
 
-            self.setPixmap(QPixmap.fromImage(new_image))
+            if self.tool.emission_rate:
+                self.emission_timer.start(1000 // self.tool.emission_rate)
+
+            self.show_image(result)
 
     def mouseMoveEvent(self, event: QMouseEvent):
+        """Точки копятся и передаются инструменту пачкой в ближайшем кадре. Событие только запоминает точку,
+        поэтому частота мыши почти не влияет на нагрузку. Повтор той же точки пропускается"""
         if (event.buttons() & Qt.MouseButton.LeftButton) and self.drawing:
-            new_image = self.tool.mouse_move_event(self.image, self.last_point, self.get_point(event.pos()))
+            profiler.input_event()
 
-            self.last_point = self.get_point(event.pos())
+            point = self.get_point(event.pos())
+
+            if point == (self.pending_points[-1] if self.pending_points else self.last_point):
+                return
+
+            self.pending_points.append(point)
+            self.input_frames.request()
+
+    def flush_points(self):
+        self.input_frames.cancel()
+
+        if not self.pending_points or not self.drawing:
+            return
+
+        points = self.pending_points
+        self.pending_points = []
+
+        self.operation.add_event("move", points, self.origin)
+
+        self.tool.dirty_rect = None
+        with profiler.span("tool.mouse_move_points"):
+            result = drawing.edit_result(self.tool, self.tool.mouse_move_points(self.image, self.last_point, points))
+
+        self.last_point = points[-1]
+
+        self.show_image(result)
+
+    def emit_tool(self):
+        """Вызывается по таймеру с постоянной частотой, пока зажата кнопка мыши"""
+        if not self.drawing:
+            return
+
+        self.flush_points()
+
+        self.operation.add_event("hold", [self.last_point], self.origin)
+
+        self.tool.dirty_rect = None
+        with profiler.span("tool.mouse_hold_event"):
+            result = drawing.edit_result(self.tool, self.tool.mouse_hold_event(self.image, self.last_point))
 
-            self.setPixmap(QPixmap.fromImage(new_image))
+        self.show_image(result)
 
     def mouseReleaseEvent(self, event: QMouseEvent):
-        if event.button() == Qt.MouseButton.LeftButton:
+        if event.button() == Qt.MouseButton.LeftButton and self.drawing:
+            self.emission_timer.stop()
+            self.flush_points()
+
             self.drawing = False
+            self.view.drawing = False
+
+            point = self.get_point(event.pos())
+            self.operation.add_event("release", [point], self.origin)
+            self.log.operations.append(self.operation)
+
+            self.tool.dirty_rect = None
+            with profiler.span("tool.mouse_release_event"):
+                result = drawing.edit_result(self.tool, self.tool.mouse_release_event(self.image, point))
+                self.tool.end_stroke()
+
+            self.show_image(result)
+
+            shapes = self.current_shapes()
+
+            with profiler.span("History.commit"):
+                self.history.commit(self.image, self.stroke_rect, self.origin,
+                                    shapes.take_edit() if shapes is not None else None)
+
+            self.mark_tiles(self.history.layer, self.stroke_rect.translated(self.origin))
+
+            if self.store is not None:
+                self.view.mipmap.invalidate(self.stroke_rect.translated(self.origin))
+                self.close_window()
+
+            if self.remote_records:
+                self.apply_remote([])
+
+    def show_image(self, result: drawing.EditResult):
+        """Перерисовывает только тот прямоугольник, который изменил инструмент"""
+        with profiler.span("Canvas.show_image"):
+            self.update_dirty(result)
+
+    def update_dirty(self, result: drawing.EditResult):
+        """Предпросмотр только перерисовывается, изменения изображения еще и копятся в stroke_rect для истории"""
+        rect = result.dirty()
+
+        # выделение есть только у изображений в памяти: у плиточного хранилища нет фильтров и слоев
+        if result.selection is not None and self.store is None:
+            self.set_selection(result.selection)
+
+        if result.repaint is not None:
+            self.view.update_image_rect(result.repaint.translated(self.origin))
+
+        if result.preview:
+            self.view.update_image_rect(rect.translated(self.origin))
+
+            return
+
+        image = self.image = result.surface
+
+        if self.layers is not None:
+            self.layers.current.image = image
+
+            if not rect.isEmpty():
+                self.layers.update(rect)
+
+            image = self.layers.composite
+
+        self.view.image = image
+
+        if rect.isEmpty():
+            return
+
+        self.stroke_rect = self.stroke_rect.united(rect)
+        self.regions.invalidate(rect)
 
-            new_image = self.tool.mouse_release_event(self.image, self.get_point(event.pos()))
+        # в плиточном режиме пирамида строится из хранилища, которое изменится только при отпускании мыши
+        if self.store is None:
+            self.view.mipmap.invalidate(rect)
 
-            self.setPixmap(QPixmap.fromImage(new_image))
+        self.view.update_image_rect(rect.translated(self.origin))
 
     def get_point(self, point: QPoint):
-        return point + QPoint(self.horizontalScrollBar().value(), self.verticalScrollBar().value())
+        """Переводит точку области просмотра в координаты изображения, на котором рисует инструмент"""
+        x = (point.x() + self.horizontalScrollBar().value()) / self.view.zoom
+        y = (point.y() + self.verticalScrollBar().value()) / self.view.zoom
+
+        return QPoint(math.floor(x), math.floor(y)) - self.origin
 
 
 class Window(QtWidgets.QMainWindow):
     def __init__(self):
         super().__init__()
 
-        pixmap = QPixmap()
-        QPixmap.loadFromData(pixmap, icon)
+        # общая таблица стилей ставится до создания виджетов: каждый оформляется один раз при первом показе,
+        # а не второй раз, когда таблица появляется у уже готового окна
+        self.setStyleSheet(style_sheet)
 
         self.setWindowTitle("Paint by Python Map")
-        self.setWindowIcon(QIcon(pixmap))
+        self.setWindowIcon(window_icon())
 
         self.menubar = self.menuBar()
 
@@ -366,6 +1389,176 @@ class Window(QtWidgets.QMainWindow):
         self.file_menu.addAction(self.open_action)
         self.file_menu.addAction(self.save_action)
 
+        self.save_log_action = QAction("Сохранить журнал действий")
+        self.save_log_action.triggered.connect(self.save_log)
+        self.file_menu.addAction(self.save_log_action)
+
+        self.blur_action = QAction("Размытие")
+        self.blur_action.triggered.connect(self.blur_image)
+
+        self.sharpen_action = QAction("Резкость")
+        self.sharpen_action.triggered.connect(self.sharpen_image)
+
+        self.invert_action = QAction("Инверсия")
+        self.invert_action.triggered.connect(lambda: self.apply_filter("invert"))
+
+        self.brightness_contrast_action = QAction("Яркость и контраст")
+        self.brightness_contrast_action.triggered.connect(self.brightness_contrast_image)
+
+        self.grayscale_action = QAction("Оттенки серого")
+        self.grayscale_action.triggered.connect(lambda: self.apply_filter("grayscale"))
+
+        self.filters_menu = self.menubar.addMenu("Фильтры")
+        self.filters_menu.addAction(self.blur_action)
+        self.filters_menu.addAction(self.sharpen_action)
+        self.filters_menu.addSeparator()
+        self.filters_menu.addAction(self.invert_action)
+        self.filters_menu.addAction(self.brightness_contrast_action)
+        self.filters_menu.addAction(self.grayscale_action)
+
+        self.undo_action = QAction("Отменить")
+        self.undo_action.setShortcut(QKeySequence.StandardKey.Undo)
+        self.undo_action.triggered.connect(self.undo)
+
+        self.redo_action = QAction("Повторить")
+        self.redo_action.setShortcut(QKeySequence.StandardKey.Redo)
+        self.redo_action.triggered.connect(self.redo)
+
+        self.deselect_action = QAction("Снять выделение")
+        self.deselect_action.setShortcut(QKeySequence("Ctrl+D"))
+        self.deselect_action.triggered.connect(self.deselect)
+
+        self.delete_selection_action = QAction("Удалить выделенное")
+        self.delete_selection_action.setShortcut(QKeySequence.StandardKey.Delete)
+        self.delete_selection_action.triggered.connect(self.delete_selection)
+
+        self.edit_menu = self.menubar.addMenu("Правка")
+        self.edit_menu.addAction(self.undo_action)
+        self.edit_menu.addAction(self.redo_action)
+        self.edit_menu.addSeparator()
+        self.edit_menu.addAction(self.deselect_action)
+        self.edit_menu.addAction(self.delete_selection_action)
+
+        self.brush_hardness_action = QAction("Жесткость кисти")
+        self.brush_hardness_action.triggered.connect(self.brush_hardness)
+        self.edit_menu.addSeparator()
+        self.edit_menu.addAction(self.brush_hardness_action)
+
+        self.zoom_in_action = QAction("Увеличить")
+        self.zoom_in_action.setShortcut(QKeySequence.StandardKey.ZoomIn)
+        self.zoom_in_action.triggered.connect(self.zoom_in)
+
+        self.zoom_out_action = QAction("Уменьшить")
+        self.zoom_out_action.setShortcut(QKeySequence.StandardKey.ZoomOut)
+        self.zoom_out_action.triggered.connect(self.zoom_out)
+
+        self.zoom_reset_action = QAction("Масштаб 100%")
+        self.zoom_reset_action.setShortcut(QKeySequence("Ctrl+0"))
+        self.zoom_reset_action.triggered.connect(self.zoom_reset)
+
+        self.view_menu = self.menubar.addMenu("Вид")
+        self.view_menu.addAction(self.zoom_in_action)
+        self.view_menu.addAction(self.zoom_out_action)
+        self.view_menu.addAction(self.zoom_reset_action)
+
+        self.profile_action = QAction("Замеры производительности")
+        self.profile_action.setCheckable(True)
+        self.profile_action.setChecked(profiler.enabled)
+        self.profile_action.toggled.connect(self.set_profiling)
+
+        self.cprofile_action = QAction("Профилировать (cProfile)")
+        self.cprofile_action.setCheckable(True)
+        self.cprofile_action.setChecked(profiler.cprofile)
+        self.cprofile_action.setEnabled(profiler.enabled)
+        self.cprofile_action.toggled.connect(profiler.set_cprofile)
+
+        self.dump_profile_action = QAction("Сохранить замеры")
+        self.dump_profile_action.setEnabled(profiler.enabled)
+        self.dump_profile_action.triggered.connect(self.dump_profile)
+
+        self.view_menu.addSeparator()
+        self.view_menu.addAction(self.profile_action)
+        self.view_menu.addAction(self.cprofile_action)
+        self.view_menu.addAction(self.dump_profile_action)
+
+        self.new_layer_action = QAction("Новый слой")
+        self.new_layer_action.setShortcut(QKeySequence("Ctrl+Shift+N"))
+        self.new_layer_action.triggered.connect(self.new_layer)
+
+        self.new_vector_layer_action = QAction("Новый векторный слой")
+        self.new_vector_layer_action.triggered.connect(self.new_vector_layer)
+
+        self.remove_layer_action = QAction("Удалить слой")
+        self.remove_layer_action.triggered.connect(self.remove_layer)
+
+        self.upper_layer_action = QAction("Выбрать слой выше")
+        self.upper_layer_action.setShortcut(QKeySequence("Alt+]"))
+        self.upper_layer_action.triggered.connect(lambda: self.select_layer(1))
+
+        self.lower_layer_action = QAction("Выбрать слой ниже")
+        self.lower_layer_action.setShortcut(QKeySequence("Alt+["))
+        self.lower_layer_action.triggered.connect(lambda: self.select_layer(-1))
+
+        self.raise_layer_action = QAction("Поднять слой")
+        self.raise_layer_action.setShortcut(QKeySequence("Ctrl+]"))
+        self.raise_layer_action.triggered.connect(lambda: self.move_layer(1))
+
+        self.lower_layer_down_action = QAction("Опустить слой")
+        self.lower_layer_down_action.setShortcut(QKeySequence("Ctrl+["))
+        self.lower_layer_down_action.triggered.connect(lambda: self.move_layer(-1))
+
+        self.layer_visible_action = QAction("Показывать слой")
+        self.layer_visible_action.setCheckable(True)
+        self.layer_visible_action.triggered.connect(self.set_layer_visible)
+
+        self.layer_opacity_action = QAction("Непрозрачность слоя")
+        self.layer_opacity_action.triggered.connect(self.set_layer_opacity)
+
+        self.blend_mode_group = QActionGroup(self)
+        self.blend_mode_actions: dict[str, QAction] = {}
+
+        for key, (title, _) in BLEND_MODES.items():
+            action = QAction(title, self.blend_mode_group)
+            action.setCheckable(True)
+            action.triggered.connect(lambda checked, key=key: self.set_layer_blend_mode(key))
+            self.blend_mode_actions[key] = action
+
+        self.layers_menu = self.menubar.addMenu("Слои")
+        self.layers_menu.addAction(self.new_layer_action)
+        self.layers_menu.addAction(self.new_vector_layer_action)
+        self.layers_menu.addAction(self.remove_layer_action)
+        self.layers_menu.addSeparator()
+        self.layers_menu.addAction(self.upper_layer_action)
+        self.layers_menu.addAction(self.lower_layer_action)
+        self.layers_menu.addAction(self.raise_layer_action)
+        self.layers_menu.addAction(self.lower_layer_down_action)
+        self.layers_menu.addSeparator()
+        self.layers_menu.addAction(self.layer_visible_action)
+        self.layers_menu.addAction(self.layer_opacity_action)
+        self.blend_mode_menu = self.layers_menu.addMenu("Режим наложения")
+        self.blend_mode_menu.addActions(self.blend_mode_group.actions())
+
+        self.host_session_action = QAction("Начать сеанс")
+        self.host_session_action.triggered.connect(lambda: self.host_session())
+
+        self.host_lan_session_action = QAction("Начать сеанс в локальной сети")
+        self.host_lan_session_action.triggered.connect(lambda: self.host_session(lan=True))
+
+        self.join_session_action = QAction("Подключиться к сеансу")
+        self.join_session_action.triggered.connect(self.join_session)
+
+        self.leave_session_action = QAction("Отключиться")
+        self.leave_session_action.triggered.connect(self.leave_session)
+
+        self.session_menu = self.menubar.addMenu("Совместная работа")
+        self.session_menu.addAction(self.host_session_action)
+        self.session_menu.addAction(self.host_lan_session_action)
+        self.session_menu.addAction(self.join_session_action)
+        self.session_menu.addAction(self.leave_session_action)
+
+        # сервер, запущенный этим окном
+        self.relay: collab.RelayThread = None
+
         self.widget = QtWidgets.QFrame()
         self.widget.setObjectName("widget")
         self.setCentralWidget(self.widget)
@@ -410,28 +1603,117 @@ class Window(QtWidgets.QMainWindow):
         self.toolbar.init_button._tool_choosed()
         self.pallete.init_button._color_choosed()
 
-        self.setStyleSheet(style_sheet)
+        self.task: fileio.Task = None
+
+        # полоса прогресса и кнопка отмены нужны только во время открытия и сохранения, они создаются при первой задаче
+        self.progress_bar: QtWidgets.QProgressBar = None
+        self.cancel_button: QtWidgets.QPushButton = None
+
+        self.layer_label = QtWidgets.QLabel()
+        self.statusBar().addPermanentWidget(self.layer_label)
+
+        self.canvas.layers_changed.connect(self.update_layer_actions)
+        self.update_layer_actions()
+
+        self.canvas.selection_changed.connect(self.update_selection_actions)
+        self.canvas.status_message.connect(lambda text: self.statusBar().showMessage(text, 3000))
+        self.update_selection_actions()
+
+        self.canvas.session_changed.connect(self.update_session_actions)
+        self.update_session_actions()
+
+        QTimer.singleShot(0, self.offer_recovery)
+
+    def offer_recovery(self):
+        """Если прошлый запуск завершился сбоем, от него остался журнал автосохранения"""
+        journal = self.canvas.journal
+
+        if journal.exists():
+            answer = QtWidgets.QMessageBox.question(self, "Восстановление",
+                                                    "Прошлый сеанс завершился аварийно. Восстановить несохраненную работу?")
+
+            if answer == QtWidgets.QMessageBox.StandardButton.Yes:
+                QtWidgets.QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+
+                try:
+                    self.canvas.recover()
+                except (OSError, ValueError) as error:
+                    QtWidgets.QApplication.restoreOverrideCursor()
+
+                    # новый журнал затер бы старый, а его еще можно восстановить, например вернув исходный файл
+                    message = f"Не удалось восстановить работу: {error}"
+
+                    try:
+                        message += f"\nЖурнал сохранен в {journal.set_aside()}"
+                    except OSError:
+                        pass
+
+                    QtWidgets.QMessageBox.warning(self, "Ошибка", message)
+                else:
+                    QtWidgets.QApplication.restoreOverrideCursor()
+
+                    return
+
+        self.canvas.start_autosave()
+
+    def closeEvent(self, event):
+        self.leave_session()
+        self.canvas.journal.close()
+
+        super().closeEvent(event)
 
     def new_image(self):
-        width, status = QtWidgets.QInputDialog.getInt(self, "Ширина холста", "Введите ширину холста [50; 1820]",
-                                                        min = 50, max=1820, value=self.canvas.img_width)
+        max_size = self.canvas.settings.tiles.max_size
+
+        width, status = QtWidgets.QInputDialog.getInt(self, "Ширина холста", f"Введите ширину холста [50; {max_size}]",
+                                                        min = 50, max=max_size, value=self.canvas.img_width)
 
         if not status:
             return
 
-        height, status = QtWidgets.QInputDialog.getInt(self, "Высота холста", "Введите высоту холста [50; 1820]",
-                                                      min=50, max=1820, value=self.canvas.img_height)
+        height, status = QtWidgets.QInputDialog.getInt(self, "Высота холста", f"Введите высоту холста [50; {max_size}]",
+                                                      min=50, max=max_size, value=self.canvas.img_height)
                                                       
         self.canvas.new_image(width, height)
         
     def save_image(self):
         desktop = os.path.normpath(os.path.expanduser("~/Desktop"))
 
+        # плиточное хранилище пишется в файл только полосами, а это умеет только PNG (fileio.write_image)
+        filters = "PNG(*.png);;PNG с палитрой(*.png)"
+
+        if self.canvas.store is None:
+            filters += ";;GIF(*.gif);;JPG(*.jpg)"
+
         dialog = QtWidgets.QFileDialog()
-        path, _ = dialog.getSaveFileName(self, "Сохранить изображение", desktop, "PNG(*.png);;JPG(*.jpg)")
+        path, selected = dialog.getSaveFileName(self, "Сохранить изображение", desktop, filters)
 
-        if path:
-            self.canvas.image.save(path)
+        if not path:
+            return
+
+        settings = self.canvas.settings.export
+        extension = os.path.splitext(path)[1].lower()
+        indexed = selected.startswith("PNG с палитрой")
+
+        if extension == ".gif" or extension == ".png" and indexed:
+            colors, status = QtWidgets.QInputDialog.getInt(self, "Палитра", "Число цветов [2; 256]",
+                                                           min=2, max=256, value=settings.colors)
+            if not status:
+                return
+
+            settings.colors = colors
+        elif extension in (".jpg", ".jpeg"):
+            quality, status = QtWidgets.QInputDialog.getInt(self, "Качество JPEG", "Качество [1; 100]",
+                                                            min=1, max=100, value=settings.jpeg_quality)
+            if not status:
+                return
+
+            settings.jpeg_quality = quality
+
+        import fileio
+
+        self.start_task(fileio.SaveTask(self.canvas.snapshot(), path, settings, indexed), "Сохранение",
+                        self.image_saved)
 
     def open_image(self):
         desktop = os.path.normpath(os.path.expanduser("~/Desktop"))
@@ -440,7 +1722,292 @@ class Window(QtWidgets.QMainWindow):
         path, _ = dialog.getOpenFileName(self, "Открыть изображение", desktop, "PNG(*.png);;JPG(*.jpg)")
 
         if path:
-            self.canvas.open_image(path)
+            import fileio
+
+            task = fileio.OpenTask(path, self.canvas.settings.tiles)
+            task.signals.preview.connect(self.canvas.set_preview)
+
+            self.start_task(task, "Открытие", lambda image: self.canvas.set_opened(image, path))
+
+    def save_log(self):
+        """Журнал можно воспроизвести без окна: python render.py журнал.json"""
+        desktop = os.path.normpath(os.path.expanduser("~/Desktop"))
+
+        dialog = QtWidgets.QFileDialog()
+        path, _ = dialog.getSaveFileName(self, "Сохранить журнал действий", desktop, "JSON(*.json)")
+
+        if path:
+            self.canvas.log.save(path)
+
+    def start_task(self, task: "fileio.Task", title: str, finished: typing.Callable):
+        """Запускает открытие или сохранение в фоне, холст при этом остается доступным"""
+        self.create_task_widgets()
+
+        self.task = task
+        self.task.signals.progress.connect(self.progress_bar.setValue)
+        # сначала задача закрывается, потом обрабатывается результат, иначе task_done сотрет его сообщение
+        self.task.signals.finished.connect(self.task_done)
+        self.task.signals.finished.connect(finished)
+        self.task.signals.failed.connect(self.task_failed)
+        self.task.signals.canceled.connect(self.task_done)
+
+        self.statusBar().showMessage(title)
+        self.progress_bar.setValue(0)
+        self.set_task_visible(True)
+
+        QThreadPool.globalInstance().start(self.task)
+
+    def cancel_task(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    def task_done(self):
+        self.task = None
+        self.canvas.locked = False
+        self.canvas.set_preview(None)
+
+        self.statusBar().clearMessage()
+        self.set_task_visible(False)
+
+    def task_failed(self, message: str):
+        self.task_done()
+
+        QtWidgets.QMessageBox.warning(self, "Ошибка", message)
+
+    def image_saved(self, report: "fileio.ExportReport"):
+        """Размер файла и время сохранения, чтобы было видно, во что обходятся палитра, сжатие и качество"""
+        self.canvas.file_saved(report.path)
+        self.statusBar().showMessage(f"Сохранено {report}", 5000)
+
+    def create_task_widgets(self):
+        if self.progress_bar is not None:
+            return
+
+        self.progress_bar = QtWidgets.QProgressBar()
+        self.progress_bar.setFixedWidth(200)
+        self.cancel_button = QtWidgets.QPushButton("Отмена")
+        self.cancel_button.clicked.connect(self.cancel_task)
+
+        self.statusBar().addPermanentWidget(self.progress_bar)
+        self.statusBar().addPermanentWidget(self.cancel_button)
+
+    def set_task_visible(self, visible: bool):
+        if self.progress_bar is not None:
+            self.progress_bar.setVisible(visible)
+            self.cancel_button.setVisible(visible)
+
+        self.new_action.setEnabled(not visible)
+        self.open_action.setEnabled(not visible)
+        self.save_action.setEnabled(not visible)
+
+    def zoom_in(self):
+        self.canvas.zoom_in()
+
+    def zoom_out(self):
+        self.canvas.zoom_out()
+
+    def zoom_reset(self):
+        self.canvas.set_zoom(1)
+
+    def apply_filter(self, name: str, **params):
+        QtWidgets.QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+
+        try:
+            self.canvas.apply_filter(name, **params)
+        finally:
+            QtWidgets.QApplication.restoreOverrideCursor()
+
+    def blur_image(self):
+        radius, status = QtWidgets.QInputDialog.getInt(self, "Размытие", "Радиус размытия [1; 50]",
+                                                       min=1, max=50, value=3)
+
+        if status:
+            self.apply_filter("blur", radius=radius)
+
+    def sharpen_image(self):
+        amount, status = QtWidgets.QInputDialog.getInt(self, "Резкость", "Сила, % [10; 500]",
+                                                       min=10, max=500, value=100)
+
+        if status:
+            self.apply_filter("sharpen", amount=amount / 100)
+
+    def brightness_contrast_image(self):
+        brightness, status = QtWidgets.QInputDialog.getInt(self, "Яркость и контраст", "Яркость [-100; 100]",
+                                                           min=-100, max=100, value=0)
+
+        if not status:
+            return
+
+        contrast, status = QtWidgets.QInputDialog.getInt(self, "Яркость и контраст", "Контраст [-100; 100]",
+                                                         min=-100, max=100, value=0)
+
+        if status:
+            self.apply_filter("brightness_contrast", brightness=brightness, contrast=contrast)
+
+    def new_layer(self):
+        self.canvas.change_layers("add_layer")
+
+    def new_vector_layer(self):
+        self.canvas.change_layers("add_layer", vector=True)
+
+    def remove_layer(self):
+        self.canvas.change_layers("remove_layer", index=self.canvas.layers.active)
+
+    def select_layer(self, offset: int):
+        self.canvas.change_layers("select_layer", index=self.canvas.layers.active + offset)
+
+    def move_layer(self, offset: int):
+        self.canvas.change_layers("move_layer", index=self.canvas.layers.active, offset=offset)
+
+    def set_layer_visible(self, visible: bool):
+        self.canvas.change_layers("set_layer", index=self.canvas.layers.active, visible=visible)
+
+    def set_layer_opacity(self):
+        layer = self.canvas.layers.current
+
+        opacity, status = QtWidgets.QInputDialog.getInt(self, "Непрозрачность слоя", "Непрозрачность, %",
+                                                        min=0, max=100, value=round(layer.opacity * 100))
+
+        if status:
+            self.canvas.change_layers("set_layer", index=self.canvas.layers.active, opacity=opacity / 100)
+
+    def set_layer_blend_mode(self, blend_mode: str):
+        self.canvas.change_layers("set_layer", index=self.canvas.layers.active, blend_mode=blend_mode)
+
+    def host_session(self, lan: bool = False):
+        """Запускает сервер совместной работы в этом окне и подключается к нему. Сервер слушает адрес
+        из настроек (по умолчанию только этот компьютер), lan - всю локальную сеть, тогда остальные участники
+        подключаются по адресу этого компьютера"""
+        settings = self.canvas.settings.collab
+        host, port = settings.host, settings.port
+
+        if lan:
+            answer = QtWidgets.QMessageBox.question(self, "Совместная работа",
+                                                    "Подключиться к сеансу и изменить или стереть рисунок сможет "
+                                                    "любой компьютер локальной сети. Продолжить?")
+
+            if answer != QtWidgets.QMessageBox.StandardButton.Yes:
+                return
+
+            host = "0.0.0.0"
+
+        if self.relay is None:
+            import collab
+
+            relay = collab.RelayThread(host, port)
+
+            try:
+                relay.serve()
+            except OSError as error:
+                QtWidgets.QMessageBox.warning(self, "Ошибка", f"Не удалось запустить сервер: {error}")
+                return
+
+            self.relay = relay
+
+        self.canvas.connect_session("127.0.0.1" if host == "0.0.0.0" else host, port)
+
+    def join_session(self):
+        settings = self.canvas.settings.collab
+
+        address, status = QtWidgets.QInputDialog.getText(self, "Совместная работа", "Адрес сервера (адрес:порт)",
+                                                         text=f"{settings.host}:{settings.port}")
+
+        if not status or not address.strip():
+            return
+
+        host, _, port = address.strip().rpartition(":")
+
+        if not host or not port.isdigit():
+            host, port = address.strip(), str(settings.port)
+
+        self.canvas.connect_session(host, int(port))
+
+    def leave_session(self):
+        self.canvas.disconnect_session()
+
+        if self.relay is not None:
+            self.relay.stop()
+            self.relay = None
+
+    def update_session_actions(self):
+        connected = self.canvas.session is not None
+
+        self.host_session_action.setEnabled(not connected)
+        self.host_lan_session_action.setEnabled(not connected)
+        self.join_session_action.setEnabled(not connected)
+        self.leave_session_action.setEnabled(connected or self.relay is not None)
+
+    def update_selection_actions(self):
+        selected = self.canvas.selection is not None
+
+        self.deselect_action.setEnabled(selected)
+        self.delete_selection_action.setEnabled(selected)
+
+    def deselect(self):
+        self.canvas.deselect()
+
+    def delete_selection(self):
+        self.canvas.delete_selection()
+
+    def update_layer_actions(self):
+        """Обновляет меню слоев и подпись в строке состояния. У плиточного хранилища слоев и фильтров нет"""
+        layers = self.canvas.layers
+
+        self.layers_menu.setEnabled(layers is not None)
+        self.filters_menu.setEnabled(layers is not None and layers.current.shapes is None)
+
+        if layers is None:
+            self.layer_label.setText("")
+
+            return
+
+        layer = layers.current
+        count = len(layers.layers)
+
+        self.remove_layer_action.setEnabled(count > 1)
+        self.upper_layer_action.setEnabled(layers.active < count - 1)
+        self.lower_layer_action.setEnabled(layers.active > 0)
+        self.raise_layer_action.setEnabled(layers.active < count - 1)
+        self.lower_layer_down_action.setEnabled(layers.active > 0)
+        self.layer_visible_action.setChecked(layer.visible)
+        self.blend_mode_actions[layer.blend_mode].setChecked(True)
+
+        self.layer_label.setText(f"{layer.name} ({layers.active + 1} из {count}), {round(layer.opacity * 100)}%")
+
+    def set_profiling(self, enabled: bool):
+        profiler.set_enabled(enabled)
+
+        if not enabled:
+            self.cprofile_action.setChecked(False)
+
+        self.cprofile_action.setEnabled(enabled)
+        self.dump_profile_action.setEnabled(enabled)
+        self.canvas.profiler_overlay.set_active(enabled)
+
+    def dump_profile(self):
+        """Сохраняет замеры последних секунд, рядом с JSON кладется профиль cProfile, если он включен"""
+        desktop = os.path.normpath(os.path.expanduser("~/Desktop"))
+
+        dialog = QtWidgets.QFileDialog()
+        path, _ = dialog.getSaveFileName(self, "Сохранить замеры", desktop, "JSON(*.json)")
+
+        if path:
+            profiler.dump(path)
+
+    def undo(self):
+        self.canvas.undo()
+
+    def redo(self):
+        self.canvas.redo()
+
+    def brush_hardness(self):
+        brush = self.canvas.settings.brush
+        hardness, status = QtWidgets.QInputDialog.getInt(self, "Жесткость кисти", "Жесткость края, % [0; 100]",
+                                                         min=0, max=100, value=round(brush.hardness * 100))
+
+        if status:
+            brush.hardness = hardness / 100
+            self.canvas.update_tool()
 
     def size_combobox_changed(self, value: int):
         self.canvas.update_tool_width(value)
@@ -463,8 +2030,7 @@ class Window(QtWidgets.QMainWindow):
 
         if tool_settings_field and tool_settings.width and tool_settings.width_range:
             self.size_combobox.setEnabled(True)
-            self.size_combobox.add_items(tool_settings.width_range,
-                                         tool_settings.width_range.index(tool_settings.width))
+            self.size_combobox.add_items(tool_settings.width_range, tool_settings.width)
         else:
             self.size_combobox.setEnabled(False)
 
@@ -473,6 +2039,9 @@ class Window(QtWidgets.QMainWindow):
 
 
 if __name__ == "__main__":
+    # склейку событий нужно выключить до создания приложения
+    QtWidgets.QApplication.setAttribute(Qt.ApplicationAttribute.AA_CompressHighFrequencyEvents,
+                                        Settings.input.compress_events)
     app = QtWidgets.QApplication(sys.argv)
 
     window = Window()
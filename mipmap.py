@@ -0,0 +1,134 @@
+from PyQt6.QtGui import QImage
+from PyQt6.QtCore import QRect
+from PyQt6 import sip
+from collections import OrderedDict
+import numpy as np
+
+"""Это модуль пирамиды уменьшенных копий изображения (mipmap) для отображения в мелком масштабе
+Уровень k уменьшен в 2**k раз и делится на плитки. Плитки строятся лениво, только когда их нужно показать:
+плитка уровня k собирается из четырех плиток уровня k - 1 усреднением квадратов 2x2.
+Когда инструмент изменяет изображение, удаляются только плитки над измененным прямоугольником,
+остальные берутся из кэша, поэтому уменьшенный вид не пересчитывает все изображение при каждой перерисовке.
+Плитки всех уровней лежат в одном кэше с вытеснением давно не показанных (LRU) объемом не больше budget байт,
+иначе при прокрутке огромного изображения в мелком масштабе кэш рос бы до размеров самого изображения"""
+
+
+def downsample(pixels: np.ndarray) -> np.ndarray:
+    """Уменьшает массив uint32 (0xAARRGGBB) в два раза, усредняя каждый канал по квадратам 2x2"""
+    h, w = pixels.shape
+
+    if h % 2 or w % 2:
+        pixels = np.pad(pixels, ((0, h % 2), (0, w % 2)), mode="edge")
+
+    channels = np.ascontiguousarray(pixels).view(np.uint8).reshape(pixels.shape[0] // 2, 2, pixels.shape[1] // 2, 2, 4)
+    mean = (channels.sum(axis=(1, 3), dtype=np.uint16) + 2) >> 2
+
+    return mean.astype(np.uint8).view(np.uint32).reshape(mean.shape[:2])
+
+
+class Mipmap:
+    def __init__(self, source, width: int, height: int, tile_size: int = 256, budget: int = 128 * 1024 * 1024):
+        """source(rect) возвращает пиксели прямоугольника исходного изображения в виде массива uint32"""
+        self.source = source
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.budget = budget
+
+        self.max_level = 0
+        while max(width, height) > tile_size << self.max_level:
+            self.max_level += 1
+
+        # (уровень, tx, ty) -> (пиксели, QImage над ними)
+        self.tiles: OrderedDict[tuple[int, int, int], tuple[np.ndarray, QImage]] = OrderedDict()
+        self.size = 0
+
+    def level_rect(self, level: int) -> QRect:
+        return QRect(0, 0, -(-self.width >> level), -(-self.height >> level))
+
+    def level_for(self, zoom: float) -> int:
+        """Самый мелкий уровень, который еще не меньше нужного масштаба"""
+        level = 0
+
+        while level < self.max_level and zoom <= 0.5 ** (level + 1):
+            level += 1
+
+        return level
+
+    def tile_rect(self, level: int, tx: int, ty: int) -> QRect:
+        size = self.tile_size
+
+        return QRect(tx * size, ty * size, size, size).intersected(self.level_rect(level))
+
+    def tiles_in(self, level: int, rect: QRect):
+        rect = rect.intersected(self.level_rect(level))
+
+        if rect.isEmpty():
+            return
+
+        for ty in range(rect.top() // self.tile_size, rect.bottom() // self.tile_size + 1):
+            for tx in range(rect.left() // self.tile_size, rect.right() // self.tile_size + 1):
+                yield tx, ty
+
+    def read(self, level: int, rect: QRect) -> np.ndarray:
+        if level == 0:
+            return self.source(rect)
+
+        pixels = np.empty((rect.height(), rect.width()), np.uint32)
+
+        for tx, ty in self.tiles_in(level, rect):
+            tile_rect = self.tile_rect(level, tx, ty)
+            part = tile_rect.intersected(rect)
+            tile, _ = self.get_tile(level, tx, ty)
+
+            pixels[part.top() - rect.top():part.bottom() + 1 - rect.top(),
+                   part.left() - rect.left():part.right() + 1 - rect.left()] = \
+                tile[part.top() - tile_rect.top():part.bottom() + 1 - tile_rect.top(),
+                     part.left() - tile_rect.left():part.right() + 1 - tile_rect.left()]
+
+        return pixels
+
+    def get_tile(self, level: int, tx: int, ty: int) -> tuple[np.ndarray, QImage]:
+        key = (level, tx, ty)
+        entry = self.tiles.get(key)
+
+        if entry is not None:
+            self.tiles.move_to_end(key)
+
+            return entry
+
+        rect = self.tile_rect(level, tx, ty)
+        source_rect = QRect(rect.x() * 2, rect.y() * 2, rect.width() * 2, rect.height() * 2)
+        source = self.read(level - 1, source_rect.intersected(self.level_rect(level - 1)))
+
+        tile = np.ascontiguousarray(downsample(source)[:rect.height(), :rect.width()])
+        image = QImage(sip.voidptr(tile.ctypes.data), tile.shape[1], tile.shape[0], tile.shape[1] * 4,
+                       QImage.Format.Format_ARGB32)
+
+        entry = self.tiles[key] = (tile, image)
+        self.size += tile.nbytes
+
+        # вытесненная плитка живет, пока ее держит вызывающий, так что только что построенную можно не беречь
+        while self.size > self.budget and len(self.tiles) > 1:
+            self.size -= self.tiles.popitem(last=False)[1][0].nbytes
+
+        return entry
+
+    def tile_image(self, level: int, tx: int, ty: int) -> QImage:
+        return self.get_tile(level, tx, ty)[1]
+
+    def invalidate(self, rect: QRect):
+        """Удаляет плитки всех уровней над измененным прямоугольником исходного изображения"""
+        if rect.isEmpty() or not self.tiles:
+            return
+
+        for level in range(1, self.max_level + 1):
+            level_rect = QRect(rect.left() >> level, rect.top() >> level,
+                               (rect.right() >> level) - (rect.left() >> level) + 1,
+                               (rect.bottom() >> level) - (rect.top() >> level) + 1)
+
+            for tx, ty in self.tiles_in(level, level_rect):
+                entry = self.tiles.pop((level, tx, ty), None)
+
+                if entry is not None:
+                    self.size -= entry[0].nbytes
@@ -0,0 +1,265 @@
+from PyQt6.QtGui import QImage, QColor
+from PyQt6.QtCore import Qt, QPoint, QRect
+from dataclasses import dataclass, field, fields, asdict
+import base64
+import json
+import sys
+import zlib
+import numpy as np
+import drawing
+import imagebuffer
+from history import History
+from layers import Layer, LayerStack
+from regions import Selection
+from vector import VectorLayer
+from settings import (Settings, BrushSettings, SpraySettings, FigureSettings, FillSettings, HistorySettings,
+                      FilterSettings, VectorSettings)
+
+"""Это модуль журнала действий
+Холст записывает каждый штрих как операцию: инструмент, его настройки, зерно случайных чисел и события мыши
+с точками в координатах изображения. Журнал сохраняется в JSON и воспроизводится без окна функцией replay,
+которой пользуется render.py.
+Правки других участников совместной работы и плитки, восстановленные из журнала автосохранения, не повторить
+инструментами, поэтому они записываются готовыми пикселями (операция "tile") и составом слоев ("restore_layers")"""
+
+# разделы настроек, которые читают инструменты
+TOOL_SECTIONS = {
+    "brush": BrushSettings,
+    "spray": SpraySettings,
+    "figure": FigureSettings,
+    "fill": FillSettings,
+}
+
+
+def settings_to_dict(settings: Settings) -> dict:
+    data = {"primary_color": settings.primary_color.name(QColor.NameFormat.HexArgb)}
+
+    for name, section_class in TOOL_SECTIONS.items():
+        section = getattr(settings, name)
+        data[name] = {item.name: getattr(section, item.name) for item in fields(section_class)}
+
+    return data
+
+
+def settings_from_dict(data: dict) -> Settings:
+    """Создает новые экземпляры разделов, чтобы не менять настройки по умолчанию"""
+    sections = {name: section_class(**data.get(name, {})) for name, section_class in TOOL_SECTIONS.items()}
+
+    return Settings(primary_color=QColor(data["primary_color"]), **sections)
+
+
+@dataclass
+class Operation:
+    """kind - "stroke", "undo", "redo", "filter", "deselect", "delete_selection", "tile"
+    или действие со слоями (см. apply_layer_operation).
+    events - список [событие, [[x, y], ...]], событие: "press", "move", "hold" или "release".
+    params - параметры действия со слоями, имя фильтра (name) и его параметры
+    или плитка (см. tile_operation)"""
+    kind: str = "stroke"
+    tool: str = None
+    settings: dict = None
+    seed: int = None
+    events: list = field(default_factory=list)
+    params: dict = None
+
+    def add_event(self, name: str, points: list[QPoint], origin: QPoint = QPoint()):
+        self.events.append([name, [[point.x() + origin.x(), point.y() + origin.y()] for point in points]])
+
+
+@dataclass
+class OperationLog:
+    width: int
+    height: int
+    source: str = None
+    operations: list[Operation] = field(default_factory=list)
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(asdict(self), file, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path: str) -> "OperationLog":
+        with open(path, encoding="utf-8") as file:
+            data = json.load(file)
+
+        data["operations"] = [Operation(**operation) for operation in data["operations"]]
+
+        return cls(**data)
+
+
+def tile_operation(index: int, x: int, y: int, pixels: np.ndarray) -> Operation:
+    """Пиксели, записанные в слой index мимо инструментов: сжатые и в base64, чтобы журнал оставался JSON"""
+    h, w = pixels.shape
+    data = base64.b64encode(zlib.compress(np.ascontiguousarray(pixels).tobytes(), 1)).decode("ascii")
+
+    return Operation("tile", params={"layer": index, "x": x, "y": y, "width": w, "height": h, "data": data})
+
+
+def tile_pixels(operation: Operation) -> tuple[QRect, np.ndarray]:
+    params = operation.params
+    pixels = np.frombuffer(zlib.decompress(base64.b64decode(params["data"])), np.uint32)
+
+    return (QRect(params["x"], params["y"], params["width"], params["height"]),
+            pixels.reshape(params["height"], params["width"]))
+
+
+def replay(log: OperationLog) -> QImage:
+    """Воспроизводит журнал на новом изображении и возвращает результат.
+    Отмена или повтор, для которых в истории нет шага, поднимают ValueError"""
+    if log.source is not None:
+        image = imagebuffer.canonical(QImage(log.source))
+
+        # без исходного изображения штрихи легли бы на пустой холст, и результат был бы неверным
+        if image.isNull():
+            raise OSError(f"Не удалось открыть исходное изображение журнала: {log.source}")
+    else:
+        image = QImage(log.width, log.height, QImage.Format.Format_RGB32)
+        image.fill(Qt.GlobalColor.white)
+
+    # фильтры нужны только воспроизведению, а окну этот модуль нужен с первого кадра
+    from filters import FilterEngine, make_filter
+
+    layers = LayerStack(image)
+    # окно пишет в журнал только те отмены, которые смогло сделать, поэтому здесь шаги не удаляются: иначе
+    # история с меньшим бюджетом, чем у записавшего журнал окна, не нашла бы шаг для отмены
+    history = History(HistorySettings(budget=sys.maxsize))
+    engine = FilterEngine(FilterSettings())
+    history.reset(imagebuffer.pixel_array(image).copy(), layers.current)
+    selection: Selection = None
+
+    for number, operation in enumerate(log.operations, 1):
+        if operation.kind == "undo":
+            if not history.can_undo():
+                raise ValueError(f"Операция {number}: в журнале действий нечего отменять")
+
+            history.undo(history.undo_layer().image)
+        elif operation.kind == "redo":
+            if not history.can_redo():
+                raise ValueError(f"Операция {number}: в журнале действий нечего повторять")
+
+            history.redo(history.redo_layer().image)
+        elif operation.kind == "stroke":
+            layer = layers.current
+            layer.image, rect, new_selection = replay_stroke(layer.image, operation, layer.shapes)
+            history.commit(layer.image, rect, edit=layer.shapes.take_edit() if layer.shapes is not None else None)
+            selection = new_selection or selection
+        elif operation.kind == "filter":
+            layer = layers.current
+            params = dict(operation.params)
+            image_filter = make_filter(params.pop("name"), **params)
+
+            if selection is None:
+                engine.run(image_filter, imagebuffer.pixel_array(layer.image))
+                history.commit(layer.image, layer.image.rect())
+            else:
+                engine.run(image_filter, imagebuffer.pixel_array(layer.image), selection.mask, selection.box())
+                history.commit(layer.image, selection.rect)
+        elif operation.kind == "deselect":
+            selection = None
+        elif operation.kind == "delete_selection":
+            if selection is not None:
+                history.commit(layers.current.image, selection.clear(layers.current.image))
+        elif operation.kind == "tile":
+            layer = layers.layers[operation.params["layer"]]
+            rect, pixels = tile_pixels(operation)
+            history.write(layer, rect, pixels)
+            imagebuffer.pixel_array(layer.image)[rect.top():rect.bottom() + 1, rect.left():rect.right() + 1] = pixels
+        else:
+            apply_layer_operation(layers, history, operation)
+
+    return layers.flatten()
+
+
+def apply_layer_operation(layers: LayerStack, history: History, operation: Operation):
+    """Действия со слоями: "add_layer" (vector - векторный слой), "remove_layer" (index), "select_layer" (index), "move_layer" (index, offset),
+    "set_layer" (index и любые из visible, opacity, blend_mode) и "restore_layers" (layers - новый состав стека,
+    у каждого слоя index - его прежнее место или None для нового прозрачного слоя, и свойства, active, counter).
+    Этим же пользуется холст"""
+    params = operation.params or {}
+
+    if operation.kind == "add_layer":
+        shapes = VectorLayer(layers.rect(), VectorSettings()) if params.get("vector") else None
+        layer = layers.add_layer(shapes=shapes)
+        history.add_layer(layer, imagebuffer.pixel_array(layer.image).copy())
+    elif operation.kind == "remove_layer":
+        layer = layers.remove_layer(params["index"])
+
+        if layer is not None:
+            history.remove_layer(layer)
+    elif operation.kind == "select_layer":
+        layers.select(params["index"])
+    elif operation.kind == "move_layer":
+        layers.move_layer(params["index"], params["offset"])
+    elif operation.kind == "set_layer":
+        index = params["index"]
+
+        if "visible" in params:
+            layers.set_visible(index, params["visible"])
+        if "opacity" in params:
+            layers.set_opacity(index, params["opacity"])
+        if "blend_mode" in params:
+            layers.set_blend_mode(index, params["blend_mode"])
+    elif operation.kind == "restore_layers":
+        stack = []
+
+        for entry in params["layers"]:
+            if entry["index"] is None:
+                layer = Layer(layers.new_image(QImage.Format.Format_ARGB32), entry["name"])
+                history.add_layer(layer, imagebuffer.pixel_array(layer.image).copy())
+            else:
+                layer = layers.layers[entry["index"]]
+
+            layer.name = entry["name"]
+            layer.visible = entry["visible"]
+            layer.opacity = entry["opacity"]
+            layer.blend_mode = entry["blend_mode"]
+            stack.append(layer)
+
+        for layer in layers.layers:
+            if layer not in stack:
+                history.remove_layer(layer)
+
+        layers.restore(stack, params["active"], params["counter"])
+    else:
+        raise ValueError(f"Неизвестное действие: {operation.kind}")
+
+    history.select(layers.current)
+
+
+def replay_stroke(image: QImage, operation: Operation, shapes: VectorLayer = None) -> tuple[QImage, QRect, Selection]:
+    """Возвращает изображение, прямоугольник, который изменил инструмент (без предпросмотра),
+    и выделение, если инструмент его задал. shapes - фигуры, если штрих был на векторном слое"""
+    tool: drawing.BaseTool = getattr(drawing, operation.tool)(settings_from_dict(operation.settings))
+    tool.set_seed(operation.seed)
+    tool.shapes = shapes
+
+    last_point = QPoint()
+    rect = QRect()
+    selection = None
+
+    for name, points in operation.events:
+        points = [QPoint(x, y) for x, y in points]
+
+        if name == "press":
+            tool.begin_stroke(image)
+            result = tool.mouse_press_event(image, points[0])
+        elif name == "move":
+            result = tool.mouse_move_points(image, last_point, points)
+        elif name == "hold":
+            result = tool.mouse_hold_event(image, points[0])
+        else:
+            result = tool.mouse_release_event(image, points[0])
+            tool.end_stroke()
+
+        result = drawing.edit_result(tool, result)
+        selection = result.selection or selection
+
+        if not result.preview:
+            image = result.surface
+            rect = rect.united(result.dirty())
+
+        last_point = points[-1]
+
+    tool.end_stroke()
+
+    return image, rect, selection
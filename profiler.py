@@ -0,0 +1,201 @@
+from collections import deque
+import json
+import os
+import threading
+import time
+import numpy as np
+from settings import ProfilerSettings
+
+"""Это модуль замеров производительности, по умолчанию выключен
+Включается переменной окружения PAINT_PROFILE=1 (PAINT_PROFILE=cprofile дополнительно включает cProfile)
+или пунктом меню "Вид - Замеры производительности".
+
+Холст оборачивает свои этапы и вызовы инструмента в profiler.span("имя"). Для каждого имени хранится скользящая
+выборка последних длительностей, по ней считаются перцентили для окна замеров. Все отрезки за последние
+trace_seconds секунд хранятся и сохраняются методом dump в формате Chrome Trace (открывается в chrome://tracing
+или ui.perfetto.dev). cProfile пишется кусками по trace_seconds секунд, при сохранении берутся два последних куска,
+то есть профиль покрывает не меньше trace_seconds последних секунд.
+
+Задержка от события до кадра считается от первого события мыши, которое еще не было показано, до конца paintEvent.
+Выключенный профайлер возвращает из span общий пустой контекст, так что замеры почти ничего не стоят"""
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler: "Profiler", name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.record(self.name, self.start, time.perf_counter_ns() - self.start)
+
+        return False
+
+
+class Profiler:
+    def __init__(self, settings: ProfilerSettings):
+        self.trace_seconds = settings.trace_seconds
+        self.histogram_size = settings.histogram_size
+
+        self.enabled = False
+        self.histograms: dict[str, deque[int]] = {}
+        self.trace: deque[tuple[str, int, int, int]] = deque(maxlen=settings.trace_events)
+        self.frames: deque[int] = deque()
+        self.pending_input: int = None
+
+        self.profiles: deque[cProfile.Profile] = deque(maxlen=2)
+        self.profile_started = 0
+
+        mode = os.environ.get("PAINT_PROFILE", "")
+
+        if mode:
+            self.set_enabled(True)
+
+            if mode.lower() == "cprofile":
+                self.set_cprofile(True)
+
+    def set_enabled(self, enabled: bool):
+        self.enabled = enabled
+
+        if not enabled:
+            self.set_cprofile(False)
+            self.histograms.clear()
+            self.trace.clear()
+            self.frames.clear()
+            self.pending_input = None
+
+    @property
+    def cprofile(self) -> bool:
+        return bool(self.profiles)
+
+    def set_cprofile(self, enabled: bool):
+        if enabled and not self.profiles:
+            self.start_profile()
+        elif not enabled and self.profiles:
+            self.profiles[-1].disable()
+            self.profiles.clear()
+
+    def start_profile(self):
+        # cProfile и pstats нужны только при включенном профилировании, окно не грузит их при запуске
+        import cProfile
+
+        if self.profiles:
+            self.profiles[-1].disable()
+
+        profile = cProfile.Profile()
+        self.profiles.append(profile)
+        self.profile_started = time.perf_counter_ns()
+
+        profile.enable()
+
+    def span(self, name: str):
+        if not self.enabled:
+            return NULL_SPAN
+
+        return Span(self, name)
+
+    def record(self, name: str, start: int, duration: int):
+        histogram = self.histograms.get(name)
+
+        if histogram is None:
+            histogram = self.histograms[name] = deque(maxlen=self.histogram_size)
+
+        histogram.append(duration)
+        self.trace.append((name, start, duration, threading.get_ident()))
+
+        # старые отрезки удаляются с начала, пока буфер покрывает больше trace_seconds секунд
+        limit = start - self.trace_seconds * 1_000_000_000
+
+        while self.trace and self.trace[0][1] < limit:
+            self.trace.popleft()
+
+    def input_event(self):
+        """Вызывается на каждое событие мыши, запоминает время самого раннего еще не показанного события"""
+        if self.enabled and self.pending_input is None:
+            self.pending_input = time.perf_counter_ns()
+
+    def frame(self):
+        """Вызывается в конце paintEvent"""
+        if not self.enabled:
+            return
+
+        now = time.perf_counter_ns()
+        self.frames.append(now)
+
+        while self.frames[0] < now - 1_000_000_000:
+            self.frames.popleft()
+
+        if self.pending_input is not None:
+            self.record("input_to_paint", self.pending_input, now - self.pending_input)
+            self.pending_input = None
+
+    def tick(self):
+        """Вызывается по таймеру окна замеров, начинает новый кусок cProfile"""
+        if self.profiles and time.perf_counter_ns() - self.profile_started > self.trace_seconds * 1_000_000_000:
+            self.start_profile()
+
+    def fps(self) -> int:
+        now = time.perf_counter_ns()
+
+        return sum(1 for frame in self.frames if frame >= now - 1_000_000_000)
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """Перцентили по скользящим выборкам, в миллисекундах"""
+        result = {}
+
+        for name, histogram in list(self.histograms.items()):
+            if not histogram:
+                continue
+
+            ms = np.array(histogram) / 1_000_000
+            p50, p95 = np.percentile(ms, (50, 95))
+
+            result[name] = {"count": len(ms), "p50": float(p50), "p95": float(p95), "max": float(ms.max())}
+
+        return result
+
+    def dump(self, path: str) -> list[str]:
+        """Сохраняет отрезки последних trace_seconds секунд в JSON, а если включен cProfile - профиль рядом в .prof.
+        Возвращает пути сохраненных файлов"""
+        pid = os.getpid()
+        events = [{"name": name, "ph": "X", "ts": start / 1000, "dur": duration / 1000, "pid": pid, "tid": tid}
+                  for name, start, duration, tid in list(self.trace)]
+
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms", "summary": self.summary()}, file)
+
+        paths = [path]
+
+        if self.profiles:
+            import pstats
+
+            current = self.profiles[-1]
+            profile_path = os.path.splitext(path)[0] + ".prof"
+
+            # create_stats выключает профилирование, после снимка текущий кусок продолжает писаться
+            pstats.Stats(*self.profiles).dump_stats(profile_path)
+            current.enable()
+
+            paths.append(profile_path)
+
+        return paths
+
+
+profiler = Profiler(ProfilerSettings())
@@ -0,0 +1,189 @@
+import numpy as np
+from settings import ExportSettings
+
+"""Это модуль уменьшения числа цветов для сохранения с палитрой (PNG с палитрой и GIF)
+Пиксели - массив uint32 (0xAARRGGBB), как у imagebuffer.pixel_array, результат - номера цветов uint8 и палитра uint32.
+
+Рисунки с заливками обычно содержат меньше цветов, чем помещается в палитру. Это проверяется сначала по случайной
+выборке пикселей, а если выборка не опровергла, то и по всему изображению, и тогда палитра - это просто все цвета
+изображения, а сохранение получается без потерь.
+
+Иначе палитра строится по выборке quantize_sample пикселей: медианное сечение делит куб цветов на области
+с примерно равным числом пикселей, средние цвета областей уточняются несколькими проходами k-средних.
+Каждый пиксель не сравнивается со всей палитрой: пиксели раскладываются по ячейкам куба цветов (по 6 старших бит
+каналов), ближайший цвет палитры ищется один раз для среднего цвета каждой непустой ячейки, а номер пикселя
+берется из таблицы ячеек. Так все шаги - операции NumPy над массивами, без циклов Python по пикселям.
+
+Плиточное хранилище целиком в память не собирается: палитра строится по выборке (sample_palette),
+а номера цветов считаются полосами (map_pixels)"""
+
+
+def to_channels(colors: np.ndarray) -> np.ndarray:
+    """Цвета uint32 в массив float32 (n, 4) с каналами в порядке B, G, R, A"""
+    return colors.view(np.uint8).reshape(-1, 4).astype(np.float32)
+
+
+def nearest(points: np.ndarray, palette: np.ndarray, chunk: int = 16384) -> np.ndarray:
+    """Номер ближайшего цвета палитры для каждой точки. Квадрат расстояния раскрывается как |x|^2 - 2xp + |p|^2,
+    чтобы сравнение со всей палитрой было одним умножением матриц; точки берутся порциями, чтобы не держать
+    в памяти всю таблицу расстояний"""
+    norms = (palette * palette).sum(axis=1)
+    labels = np.empty(len(points), np.intp)
+
+    for start in range(0, len(points), chunk):
+        part = points[start:start + chunk]
+        labels[start:start + chunk] = np.argmin(norms[None, :] - 2 * part @ palette.T, axis=1)
+
+    return labels
+
+
+def box_stats(channels: np.ndarray, weights: np.ndarray, box: np.ndarray) -> tuple[float, int]:
+    """Приоритет деления области (размах канала на число пикселей) и канал с наибольшим размахом"""
+    values = channels[box]
+    ranges = values.max(axis=0) - values.min(axis=0)
+    axis = int(ranges.argmax())
+
+    return float(ranges[axis] * weights[box].sum()), axis
+
+
+def median_cut(channels: np.ndarray, weights: np.ndarray, count: int) -> np.ndarray:
+    """Делит цвета на count областей: каждый раз самая большая область режется поперек самого широкого канала
+    по взвешенной медиане. Возвращает средние цвета областей"""
+    boxes = [np.arange(len(channels))]
+    stats = [box_stats(channels, weights, boxes[0])]
+
+    while len(boxes) < count:
+        index = max(range(len(boxes)), key=lambda i: stats[i][0])
+        score, axis = stats[index]
+
+        if score == 0:
+            break
+
+        box = boxes[index]
+        box = box[np.argsort(channels[box, axis], kind="stable")]
+        cumulative = np.cumsum(weights[box])
+        split = min(max(int(np.searchsorted(cumulative, cumulative[-1] / 2)), 1), len(box) - 1)
+
+        boxes[index], stats[index] = box[:split], box_stats(channels, weights, box[:split])
+        boxes.append(box[split:])
+        stats.append(box_stats(channels, weights, box[split:]))
+
+    return np.array([np.average(channels[box], axis=0, weights=weights[box]) for box in boxes], np.float32)
+
+
+def kmeans(channels: np.ndarray, weights: np.ndarray, palette: np.ndarray, iterations: int) -> np.ndarray:
+    """Уточняет палитру: цвет палитры заменяется средним взвешенным цветов, которые к нему ближе всего"""
+    palette = palette.copy()
+
+    for _ in range(iterations):
+        labels = nearest(channels, palette)
+        totals = np.bincount(labels, weights, minlength=len(palette))
+        used = totals > 0
+
+        for channel in range(4):
+            sums = np.bincount(labels, weights * channels[:, channel], minlength=len(palette))
+            palette[used, channel] = sums[used] / totals[used]
+
+    return palette
+
+
+def cell_keys(colors: np.ndarray, alpha: bool) -> np.ndarray:
+    """Номер ячейки куба цветов: по 6 старших бит красного, зеленого и синего и 4 старших бита альфы"""
+    keys = ((colors >> 18) & 0x3f) << 12 | ((colors >> 10) & 0x3f) << 6 | ((colors >> 2) & 0x3f)
+
+    if alpha:
+        keys |= ((colors >> 28) & 0xf) << 18
+
+    return keys.astype(np.intp)
+
+
+def map_colors(colors: np.ndarray, palette: np.ndarray, alpha: bool) -> np.ndarray:
+    """Номера ближайших цветов палитры для всех пикселей через таблицу ячеек куба цветов"""
+    keys = cell_keys(colors, alpha)
+    size = 1 << (22 if alpha else 18)
+    counts = np.bincount(keys, minlength=size)
+    cells = np.flatnonzero(counts)
+
+    channels = colors.view(np.uint8).reshape(-1, 4)
+    means = np.empty((len(cells), 4), np.float32)
+
+    for channel in range(4):
+        means[:, channel] = np.bincount(keys, channels[:, channel], minlength=size)[cells] / counts[cells]
+
+    table = np.zeros(size, np.uint8)
+    table[cells] = nearest(means, palette)
+
+    return table[keys]
+
+
+def to_colors(palette: np.ndarray) -> np.ndarray:
+    return np.clip(palette + 0.5, 0, 255).astype(np.uint8).view(np.uint32).ravel()
+
+
+def reduce_palette(values: np.ndarray, counts: np.ndarray, settings: ExportSettings, colors: int) -> np.ndarray:
+    """Палитра (n, 4) float32 из colors цветов по различным цветам выборки и числу их повторов"""
+    channels = to_channels(values)
+    weights = counts.astype(np.float64)
+
+    palette = median_cut(channels, weights, colors)
+
+    return kmeans(channels, weights, palette, settings.kmeans_iterations)
+
+
+def sample_palette(sample: np.ndarray, settings: ExportSettings, alpha: bool = True,
+                   colors: int = None) -> np.ndarray:
+    """Отсортированная палитра uint32 по выборке пикселей. Если в выборке цветов не больше colors,
+    палитра - сами эти цвета"""
+    colors = min(max(colors or settings.colors, 2), 256)
+
+    if not alpha:
+        sample = sample | np.uint32(0xff000000)
+
+    values, counts = np.unique(sample, return_counts=True)
+
+    if len(values) <= colors:
+        return values
+
+    return np.unique(to_colors(reduce_palette(values, counts, settings, colors)))
+
+
+def map_pixels(pixels: np.ndarray, palette: np.ndarray, alpha: bool = True) -> np.ndarray:
+    """Номера цветов отсортированной палитры для пикселей: цвета из палитры берутся точно, остальные - ближайшие"""
+    flat = pixels.ravel()
+
+    if not alpha:
+        flat = flat | np.uint32(0xff000000)
+
+    positions = np.minimum(np.searchsorted(palette, flat), len(palette) - 1)
+    indices = positions.astype(np.uint8)
+    missing = palette[positions] != flat
+
+    if missing.any():
+        indices[missing] = map_colors(flat[missing], to_channels(palette), alpha)
+
+    return indices.reshape(pixels.shape)
+
+
+def quantize(pixels: np.ndarray, settings: ExportSettings, alpha: bool = True,
+             colors: int = None) -> tuple[np.ndarray, np.ndarray]:
+    """Номера цветов (высота, ширина) uint8 и палитра uint32 не больше чем из colors цветов (по умолчанию
+    из настроек). alpha=False - прозрачность не учитывается, все цвета палитры непрозрачные"""
+    colors = min(max(colors or settings.colors, 2), 256)
+    flat = pixels.ravel()
+
+    if not alpha:
+        flat = flat | np.uint32(0xff000000)
+
+    rng = np.random.default_rng(0)
+    sample = flat[rng.integers(0, len(flat), min(settings.quantize_sample, len(flat)))] if len(flat) else flat
+    values, counts = np.unique(sample, return_counts=True)
+
+    if len(values) <= colors:
+        palette, indices = np.unique(flat, return_inverse=True)
+
+        if len(palette) <= colors:
+            return indices.astype(np.uint8).reshape(pixels.shape), palette
+
+    palette = reduce_palette(values, counts, settings, colors)
+
+    return map_colors(flat, palette, alpha).reshape(pixels.shape), to_colors(palette)
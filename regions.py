@@ -0,0 +1,305 @@
+from PyQt6.QtGui import QImage
+from PyQt6.QtCore import Qt, QRect
+import numpy as np
+from settings import FillSettings
+import floodfill
+import imagebuffer
+
+"""Это модуль карты связных областей
+Изображение размечается на связные области одного цвета, и повторная заливка или выделение волшебной палочкой
+превращается в поиск по готовой карте вместо обхода изображения. Разметка идет по плиткам:
+  1. внутри плитки строки режутся на отрезки одного цвета, соседние по вертикали (и по диагонали при 8-связности)
+     отрезки одного цвета объединяются, номер области - номер отрезка-корня
+  2. области соседних плиток объединяются по швам между плитками, для каждой области запоминается габарит
+Обе стадии - векторные: объединение пар идет целыми массивами (больший корень подвешивается к меньшему,
+затем пути сжимаются удвоением), пока у всех пар не окажется общий корень.
+Инструменты сообщают холсту, что изменили, и он вызывает invalidate: заново размечаются только эти плитки,
+а швы (их длина - периметр плиток, а не площадь изображения) сшиваются заново целиком. Перед разметкой плитка
+проверяется: если каждая область осталась одного цвета и соседние области не стали одного цвета (так бывает после
+заливки, когда рядом нет цвета заливки), старая разметка верна, и проверка стоит намного меньше разметки.
+Карта строится только для точного совпадения цвета (допуск 0): области с допуском не делят изображение на части,
+для них заливка по-прежнему идет обходом floodfill.find_region"""
+
+
+def union_roots(parent: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Объединяет элементы пар (a[i], b[i]) и возвращает для каждого элемента корень - наименьший номер в его группе"""
+    while True:
+        ra, rb = parent[a], parent[b]
+        differ = ra != rb
+
+        if not differ.any():
+            return parent
+
+        a, b, ra, rb = a[differ], b[differ], ra[differ], rb[differ]
+        np.minimum.at(parent, np.maximum(ra, rb), np.minimum(ra, rb))
+
+        while True:
+            grand = parent[parent]
+
+            if np.array_equal(grand, parent):
+                break
+
+            parent = grand
+
+
+def neighbour_pairs(top: np.ndarray, bottom: np.ndarray, connectivity: int) -> tuple[np.ndarray, np.ndarray]:
+    """Индексы соседних пикселей одного цвета в двух соседних строках (или столбцах): по вертикали,
+    а при 8-связности и по диагонали. Возвращает индексы в top и в bottom"""
+    index = np.arange(len(top))
+    same = top == bottom
+    first, second = [index[same]], [index[same]]
+
+    if connectivity == 8:
+        down = top[:-1] == bottom[1:]
+        up = top[1:] == bottom[:-1]
+        first += [index[:-1][down], index[1:][up]]
+        second += [index[1:][down], index[:-1][up]]
+
+    return np.concatenate(first), np.concatenate(second)
+
+
+class TileLabels:
+    """Разметка одной плитки: labels - номер области каждого пикселя, boxes - габариты областей (left, top, right,
+    bottom, не включительно) в координатах изображения"""
+
+    def __init__(self, pixels: np.ndarray, left: int, top: int, connectivity: int):
+        h, w = pixels.shape
+
+        starts = np.ones((h, w), bool)
+        starts[:, 1:] = pixels[:, 1:] != pixels[:, :-1]
+        runs = np.cumsum(starts, dtype=np.int32).reshape(h, w) - 1
+        count = int(runs[-1, -1]) + 1
+
+        # пара отрезков соседних строк встречается на многих пикселях, берется только начало их перекрытия
+        same = pixels[1:] == pixels[:-1]
+        a, b = [runs[:-1][same & (starts[1:] | starts[:-1])]], [runs[1:][same & (starts[1:] | starts[:-1])]]
+
+        if connectivity == 8:
+            down = (pixels[:-1, :-1] == pixels[1:, 1:]) & (starts[:-1, :-1] | starts[1:, 1:])
+            up = (pixels[:-1, 1:] == pixels[1:, :-1]) & (starts[:-1, 1:] | starts[1:, :-1])
+            a += [runs[:-1, :-1][down], runs[:-1, 1:][up]]
+            b += [runs[1:, 1:][down], runs[1:, :-1][up]]
+
+        parent = union_roots(np.arange(count, dtype=np.int32), np.concatenate(a), np.concatenate(b))
+
+        # корни нумеруются подряд, номер области пикселя берется через номер его отрезка
+        roots = parent == np.arange(count)
+        compact = (np.cumsum(roots, dtype=np.int32) - 1)[parent]
+
+        self.labels = compact[runs]
+        self.count = int(roots.sum())
+
+        rows, run_starts = np.nonzero(starts)
+        run_ends = np.append(run_starts[1:], w)
+        run_ends[np.append(rows[1:] != rows[:-1], True)] = w
+
+        self.boxes = np.empty((4, self.count), np.int32)
+        self.boxes[:2] = np.iinfo(np.int32).max
+        self.boxes[2:] = -1
+
+        np.minimum.at(self.boxes[0], compact, run_starts + left)
+        np.minimum.at(self.boxes[1], compact, rows + top)
+        np.maximum.at(self.boxes[2], compact, run_ends + left)
+        np.maximum.at(self.boxes[3], compact, rows + top + 1)
+
+    def matches(self, pixels: np.ndarray, connectivity: int) -> bool:
+        """Верна ли разметка для новых пикселей плитки"""
+        labels = self.labels
+
+        if labels.shape != pixels.shape:
+            return False
+
+        colors = np.empty(self.count, np.uint32)
+        colors[labels] = pixels
+
+        if not np.array_equal(colors[labels], pixels):
+            return False
+
+        pairs = [(np.s_[:, 1:], np.s_[:, :-1]), (np.s_[1:], np.s_[:-1])]
+
+        if connectivity == 8:
+            pairs += [(np.s_[1:, 1:], np.s_[:-1, :-1]), (np.s_[1:, :-1], np.s_[:-1, 1:])]
+
+        return not any(((labels[a] != labels[b]) & (pixels[a] == pixels[b])).any() for a, b in pairs)
+
+
+class RegionCache:
+    def __init__(self, settings: FillSettings):
+        self.tile_size = settings.label_tile_size
+
+        self.key = None
+        self.tiles: dict[tuple[int, int], TileLabels] = {}
+        self.dirty: set[tuple[int, int]] = set()
+        self.offsets: dict[tuple[int, int], int] = {}
+        self.roots: np.ndarray = None
+        self.boxes: np.ndarray = None
+
+    def invalidate(self, rect: QRect = None):
+        """Плитки внутри rect (None - все) будут размечены заново при следующем поиске"""
+        if rect is None:
+            self.key = None
+            return
+
+        size = self.tile_size
+
+        for ty in range(max(rect.top(), 0) // size, rect.bottom() // size + 1):
+            for tx in range(max(rect.left(), 0) // size, rect.right() // size + 1):
+                self.dirty.add((tx, ty))
+
+    def tile_slices(self, tx: int, ty: int, h: int, w: int) -> tuple[slice, slice]:
+        size = self.tile_size
+
+        return slice(ty * size, min((ty + 1) * size, h)), slice(tx * size, min((tx + 1) * size, w))
+
+    def update(self, image: QImage, connectivity: int):
+        """Размечает заново грязные плитки и сшивает швы. Другое изображение (или то же, но скопированное при
+        записи) узнается по серийному номеру в cacheKey, тогда размечается все"""
+        pixels = imagebuffer.pixel_array(image, readonly=True)
+        h, w = pixels.shape
+        size = self.tile_size
+        key = (image.cacheKey() >> 32, w, h, connectivity)
+
+        if key != self.key:
+            self.key = key
+            self.tiles.clear()
+            self.dirty = {(tx, ty) for ty in range(-(-h // size)) for tx in range(-(-w // size))}
+
+        if not self.dirty:
+            return
+
+        for tx, ty in self.dirty:
+            if ty * size < h and tx * size < w:
+                ys, xs = self.tile_slices(tx, ty, h, w)
+                tile = self.tiles.get((tx, ty))
+
+                if tile is None or not tile.matches(pixels[ys, xs], connectivity):
+                    self.tiles[tx, ty] = TileLabels(pixels[ys, xs], xs.start, ys.start, connectivity)
+
+        self.dirty.clear()
+        self.stitch(pixels, connectivity)
+
+    def labels(self, x0: int, x1: int, y0: int, y1: int, column: bool) -> np.ndarray:
+        """Общие номера областей вдоль столбца x0 (column) или строки y0 через все плитки"""
+        size = self.tile_size
+        parts = []
+
+        if column:
+            tx = x0 // size
+
+            for ty in range(y0 // size, -(-y1 // size)):
+                parts.append(self.tiles[tx, ty].labels[:, x0 - tx * size] + self.offsets[tx, ty])
+        else:
+            ty = y0 // size
+
+            for tx in range(x0 // size, -(-x1 // size)):
+                parts.append(self.tiles[tx, ty].labels[y0 - ty * size] + self.offsets[tx, ty])
+
+        return np.concatenate(parts)
+
+    def stitch(self, pixels: np.ndarray, connectivity: int):
+        h, w = pixels.shape
+        self.offsets = {}
+        total = 0
+
+        for key in sorted(self.tiles, key=lambda key: (key[1], key[0])):
+            self.offsets[key] = total
+            total += self.tiles[key].count
+
+        a, b = [], []
+
+        for x in range(self.tile_size, w, self.tile_size):
+            first, second = neighbour_pairs(pixels[:, x - 1], pixels[:, x], connectivity)
+            left, right = self.labels(x - 1, x, 0, h, True), self.labels(x, x + 1, 0, h, True)
+            a.append(left[first])
+            b.append(right[second])
+
+        for y in range(self.tile_size, h, self.tile_size):
+            first, second = neighbour_pairs(pixels[y - 1], pixels[y], connectivity)
+            upper, lower = self.labels(0, w, y - 1, y, False), self.labels(0, w, y, y + 1, False)
+            a.append(upper[first])
+            b.append(lower[second])
+
+        parent = np.arange(total, dtype=np.int32)
+
+        if a:
+            parent = union_roots(parent, np.concatenate(a), np.concatenate(b))
+
+        self.roots = parent
+        self.boxes = np.empty((4, total), np.int32)
+        self.boxes[:2] = np.iinfo(np.int32).max
+        self.boxes[2:] = -1
+
+        for key, tile in self.tiles.items():
+            roots = parent[self.offsets[key]:self.offsets[key] + tile.count]
+
+            np.minimum.at(self.boxes[0], roots, tile.boxes[0])
+            np.minimum.at(self.boxes[1], roots, tile.boxes[1])
+            np.maximum.at(self.boxes[2], roots, tile.boxes[2])
+            np.maximum.at(self.boxes[3], roots, tile.boxes[3])
+
+    def find_region(self, image: QImage, x: int, y: int, connectivity: int = 4) -> tuple[np.ndarray, QRect]:
+        """То же, что floodfill.find_region с допуском 0: маска области внутри габарита и сам габарит.
+        Работа пропорциональна площади габарита найденной области"""
+        self.update(image, connectivity)
+
+        size = self.tile_size
+        tx, ty = x // size, y // size
+        tile = self.tiles[tx, ty]
+        region = self.roots[self.offsets[tx, ty] + tile.labels[y - ty * size, x - tx * size]]
+
+        left, top, right, bottom = (int(value) for value in self.boxes[:, region])
+        rect = QRect(left, top, right - left, bottom - top)
+        mask = np.zeros((bottom - top, right - left), bool)
+
+        for ty in range(top // size, -(-bottom // size)):
+            for tx in range(left // size, -(-right // size)):
+                tile = self.tiles[tx, ty]
+                roots = self.roots[self.offsets[tx, ty]:self.offsets[tx, ty] + tile.count]
+
+                x0, y0 = max(left, tx * size), max(top, ty * size)
+                x1, y1 = min(right, (tx + 1) * size), min(bottom, (ty + 1) * size)
+
+                labels = tile.labels[y0 - ty * size:y1 - ty * size, x0 - tx * size:x1 - tx * size]
+                mask[y0 - top:y1 - top, x0 - left:x1 - left] = roots[labels] == region
+
+        return mask, rect
+
+
+class Selection:
+    """Выделение: маска внутри габаритного прямоугольника rect (координаты изображения)"""
+    __slots__ = ("mask", "rect")
+
+    def __init__(self, mask: np.ndarray, rect: QRect):
+        self.mask = mask
+        self.rect = rect
+
+    def crop(self, pixels: np.ndarray) -> np.ndarray:
+        return pixels[self.rect.top():self.rect.bottom() + 1, self.rect.left():self.rect.right() + 1]
+
+    def box(self) -> tuple[int, int, int, int]:
+        """Габаритный прямоугольник как (top, bottom, left, right) для срезов, bottom и right не входят"""
+        return self.rect.top(), self.rect.bottom() + 1, self.rect.left(), self.rect.right() + 1
+
+    def clear(self, image: QImage) -> QRect:
+        """Стирает выделенные пиксели: на прозрачном слое - до прозрачности, на фоне - до белого"""
+        value = 0 if image.format() == QImage.Format.Format_ARGB32 else 0xffffffff
+        self.crop(imagebuffer.pixel_array(image))[self.mask] = value
+
+        return QRect(self.rect)
+
+    def outline(self) -> QImage:
+        """Граница выделения пунктиром из черных и белых отрезков по 4 пикселя"""
+        h, w = self.mask.shape
+        padded = np.pad(self.mask, 1)
+        inner = padded[:-2, 1:-1] & padded[2:, 1:-1] & padded[1:-1, :-2] & padded[1:-1, 2:]
+        edge = self.mask & ~inner
+
+        phase = ((np.arange(h)[:, None] + np.arange(w)[None, :] + self.rect.left() + self.rect.top()) // 4) & 1
+        colors = np.where(phase, np.uint32(0xff000000), np.uint32(0xffffffff))
+
+        image = QImage(w, h, QImage.Format.Format_ARGB32_Premultiplied)
+        image.fill(Qt.GlobalColor.transparent)
+        pixels = imagebuffer.pixel_array(image)
+        pixels[edge] = colors[edge]
+
+        return image
@@ -0,0 +1,96 @@
+import os
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt6.QtGui import QGuiApplication
+from PyQt6.QtCore import Qt
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import argparse
+import sys
+import time
+import oplog
+
+"""Это утилита пакетного воспроизведения журналов действий без окна
+python render.py журнал.json [журнал.json ...] -o папка --jobs 4 --thumbnail 256
+Каждый журнал воспроизводится в отдельном процессе пула (рисование в QImage держит GIL, поэтому потоки не помогли бы),
+результат сохраняется в PNG с именем журнала, а при --thumbnail рядом кладется уменьшенная копия"""
+
+application: QGuiApplication = None
+
+
+def init_worker():
+    """QImage и QPainter работают только при созданном приложении, в каждом процессе оно свое"""
+    global application
+
+    if QGuiApplication.instance() is None:
+        application = QGuiApplication([])
+
+
+def render(path: str, output: str, thumbnail: int = 0) -> tuple[str, str, float]:
+    """Возвращает путь к журналу, путь к результату и время воспроизведения"""
+    start = time.perf_counter()
+
+    image = oplog.replay(oplog.OperationLog.load(path))
+    name = os.path.splitext(os.path.basename(path))[0]
+    result = os.path.join(output, name + ".png")
+
+    if not image.save(result):
+        raise OSError(f"Не удалось сохранить {result}")
+
+    if thumbnail:
+        small = image.scaled(thumbnail, thumbnail, Qt.AspectRatioMode.KeepAspectRatio,
+                             Qt.TransformationMode.SmoothTransformation)
+        small.save(os.path.join(output, name + ".thumb.png"))
+
+    return path, result, time.perf_counter() - start
+
+
+def main(arguments: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Воспроизводит журналы действий и сохраняет результаты в PNG")
+    parser.add_argument("logs", nargs="+", help="файлы журналов (JSON)")
+    parser.add_argument("-o", "--output", default=".", help="папка для результатов")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="число процессов")
+    parser.add_argument("--thumbnail", type=int, default=0, help="размер уменьшенной копии, 0 - без нее")
+    arguments = parser.parse_args(arguments)
+
+    os.makedirs(arguments.output, exist_ok=True)
+    jobs = max(1, min(arguments.jobs, len(arguments.logs)))
+    failed = 0
+
+    if jobs == 1:
+        init_worker()
+        results = []
+
+        for path in arguments.logs:
+            try:
+                results.append(render(path, arguments.output, arguments.thumbnail))
+            except Exception as error:
+                results.append(error)
+    else:
+        # spawn вместо fork: копировать в дочерний процесс уже созданный Qt небезопасно
+        context = multiprocessing.get_context("spawn")
+
+        with ProcessPoolExecutor(jobs, context, initializer=init_worker) as executor:
+            futures = [executor.submit(render, path, arguments.output, arguments.thumbnail)
+                       for path in arguments.logs]
+            results = []
+
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as error:
+                    results.append(error)
+
+    for path, result in zip(arguments.logs, results):
+        if isinstance(result, Exception):
+            failed += 1
+            print(f"{path}: ошибка: {result}", file=sys.stderr)
+        else:
+            print(f"{path} -> {result[1]} ({result[2]:.2f} с)")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -12,7 +12,11 @@ def default_field(obj):
 @dataclass
 class BrushSettings:
     width: int = 3
-    width_range: tuple[int] = (1, 3, 5, 7, 10)
+    width_range: tuple[int] = (1, 3, 5, 7, 10, 15, 20, 30, 50, 80)
+    # жесткость края кончика от 0 (мягкий) до 1 (резкий, сглажен на один пиксель)
+    hardness: float = 1.0
+    # расстояние между отпечатками кисти в долях ее ширины
+    spacing: float = 0.15
 
 
 @dataclass
@@ -20,8 +24,19 @@ class SpraySettings:
     width: int = 10
     width_range: tuple[int] = (5, 10, 15, 20, 25)
     density: int = 0.4
+    # сколько раз в секунду распылять краску, пока зажата кнопка мыши (0 - только при движении мыши)
+    emission_rate: int = 60
+    seed: int = None
+
 
 
+@dataclass
+class FillSettings:
+    tolerance: int = 0
+    connectivity: int = 4
+    # размер плитки карты связных областей (regions.py)
+    label_tile_size: int = 256
+
 
 @dataclass
 class FigureSettings:
@@ -29,9 +44,118 @@ class FigureSettings:
     width_range: tuple[int] = (1, 3, 5, 7, 10)
 
 
+@dataclass
+class HistorySettings:
+    tile_size: int = 64
+    # сколько байт может занимать история, самые старые шаги удаляются
+    budget: int = 256 * 1024 * 1024
+    compress: bool = True
+    # сколько последних шагов хранится без сжатия
+    raw_steps: int = 4
+
+
+@dataclass
+class TileSettings:
+    tile_size: int = 256
+    # изображения больше этого числа пикселей хранятся по плиткам в файле на диске
+    threshold: int = 1820 * 1820
+    max_size: int = 30000
+    # сколько плиток держать готовыми для отрисовки
+    cache_tiles: int = 256
+    # сколько байт могут занимать уменьшенные копии для мелкого масштаба (mipmap.py)
+    mipmap_budget: int = 128 * 1024 * 1024
+    # папка для файла с плитками (None - временная папка системы)
+    directory: str = None
+    # у изображений больше этого числа пикселей сначала показывается уменьшенная копия со стороной preview_size
+    preview_threshold: int = 4_000_000
+    preview_size: int = 1024
+
+
+@dataclass
+class ProfilerSettings:
+    # за сколько последних секунд сохраняются отрезки и профиль cProfile
+    trace_seconds: int = 10
+    # сколько последних замеров каждого этапа берется для перцентилей
+    histogram_size: int = 1000
+    trace_events: int = 200_000
+
+
+@dataclass
+class FilterSettings:
+    # размер плитки, которую обрабатывает один поток
+    tile_size: int = 256
+    # число потоков (0 - по числу ядер)
+    threads: int = 0
+
+
+@dataclass
+class AutosaveSettings:
+    enabled: bool = True
+    # как часто записывать изменения в журнал, в миллисекундах
+    interval: int = 5000
+    tile_size: int = 256
+    # уровень сжатия плиток zlib
+    compression: int = 1
+    # журнал сжимается, когда записей плиток в compact_ratio раз больше, чем разных плиток, и их не меньше compact_records
+    compact_ratio: float = 2.0
+    compact_records: int = 64
+    # папка для журнала (None - ~/.paint/autosave)
+    directory: str = None
+
+
+@dataclass
+class VectorSettings:
+    # сколько фигур лежит в узле квадродерева, прежде чем он делится на четыре
+    node_capacity: int = 16
+    max_depth: int = 12
+    # на каком расстоянии от линии фигуры (в пикселях) щелчок ее выбирает
+    hit_tolerance: int = 3
+
+
+@dataclass
+class InputSettings:
+    # сколько раз в секунду передавать точки инструменту и перерисовывать холст (0 - частота экрана)
+    frame_rate: int = 0
+    # склеивать ли частые события мыши и планшета средствами Qt. Выключено: холст сам собирает точки в пачки,
+    # а промежуточные точки нужны, чтобы линия не превращалась в ломаную
+    compress_events: bool = False
+
+
+@dataclass
+class ExportSettings:
+    # уровень сжатия PNG zlib (0-9), выше - меньше файл и дольше сохранение
+    png_compression: int = 6
+    # качество JPEG (1-100)
+    jpeg_quality: int = 90
+    # сколько цветов в палитре PNG с палитрой и GIF (2-256)
+    colors: int = 256
+    # по скольким случайным пикселям строится палитра и сколько раз она уточняется k-средними
+    quantize_sample: int = 65536
+    kmeans_iterations: int = 4
+
+
+@dataclass
+class CollabSettings:
+    # адрес сервера совместной работы (python collab.py) и порт, на котором его запускает окно
+    host: str = "localhost"
+    port: int = 8765
+    # размер плиток, которыми передаются изменения, и уровень их сжатия zlib
+    tile_size: int = 64
+    compression: int = 6
+
+
 @dataclass
 class Settings:
     primary_color: QColor = default_field(QColor("#000000"))
     brush: BrushSettings = BrushSettings
     spray: FigureSettings = SpraySettings
     figure: FigureSettings = FigureSettings
+    fill: FillSettings = FillSettings
+    history: HistorySettings = HistorySettings
+    tiles: TileSettings = TileSettings
+    filters: FilterSettings = FilterSettings
+    autosave: AutosaveSettings = AutosaveSettings
+    input: InputSettings = InputSettings
+    vector: VectorSettings = VectorSettings
+    export: ExportSettings = ExportSettings
+    collab: CollabSettings = CollabSettings
@@ -7,6 +7,13 @@ style_sheet = """
     border: 0px;
 }
 
+#profiler {
+    background-color: rgba(0, 0, 0, 160);
+    color: white;
+    font-family: monospace;
+    padding: 4px;
+}
+
 #tool_button[state="normal"] {
     border-radius: 7px;
     background-color: #f9f9f9;
@@ -0,0 +1,16 @@
+import os
+import sys
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt6.QtWidgets import QApplication
+import pytest
+
+"""Общее для тестов: модули редактора лежат в корне репозитория, а читатели изображений Qt и холст окна работают
+только при созданном приложении. Тесты запускаются без окна: python -m pytest tests"""
+
+
+@pytest.fixture(scope="session", autouse=True)
+def application():
+    return QApplication.instance() or QApplication([])
@@ -0,0 +1,89 @@
+from PyQt6.QtGui import QImage
+import os
+import numpy as np
+import pytest
+import imagebuffer
+import main
+from settings import AutosaveSettings
+
+"""Проверки журнала автосохранения: холст восстанавливается после сбоя, в том числе когда исходный файл
+перезаписан сохранением, и не восстанавливается поверх файла, который изменили в другой программе"""
+
+
+@pytest.fixture
+def source(tmp_path, monkeypatch) -> str:
+    monkeypatch.setattr(AutosaveSettings, "directory", str(tmp_path / "autosave"))
+
+    image = QImage(80, 60, QImage.Format.Format_RGB32)
+    y, x = np.indices((60, 80), np.uint32)
+    imagebuffer.pixel_array(image)[:] = 0xff000000 | x * 3 << 16 | y * 4 << 8 | (x + y)
+
+    path = str(tmp_path / "source.png")
+    assert image.save(path)
+
+    return path
+
+
+def open_canvas(path: str) -> main.Canvas:
+    canvas = main.Canvas()
+    canvas.open_image(path)
+    canvas.start_autosave()
+
+    return canvas
+
+
+def crash(canvas: main.Canvas) -> np.ndarray:
+    """Записывает последние правки и бросает журнал, как при сбое. Возвращает изображение холста"""
+    canvas.checkpoint()
+    canvas.journal.close(remove=False)
+
+    return imagebuffer.pixel_array(canvas.export_image()).copy()
+
+
+def recover() -> np.ndarray:
+    canvas = main.Canvas()
+    canvas.recover()
+    canvas.journal.close()
+
+    return imagebuffer.pixel_array(canvas.export_image())
+
+
+def test_recovers_after_saving_over_source(source):
+    canvas = open_canvas(source)
+    canvas.apply_filter("invert")
+    canvas.checkpoint()
+
+    canvas.export_image().save(source)
+    canvas.file_saved(source)
+
+    canvas.apply_filter("brightness_contrast", brightness=40, contrast=0)
+    expected = crash(canvas)
+
+    # журнал больше не опирается на перезаписанный файл, иначе инверсия применилась бы к нему второй раз
+    assert np.array_equal(recover(), expected)
+
+
+def test_recovers_after_saving_elsewhere(source, tmp_path):
+    canvas = open_canvas(source)
+    canvas.apply_filter("invert")
+
+    copy = str(tmp_path / "copy.png")
+    canvas.export_image().save(copy)
+    canvas.file_saved(copy)
+
+    canvas.apply_filter("grayscale")
+    expected = crash(canvas)
+
+    assert np.array_equal(recover(), expected)
+
+
+def test_refuses_source_changed_after_crash(source):
+    canvas = open_canvas(source)
+    canvas.apply_filter("invert")
+    crash(canvas)
+
+    QImage(10, 10, QImage.Format.Format_RGB32).save(source)
+    os.utime(source, ns=(0, 0))
+
+    with pytest.raises(OSError, match="Исходный файл изменился"):
+        recover()
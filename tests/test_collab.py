@@ -0,0 +1,170 @@
+from PyQt6.QtWidgets import QApplication
+import asyncio
+import json
+import time
+import numpy as np
+import autosave
+import collab
+import imagebuffer
+import main
+import oplog
+from settings import AutosaveSettings, CollabSettings, TileSettings
+
+"""Проверки совместной работы: нумерация записей на сервере, отключение тех, кто прислал испорченную запись,
+и подключение холста окна к сеансу и запись чужих правок в журналы"""
+
+
+async def read_frame(reader: asyncio.StreamReader) -> tuple[bytes, int, bytes]:
+    kind, seq, length = collab.FRAME.unpack(await reader.readexactly(collab.FRAME.size))
+
+    return kind, seq, await reader.readexactly(length)
+
+
+async def join(port: int) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """Подключается и дочитывает снимок до SNAP"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+
+    while (await read_frame(reader))[0] != collab.SNAPSHOT:
+        pass
+
+    return reader, writer
+
+
+def run_relay(scenario):
+    async def main():
+        relay = collab.Relay()
+        server = await asyncio.start_server(relay.handle, "127.0.0.1", 0)
+
+        try:
+            return await asyncio.wait_for(scenario(relay, server.sockets[0].getsockname()[1]), 10)
+        finally:
+            server.close()
+
+    return asyncio.run(main())
+
+
+BASE = json.dumps({"width": 64, "height": 64}).encode("utf-8")
+TILE = autosave.tile_payload(0, 0, 0, np.zeros((4, 4), np.uint32), 1)
+BAD_RECORDS = [
+    (autosave.TILE_RECORD, b"short"),
+    (autosave.TILE_RECORD, TILE[:autosave.TILE.size] + b"not zlib"),
+    (autosave.TILE_RECORD, autosave.TILE.pack(0, 0, 0, 5, 5) + TILE[autosave.TILE.size:]),
+    (autosave.LAYR, b"{not json"),
+    (autosave.LAYR, json.dumps({"layers": [{"id": 1}], "active": 0, "counter": 1}).encode("utf-8")),
+    (autosave.BASE, json.dumps({"width": -1, "height": 10}).encode("utf-8")),
+]
+
+
+def test_bad_record_disconnects_only_sender():
+    async def scenario(relay, port):
+        good_reader, good_writer = await join(port)
+        good_writer.write(collab.pack_frame(autosave.BASE, 0, BASE))
+        assert (await read_frame(good_reader))[:2] == (collab.ACK, 1)
+
+        watcher, _ = await join(port)
+
+        for kind, payload in BAD_RECORDS:
+            bad_reader, bad_writer = await join(port)
+            bad_writer.write(collab.pack_frame(kind, 0, payload))
+
+            # сервер закрывает соединение, ничего не ответив
+            assert await bad_reader.read() == b""
+
+        assert relay.seq == 1
+
+        good_writer.write(collab.pack_frame(autosave.TILE_RECORD, 0, TILE))
+
+        assert (await read_frame(watcher))[:2] == (autosave.TILE_RECORD, 2)
+        assert (await read_frame(good_reader))[:2] == (collab.ACK, 2)
+
+        return relay
+
+    relay = run_relay(scenario)
+
+    assert relay.base == BASE
+    assert list(relay.tiles) == [(0, 0, 0)]
+
+
+def wait_until(condition, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+
+    while not condition() and time.monotonic() < deadline:
+        QApplication.processEvents()
+        time.sleep(0.005)
+
+    return condition()
+
+
+def test_join_refuses_canvas_over_tile_threshold():
+    """Общий холст больше порога плиточного хранилища не открывается: у хранилища нет слоев"""
+    relay = collab.RelayThread("127.0.0.1", 0)
+    side = int(TileSettings.threshold ** 0.5) + 1
+    relay.relay.apply(autosave.BASE, json.dumps({"width": side, "height": side}).encode("utf-8"))
+    relay.serve()
+
+    canvas = main.Canvas()
+    messages = []
+    canvas.status_message.connect(messages.append)
+
+    try:
+        canvas.connect_session("127.0.0.1", relay.port)
+
+        assert wait_until(lambda: canvas.session is None)
+    finally:
+        canvas.disconnect_session()
+        relay.stop()
+        relay.join(5)
+
+    assert canvas.store is None and canvas.layers is not None
+    assert (canvas.image.width(), canvas.image.height()) == (1200, 600)
+    assert "Большие изображения в плиточном хранилище нельзя редактировать совместно" in messages
+
+
+def layers_record(*layers: tuple[int, str], counter: int = 3) -> tuple[bytes, bytes]:
+    entries = [{"id": layer_id, "name": name, "visible": True, "opacity": 1.0, "blend_mode": "normal"}
+               for layer_id, name in layers]
+
+    return autosave.LAYR, json.dumps({"layers": entries, "active": 0, "counter": counter}).encode("utf-8")
+
+
+def tile_record(layer_id: int, x: int, y: int, w: int, h: int, value: int) -> tuple[bytes, bytes]:
+    return autosave.TILE_RECORD, autosave.tile_payload(layer_id, x, y, np.full((h, w), value, np.uint32), 1)
+
+
+def test_remote_edits_reach_log_and_journal(tmp_path, monkeypatch):
+    """Чужие правки воспроизводятся журналом действий и переживают сбой через журнал автосохранения"""
+    monkeypatch.setattr(AutosaveSettings, "directory", str(tmp_path))
+    canvas = main.Canvas()
+    canvas.start_autosave()
+
+    canvas.session = collab.Session(CollabSettings, canvas)
+    canvas.session.joining = False
+
+    canvas.apply_remote([
+        (autosave.BASE, json.dumps({"width": 150, "height": 90}).encode("utf-8")),
+        layers_record((1, "Фон"), (2, "Верх")),
+        tile_record(1, 0, 0, 64, 64, 0xff336699),
+        tile_record(1, 64, 0, 64, 64, 0xff996633),
+        tile_record(2, 20, 30, 64, 60, 0x80ff0000),
+    ])
+    canvas.apply_remote([
+        layers_record((2, "Верх"), (1, "Фон"), (3, "Новый"), counter=4),
+        tile_record(3, 64, 64, 64, 26, 0xff00ff00),
+        tile_record(1, 0, 0, 64, 64, 0xff000000),
+    ])
+
+    expected = imagebuffer.pixel_array(canvas.layers.flatten()).copy()
+    assert [layer.name for layer in canvas.layers.layers] == ["Верх", "Фон", "Новый"]
+
+    replayed = oplog.replay(canvas.log)
+    assert np.array_equal(imagebuffer.pixel_array(replayed), expected)
+
+    canvas.session = None
+    canvas.checkpoint()
+    canvas.journal.close(remove=False)
+
+    recovered = main.Canvas()
+    recovered.recover()
+    recovered.journal.close()
+
+    assert np.array_equal(imagebuffer.pixel_array(recovered.layers.flatten()), expected)
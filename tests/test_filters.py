@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from filters import FilterEngine, make_filter
+from settings import FilterSettings
+
+"""Проверки движка фильтров: плитки в нескольких потоках с запасом halo дают то же, что обработка целиком,
+а выделение обрабатывается в своем прямоугольнике с настоящими соседними пикселями"""
+
+FILTERS = [("blur", {"radius": 5}), ("sharpen", {"amount": 1.5, "radius": 3}), ("invert", {}), ("grayscale", {}),
+           ("brightness_contrast", {"brightness": 20, "contrast": -30})]
+
+
+def make_pixels(height: int = 150, width: int = 170, alpha: bool = False) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 1 << 32, (height, width), dtype=np.uint32)
+
+    return pixels if alpha else pixels | np.uint32(0xff000000)
+
+
+def whole(name: str, params: dict, pixels: np.ndarray) -> np.ndarray:
+    """Эталон: одна плитка на все изображение в одном потоке"""
+    result = pixels.copy()
+    FilterEngine(FilterSettings(tile_size=10 ** 6, threads=1)).run(make_filter(name, **params), result)
+
+    return result
+
+
+@pytest.mark.parametrize("alpha", [False, True])
+@pytest.mark.parametrize("name, params", FILTERS)
+def test_tiles_match_whole_image(name, params, alpha):
+    pixels = make_pixels(alpha=alpha)
+    tiled = pixels.copy()
+
+    FilterEngine(FilterSettings(tile_size=32, threads=4)).run(make_filter(name, **params), tiled)
+
+    assert np.array_equal(tiled, whole(name, params, pixels))
+
+
+@pytest.mark.parametrize("box", [(40, 90, 50, 120), (0, 30, 140, 170), (0, 150, 0, 170)])
+@pytest.mark.parametrize("name, params", FILTERS)
+def test_selection_uses_real_neighbours(name, params, box):
+    """Внутри выделения результат тот же, что у фильтра на всем изображении, снаружи пиксели не меняются"""
+    pixels = make_pixels()
+    top, bottom, left, right = box
+    y, x = np.ogrid[top:bottom, left:right]
+    mask = (y + x) % 3 != 0
+
+    selected = pixels.copy()
+    FilterEngine(FilterSettings(tile_size=16, threads=3)).run(make_filter(name, **params), selected, mask, box)
+
+    inside = np.zeros(pixels.shape, bool)
+    inside[top:bottom, left:right] = mask
+    expected = np.where(inside, whole(name, params, pixels), pixels)
+
+    assert np.array_equal(selected, expected)
@@ -0,0 +1,98 @@
+from PyQt6.QtGui import QImage, QColor
+from collections import deque
+import numpy as np
+import pytest
+import floodfill
+import imagebuffer
+
+"""Проверки заливки по отрезкам: область совпадает с попиксельным обходом в ширину при 4- и 8-связности
+и любом допуске, диагональное касание соединяет области только при 8-связности"""
+
+PALETTE = np.array([0xff000000, 0xff0a0a0a, 0xff141414, 0xffffffff], np.uint32)
+
+
+def reference_region(pixels: np.ndarray, x: int, y: int, tolerance: int, connectivity: int) -> np.ndarray:
+    """Эталон: обход в ширину по отдельным пикселям, маска размером с все изображение"""
+    h, w = pixels.shape
+    target = np.array([pixels[y, x]], np.uint32).view(np.uint8).astype(int)
+    channels = imagebuffer.channel_array(pixels).astype(int)
+    similar = (np.abs(channels - target) <= tolerance).all(axis=2)
+
+    steps = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+    if connectivity == 8:
+        steps += [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+
+    mask = np.zeros((h, w), bool)
+    mask[y, x] = True
+    queue = deque([(x, y)])
+
+    while queue:
+        cx, cy = queue.popleft()
+
+        for dx, dy in steps:
+            nx, ny = cx + dx, cy + dy
+
+            if 0 <= nx < w and 0 <= ny < h and similar[ny, nx] and not mask[ny, nx]:
+                mask[ny, nx] = True
+                queue.append((nx, ny))
+
+    return mask
+
+
+def whole_mask(pixels: np.ndarray, x: int, y: int, tolerance: int, connectivity: int) -> np.ndarray:
+    region, rect = floodfill.find_region(pixels, x, y, tolerance, connectivity)
+    mask = np.zeros(pixels.shape, bool)
+    mask[rect.top():rect.bottom() + 1, rect.left():rect.right() + 1] = region
+
+    return mask
+
+
+@pytest.mark.parametrize("connectivity", [4, 8])
+@pytest.mark.parametrize("tolerance", [0, 10, 20])
+def test_region_matches_pixel_search(tolerance, connectivity):
+    rng = np.random.default_rng(tolerance + connectivity)
+    pixels = PALETTE[rng.integers(0, len(PALETTE), (40, 50))]
+
+    for x, y in rng.integers(0, 40, (25, 2)):
+        expected = reference_region(pixels, x, y, tolerance, connectivity)
+
+        assert np.array_equal(whole_mask(pixels, x, y, tolerance, connectivity), expected)
+
+
+def test_diagonal_joins_only_with_eight_neighbours():
+    pixels = np.full((5, 5), 0xffffffff, np.uint32)
+    np.fill_diagonal(pixels, 0xff000000)
+
+    assert whole_mask(pixels, 0, 0, 0, 4).sum() == 1
+    assert whole_mask(pixels, 0, 0, 0, 8).sum() == 5
+
+    # белые треугольники по обе стороны диагонали соединяются через ее углы только при 8-связности
+    assert whole_mask(pixels, 4, 0, 0, 4).sum() == 10
+    assert whole_mask(pixels, 4, 0, 0, 8).sum() == 20
+
+
+def test_tolerance_limits_each_channel():
+    pixels = np.array([[0xff000000, 0xff000010, 0xff001010, 0xff100000]], np.uint32)
+
+    assert whole_mask(pixels, 0, 0, 0x0f, 4).tolist() == [[True, False, False, False]]
+    assert whole_mask(pixels, 0, 0, 0x10, 4).tolist() == [[True, True, True, True]]
+
+    # канал, который отличается сильнее допуска, обрывает область, даже если остальные совпадают
+    pixels[0, 1] = 0xff200000
+    assert whole_mask(pixels, 0, 0, 0x10, 4).tolist() == [[True, False, False, False]]
+
+
+def test_flood_fill_paints_region_and_returns_rect():
+    image = QImage(30, 20, QImage.Format.Format_RGB32)
+    image.fill(QColor("#ffffff"))
+    pixels = imagebuffer.pixel_array(image)
+    pixels[:, 10] = 0xff000000
+
+    rect = floodfill.flood_fill(image, 15, 5, QColor("#ff0000"))
+
+    assert (rect.left(), rect.top(), rect.width(), rect.height()) == (11, 0, 19, 20)
+    assert (pixels[:, 11:] == 0xffff0000).all()
+    assert (pixels[:, :10] == 0xffffffff).all() and (pixels[:, 10] == 0xff000000).all()
+
+    # заливка тем же цветом ничего не меняет
+    assert floodfill.flood_fill(image, 15, 5, QColor("#ff0000")).isNull()
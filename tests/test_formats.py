@@ -0,0 +1,253 @@
+from PyQt6.QtGui import QImage
+import numpy as np
+import pytest
+import autosave
+import collab
+import fileio
+import imagebuffer
+from settings import AutosaveSettings
+
+"""Проверки собственных двоичных форматов: GIF с его сжатием LZW, PNG с палитрой, журнал автосохранения
+и кадры совместной работы. Изображения читаются обратно читателями Qt, то есть так, как их увидят другие программы"""
+
+COLORS = [2, 3, 17, 256]
+
+
+def make_picture(colors: int, width: int = 37, height: int = 23, alpha: bool = False, seed: int = 0):
+    """Случайные номера цветов и палитра из colors различных цветов"""
+    rng = np.random.default_rng(seed)
+    palette = rng.choice(1 << 24, colors, replace=False).astype(np.uint32)
+
+    if alpha:
+        palette |= rng.integers(0, 256, colors).astype(np.uint32) << 24
+    else:
+        palette |= np.uint32(0xff000000)
+
+    indices = rng.integers(0, colors, (height, width)).astype(np.uint8)
+
+    return indices, palette
+
+
+def read_pixels(path: str) -> np.ndarray:
+    image = QImage(path)
+    assert not image.isNull()
+
+    return imagebuffer.pixel_array(image.convertToFormat(QImage.Format.Format_ARGB32)).copy()
+
+
+def lzw_decode(data: bytes, min_size: int) -> tuple[bytes, int]:
+    """Декодер LZW по описанию GIF89a, независимый от кодировщика. Возвращает данные и число кодов очистки"""
+    clear = 1 << min_size
+    end = clear + 1
+    size = min_size + 1
+    table: list[bytes] = []
+    previous: bytes = None
+    resets = 0
+
+    output = bytearray()
+    stream = iter(data)
+    buffer = bits = 0
+
+    while True:
+        while bits < size:
+            buffer |= next(stream) << bits
+            bits += 8
+
+        code = buffer & ((1 << size) - 1)
+        buffer >>= size
+        bits -= size
+
+        if code == clear:
+            table = [bytes([value]) for value in range(clear)] + [b"", b""]
+            size = min_size + 1
+            previous = None
+            resets += 1
+            continue
+
+        if code == end:
+            return bytes(output), resets
+
+        if previous is None:
+            entry = table[code]
+        else:
+            entry = table[code] if code < len(table) else previous + previous[:1]
+
+            if len(table) < 4096:
+                table.append(previous + entry[:1])
+
+        output += entry
+        previous = entry
+
+        if len(table) == 1 << size and size < 12:
+            size += 1
+
+
+@pytest.mark.parametrize("colors", COLORS)
+def test_lzw_matches_reference_decoder(colors):
+    min_size = max((colors - 1).bit_length(), 2)
+    data = np.random.default_rng(colors).integers(0, colors, 5000).astype(np.uint8).tobytes()
+
+    assert lzw_decode(fileio.lzw_encode(data, min_size), min_size)[0] == data
+
+
+@pytest.mark.parametrize("colors", [2, 256])
+def test_lzw_table_reset(colors):
+    """Шумные данные заполняют таблицу из 4096 кодов, и кодировщик начинает ее заново"""
+    min_size = max((colors - 1).bit_length(), 2)
+    data = np.random.default_rng(1).integers(0, colors, 200_000).astype(np.uint8).tobytes()
+
+    decoded, resets = lzw_decode(fileio.lzw_encode(data, min_size, chunk=4096), min_size)
+
+    assert decoded == data
+    assert resets > 1
+
+
+@pytest.mark.parametrize("colors", COLORS)
+def test_gif_roundtrip(tmp_path, colors):
+    indices, palette = make_picture(colors)
+    path = str(tmp_path / "picture.gif")
+
+    fileio.write_gif(path, indices, palette)
+
+    assert np.array_equal(read_pixels(path), palette[indices])
+
+
+def test_gif_roundtrip_with_table_reset(tmp_path):
+    indices, palette = make_picture(256, 300, 200, seed=2)
+    path = str(tmp_path / "noise.gif")
+
+    fileio.write_gif(path, indices, palette)
+
+    assert np.array_equal(read_pixels(path), palette[indices])
+
+
+def test_gif_transparency(tmp_path):
+    """Все цвета с альфой меньше половины сводятся к одному прозрачному"""
+    indices, palette = make_picture(4)
+    palette[1] &= np.uint32(0x00ffffff)
+    palette[3] &= np.uint32(0x10ffffff)
+    path = str(tmp_path / "transparent.gif")
+
+    fileio.write_gif(path, indices, palette)
+    pixels = read_pixels(path)
+
+    transparent = (indices == 1) | (indices == 3)
+    assert not (pixels[transparent] >> 24).any()
+    assert np.array_equal(pixels[~transparent], palette[indices][~transparent])
+
+
+@pytest.mark.parametrize("alpha", [False, True])
+@pytest.mark.parametrize("colors", COLORS)
+def test_indexed_png_roundtrip(tmp_path, colors, alpha):
+    indices, palette = make_picture(colors, alpha=alpha)
+    height, width = indices.shape
+    path = str(tmp_path / "picture.png")
+
+    fileio.write_indexed_png(path, lambda top, bottom: indices[top:bottom], width, height, palette, stripe=8)
+
+    assert np.array_equal(read_pixels(path), palette[indices])
+
+
+@pytest.mark.parametrize("colors, depth", [(2, 1), (3, 2), (4, 2), (5, 4), (16, 4), (17, 8), (256, 8)])
+def test_palette_depth(colors, depth):
+    assert fileio.palette_depth(colors) == depth
+
+
+def journal_bytes() -> tuple[bytes, list[tuple[bytes, bytes]]]:
+    tile = np.arange(12, dtype=np.uint32).reshape(3, 4)
+    records = [
+        (autosave.BASE, b'{"width": 4, "height": 3, "source": null}'),
+        (autosave.TILE_RECORD, autosave.tile_payload(0, 0, 0, tile, 6)),
+        (autosave.TILE_RECORD, autosave.tile_payload(0, 0, 0, tile + 1, 6)),
+    ]
+
+    return autosave.MAGIC + b"".join(autosave.pack_record(*record) for record in records), records
+
+
+def read_records(tmp_path, data: bytes) -> list[tuple[bytes, bytes]]:
+    path = tmp_path / "journal.bin"
+    path.write_bytes(data)
+
+    return list(autosave.read_journal(str(path)))
+
+
+def test_journal_reads_all_records(tmp_path):
+    data, records = journal_bytes()
+
+    assert read_records(tmp_path, data) == records
+
+    layer_id, x, y, pixels = autosave.unpack_tile(records[2][1])
+    assert (layer_id, x, y) == (0, 0, 0)
+    assert np.array_equal(pixels, np.arange(1, 13, dtype=np.uint32).reshape(3, 4))
+
+
+def test_journal_truncated_tail(tmp_path):
+    """Обрыв в любом месте последней записи отбрасывает только ее"""
+    data, records = journal_bytes()
+    last = len(data) - len(autosave.pack_record(*records[-1]))
+
+    for cut in range(last, len(data)):
+        assert read_records(tmp_path, data[:cut]) == records[:-1]
+
+
+def test_journal_corrupted_record(tmp_path):
+    """Испорченная запись и все после нее не читаются, записи до нее остаются"""
+    data, records = journal_bytes()
+    start = len(autosave.MAGIC) + len(autosave.pack_record(*records[0]))
+
+    for offset in (0, autosave.HEADER.size + 2, len(autosave.pack_record(*records[1])) - 1):
+        corrupted = bytearray(data)
+        corrupted[start + offset] ^= 0x40
+
+        assert read_records(tmp_path, bytes(corrupted)) == records[:1]
+
+
+def test_journal_wrong_magic(tmp_path):
+    data, _ = journal_bytes()
+
+    assert read_records(tmp_path, b"NOTAJRNL" + data[len(autosave.MAGIC):]) == []
+
+
+def test_journal_compaction_keeps_latest_tile(tmp_path, monkeypatch):
+    monkeypatch.setattr(AutosaveSettings, "directory", str(tmp_path))
+    journal = autosave.Journal(AutosaveSettings)
+    data, records = journal_bytes()
+
+    journal.start([autosave.pack_record(*records[0])])
+    journal.append([], [(0, 0, 0, autosave.unpack_tile(payload)[3]) for _, payload in records[1:]])
+    journal.compact()
+
+    compacted = list(autosave.read_journal(journal.path))
+    assert [kind for kind, _ in compacted] == [autosave.BASE, autosave.TILE_RECORD]
+    assert np.array_equal(autosave.unpack_tile(compacted[1][1])[3], autosave.unpack_tile(records[2][1])[3])
+
+
+def test_frames_split_anywhere():
+    """Кадры собираются из кусков любого размера, в том числе по одному байту"""
+    frames = [(collab.HELLO, 0, b'{"client": 1}'), (autosave.TILE_RECORD, 5, b"x" * 300), (collab.ACK, 6, b"")]
+    stream = b"".join(collab.pack_frame(*frame) for frame in frames)
+
+    for size in (1, 7, len(stream)):
+        reader = collab.FrameReader()
+        received = []
+
+        for start in range(0, len(stream), size):
+            received += reader.feed(stream[start:start + size])
+
+        assert received == frames
+        assert not reader.buffer
+
+
+def test_frames_truncated_wait_for_rest():
+    reader = collab.FrameReader()
+    frame = collab.pack_frame(autosave.LAYR, 3, b"{}" * 10)
+
+    assert reader.feed(frame[:-1]) == []
+    assert reader.feed(frame[-1:]) == [(autosave.LAYR, 3, b"{}" * 10)]
+
+
+def test_frames_oversized_length_is_rejected():
+    reader = collab.FrameReader()
+
+    with pytest.raises(ValueError):
+        reader.feed(collab.FRAME.pack(autosave.TILE_RECORD, 1, collab.MAX_FRAME + 1))
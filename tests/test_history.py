@@ -0,0 +1,88 @@
+from PyQt6.QtGui import QImage
+from PyQt6.QtCore import QRect
+import numpy as np
+import imagebuffer
+from history import History
+from settings import HistorySettings
+
+"""Проверки истории изменений: отмена и повтор по плиткам и чужие пиксели, записанные мимо истории"""
+
+
+def make_history() -> tuple[History, QImage]:
+    image = QImage(200, 150, QImage.Format.Format_RGB32)
+    image.fill(0xffffffff)
+
+    history = History(HistorySettings)
+    history.reset(imagebuffer.pixel_array(image).copy())
+
+    return history, image
+
+
+def paint(history: History, image: QImage, rect: QRect, value: int):
+    imagebuffer.pixel_array(image)[rect.top():rect.bottom() + 1, rect.left():rect.right() + 1] = value
+    history.commit(image, rect)
+
+
+def test_undo_redo_roundtrip():
+    history, image = make_history()
+    states = [imagebuffer.pixel_array(image).copy()]
+
+    for index, rect in enumerate([QRect(10, 10, 100, 20), QRect(50, 0, 30, 150), QRect(0, 100, 200, 50)]):
+        paint(history, image, rect, 0xff000000 | index * 0x102030)
+        states.append(imagebuffer.pixel_array(image).copy())
+
+    for state in reversed(states[:-1]):
+        history.undo(image)
+        assert np.array_equal(imagebuffer.pixel_array(image), state)
+
+    for state in states[1:]:
+        history.redo(image)
+        assert np.array_equal(imagebuffer.pixel_array(image), state)
+
+
+def test_undo_keeps_pixels_written_past_history():
+    """Чужая правка поверх своего шага переживает отмену и повтор этого шага"""
+    history, image = make_history()
+    paint(history, image, QRect(0, 0, 120, 40), 0xff0000ff)
+
+    foreign = np.full((100, 10), 0xffff0000, np.uint32)
+    foreign_rect = QRect(30, 20, 10, 100)
+    imagebuffer.pixel_array(image)[20:120, 30:40] = foreign
+    history.write(None, foreign_rect, foreign)
+
+    history.undo(image)
+    pixels = imagebuffer.pixel_array(image)
+
+    assert np.array_equal(pixels[20:120, 30:40], foreign)
+    assert (pixels[0:20, :] == 0xffffffff).all()
+    assert (pixels[20:40, 40:120] == 0xffffffff).all()
+
+    history.redo(image)
+    pixels = imagebuffer.pixel_array(image)
+
+    assert np.array_equal(pixels[20:120, 30:40], foreign)
+    assert (pixels[0:20, 0:120] == 0xff0000ff).all()
+
+
+def test_budget_applies_to_redo_steps():
+    """После долгой отмены шаги лежат в стеке повтора, и бюджет удаляет самые дальние из них"""
+    history, image = make_history()
+    history.compress = False
+    states = [imagebuffer.pixel_array(image).copy()]
+
+    for index in range(10):
+        paint(history, image, QRect(index * 20, 0, 20, 64), 0xff000000 | index * 0x111111)
+        states.append(imagebuffer.pixel_array(image).copy())
+
+    while history.can_undo():
+        history.undo(image)
+
+    history.budget = history.size // 3
+    history.shrink()
+
+    assert history.size <= history.budget
+    assert 0 < len(history.redo_steps) < 10
+
+    for state in states[1:len(history.redo_steps) + 1]:
+        history.redo(image)
+        assert np.array_equal(imagebuffer.pixel_array(image), state)
@@ -0,0 +1,109 @@
+from PyQt6.QtCore import QRect
+import numpy as np
+import pytest
+from mipmap import Mipmap, downsample
+
+"""Проверки пирамиды уменьшенных копий: каждый уровень из плиток совпадает с уменьшением всего изображения,
+кэш не выходит за бюджет и вытесняет давно не показанные плитки, правка сбрасывает только плитки над собой"""
+
+
+class Source:
+    """Исходное изображение в массиве, считает обращения"""
+
+    def __init__(self, pixels: np.ndarray):
+        self.pixels = pixels
+        self.reads = 0
+
+    def __call__(self, rect: QRect) -> np.ndarray:
+        self.reads += 1
+
+        return self.pixels[rect.top():rect.bottom() + 1, rect.left():rect.right() + 1].copy()
+
+
+def make_mipmap(h: int = 150, w: int = 203, tile_size: int = 16, budget: int = 1 << 30) -> Mipmap:
+    pixels = np.random.default_rng(0).integers(0, 1 << 32, (h, w), dtype=np.uint32)
+
+    return Mipmap(Source(pixels), w, h, tile_size, budget)
+
+
+def reference_level(pixels: np.ndarray, level: int) -> np.ndarray:
+    for _ in range(level):
+        pixels = downsample(pixels)
+
+    return pixels
+
+
+def test_levels_match_whole_image_downsample():
+    mipmap = make_mipmap()
+
+    assert mipmap.max_level == 4
+
+    for level in range(mipmap.max_level + 1):
+        rect = mipmap.level_rect(level)
+        expected = reference_level(mipmap.source.pixels, level)
+
+        assert (rect.height(), rect.width()) == expected.shape
+        assert np.array_equal(mipmap.read(level, rect), expected)
+
+    # часть уровня через границы плиток
+    assert np.array_equal(mipmap.read(2, QRect(5, 7, 30, 20)), reference_level(mipmap.source.pixels, 2)[7:27, 5:35])
+
+
+def test_level_for_zoom():
+    mipmap = make_mipmap()
+
+    assert [mipmap.level_for(zoom) for zoom in (2.0, 1.0, 0.6, 0.5, 0.3, 0.25, 0.01)] == [0, 0, 0, 1, 1, 2, 4]
+
+
+def test_cached_tiles_do_not_read_source():
+    mipmap = make_mipmap()
+    mipmap.read(3, mipmap.level_rect(3))
+    reads = mipmap.source.reads
+
+    mipmap.read(3, mipmap.level_rect(3))
+    mipmap.read(1, QRect(0, 0, 40, 40))
+
+    assert mipmap.source.reads == reads
+
+
+def test_budget_evicts_least_recently_used():
+    tile_bytes = 16 * 16 * 4
+    mipmap = make_mipmap(budget=10 * tile_bytes)
+
+    mipmap.read(1, mipmap.level_rect(1))
+    assert mipmap.size <= mipmap.budget
+    assert mipmap.size == sum(tile.nbytes for tile, _ in mipmap.tiles.values())
+
+    first = next(iter(mipmap.tiles))
+    mipmap.get_tile(*first)
+    mipmap.get_tile(2, 0, 0)
+
+    # только что показанная плитка осталась, вытеснена следующая по давности
+    assert first in mipmap.tiles and (2, 0, 0) in mipmap.tiles
+
+    # бюджет меньше плитки: держится одна последняя плитка, и ее пиксели верны
+    tiny = make_mipmap(budget=1)
+    tile, _ = tiny.get_tile(2, 1, 1)
+
+    assert list(tiny.tiles) == [(2, 1, 1)]
+    assert np.array_equal(tile, reference_level(tiny.source.pixels, 2)[16:32, 16:32])
+
+
+@pytest.mark.parametrize("rect", [QRect(40, 30, 10, 10), QRect(0, 0, 1, 1), QRect(190, 140, 13, 10)])
+def test_invalidate_drops_only_covering_tiles(rect):
+    mipmap = make_mipmap()
+    for level in range(1, mipmap.max_level + 1):
+        mipmap.read(level, mipmap.level_rect(level))
+
+    kept = dict(mipmap.tiles)
+
+    mipmap.source.pixels[rect.top():rect.bottom() + 1, rect.left():rect.right() + 1] = 0xff00ff00
+    mipmap.invalidate(rect)
+
+    for level in range(1, mipmap.max_level + 1):
+        assert np.array_equal(mipmap.read(level, mipmap.level_rect(level)),
+                              reference_level(mipmap.source.pixels, level))
+
+    # плитки вдали от правки не строились заново
+    dropped = [key for key, entry in kept.items() if mipmap.tiles[key] is not entry]
+    assert 0 < len(dropped) <= 4 * mipmap.max_level
@@ -0,0 +1,115 @@
+from PyQt6.QtGui import QColor, QMouseEvent
+from PyQt6.QtCore import Qt, QEvent, QPointF
+import functools
+import numpy as np
+import pytest
+import drawing
+import imagebuffer
+import main
+import oplog
+from settings import HistorySettings
+
+"""Проверки журнала действий: воспроизведение без окна дает то же изображение, что было на холсте,
+для штрихов всех инструментов, фильтров, выделения, слоев и отмены"""
+
+
+@pytest.mark.parametrize("kind", ["undo", "redo"])
+def test_replay_refuses_missing_step(kind):
+    """Отмена без шагов в истории - ошибка журнала, а не AttributeError посреди воспроизведения"""
+    log = oplog.OperationLog(40, 30, operations=[oplog.Operation(kind)])
+
+    with pytest.raises(ValueError, match="Операция 1"):
+        oplog.replay(log)
+
+
+def fill(color: str) -> oplog.Operation:
+    """Заливка всего пустого холста цветом color"""
+    settings = oplog.settings_to_dict(oplog.Settings(primary_color=QColor(color)))
+
+    return oplog.Operation("stroke", "Fill", settings, 0, [["press", [[5, 5]]], ["release", [[5, 5]]]])
+
+
+def test_replay_keeps_steps_over_default_budget(monkeypatch):
+    """Окно с большим бюджетом истории может отменить шаг, который удалила бы история по умолчанию"""
+    log = oplog.OperationLog(40, 30, operations=[fill("#ff0000"), fill("#00ff00"), fill("#0000ff"),
+                                                 oplog.Operation("undo"), oplog.Operation("undo")])
+
+    # история по умолчанию с бюджетом меньше, чем у записавшего журнал окна
+    monkeypatch.setattr(oplog, "HistorySettings", functools.partial(HistorySettings, budget=1))
+    image = oplog.replay(log)
+
+    assert (imagebuffer.pixel_array(image) == 0xffff0000).all()
+
+
+def mouse(canvas: main.Canvas, kind: QEvent.Type, x: int, y: int):
+    buttons = Qt.MouseButton.NoButton if kind == QEvent.Type.MouseButtonRelease else Qt.MouseButton.LeftButton
+    event = QMouseEvent(kind, QPointF(x, y), QPointF(x, y), Qt.MouseButton.LeftButton, buttons,
+                        Qt.KeyboardModifier.NoModifier)
+
+    {QEvent.Type.MouseButtonPress: canvas.mousePressEvent, QEvent.Type.MouseMove: canvas.mouseMoveEvent,
+     QEvent.Type.MouseButtonRelease: canvas.mouseReleaseEvent}[kind](event)
+
+
+def stroke(canvas: main.Canvas, tool: type, *points: tuple[int, int], color: str = "#000000", hold: int = 0):
+    """Штрих мышью по холсту: точки движения уходят инструменту пачками по кадрам, hold - срабатывания таймера
+    распыления в последней точке"""
+    canvas.settings.primary_color = QColor(color)
+    canvas.update_tool(tool)
+
+    mouse(canvas, QEvent.Type.MouseButtonPress, *points[0])
+
+    for i, point in enumerate(points[1:-1], 1):
+        mouse(canvas, QEvent.Type.MouseMove, *point)
+
+        if i % 3 == 0:
+            canvas.flush_points()
+
+    for _ in range(hold):
+        canvas.emit_tool()
+
+    mouse(canvas, QEvent.Type.MouseButtonRelease, *points[-1])
+
+
+def test_replay_matches_canvas(tmp_path):
+    """Журнал, записанный холстом, воспроизводится без окна в то же изображение пиксель в пиксель"""
+    canvas = main.Canvas()
+    canvas.new_image(160, 120)
+
+    stroke(canvas, drawing.Brush, (10, 10), (40, 30), (80, 20), (120, 90), (60, 100), color="#ff0000")
+    stroke(canvas, drawing.Spray, (50, 50), (55, 52), (70, 60), color="#0000ff", hold=3)
+    stroke(canvas, drawing.Fill, (150, 5), color="#00ff00")
+
+    canvas.change_layers("add_layer")
+    stroke(canvas, drawing.Rectangle, (20, 20), (60, 40), (90, 70), color="#ffff00")
+    canvas.change_layers("set_layer", index=1, opacity=0.6, blend_mode="multiply")
+
+    canvas.change_layers("select_layer", index=0)
+    stroke(canvas, drawing.MagicWand, (150, 110))
+    canvas.apply_filter("blur", radius=3)
+    canvas.apply_filter("brightness_contrast", brightness=30, contrast=10)
+    canvas.delete_selection()
+    canvas.deselect()
+
+    canvas.undo()
+    canvas.undo()
+    canvas.redo()
+
+    canvas.change_layers("add_layer", vector=True)
+    stroke(canvas, drawing.Ellipse, (100, 10), (130, 50), (150, 60), color="#ff00ff")
+    stroke(canvas, drawing.Line, (5, 115), (80, 60), color="#00ffff")
+    stroke(canvas, drawing.ShapeMover, (125, 10), (115, 30), (105, 50))
+    canvas.change_layers("move_layer", index=2, offset=-1)
+
+    kinds = {operation.kind for operation in canvas.log.operations}
+    assert {"stroke", "filter", "delete_selection", "undo", "redo", "add_layer", "set_layer"} <= kinds
+
+    expected = imagebuffer.pixel_array(canvas.layers.flatten())
+    replayed = imagebuffer.pixel_array(oplog.replay(canvas.log))
+
+    assert np.array_equal(replayed, expected)
+    assert (expected != expected[0, 0]).any()
+
+    # журнал переживает запись в файл
+    path = str(tmp_path / "log.json")
+    canvas.log.save(path)
+    assert np.array_equal(imagebuffer.pixel_array(oplog.replay(oplog.OperationLog.load(path))), expected)
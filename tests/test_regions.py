@@ -0,0 +1,95 @@
+from PyQt6.QtGui import QImage
+from PyQt6.QtCore import QRect
+import numpy as np
+import pytest
+import floodfill
+import imagebuffer
+from regions import RegionCache
+from settings import FillSettings
+
+"""Проверки карты связных областей: RegionCache находит ту же область, что floodfill.find_region,
+в том числе для областей через швы плиток и после правок с частичной переразметкой"""
+
+
+def make_image(pixels: np.ndarray) -> QImage:
+    h, w = pixels.shape
+    image = QImage(w, h, QImage.Format.Format_RGB32)
+    imagebuffer.pixel_array(image)[:] = pixels
+
+    return image
+
+
+def random_pixels(rng: np.random.Generator, h: int, w: int, colors: int) -> np.ndarray:
+    return (rng.integers(0, colors, (h, w)) * 0x404040 | 0xff000000).astype(np.uint32)
+
+
+def maze_pixels(h: int, w: int) -> np.ndarray:
+    """Змейка: одна длинная область, которая много раз пересекает швы плиток"""
+    pixels = np.full((h, w), 0xffffffff, np.uint32)
+    pixels[1::4, :-1] = 0xff000000
+    pixels[3::4, 1:] = 0xff000000
+
+    return pixels
+
+
+def checker_pixels(h: int, w: int) -> np.ndarray:
+    """Шахматная доска: при 4-связности каждый пиксель отдельно, при 8-связности две области на все изображение"""
+    y, x = np.indices((h, w))
+
+    return np.where((x + y) % 2, 0xff000000, 0xffffffff).astype(np.uint32)
+
+
+def assert_same_regions(cache: RegionCache, image: QImage, points, connectivity: int):
+    pixels = imagebuffer.pixel_array(image, readonly=True)
+
+    for x, y in points:
+        mask, rect = cache.find_region(image, int(x), int(y), connectivity)
+        expected_mask, expected_rect = floodfill.find_region(pixels, int(x), int(y), 0, connectivity)
+
+        assert rect == expected_rect
+        assert np.array_equal(mask, expected_mask)
+
+
+@pytest.mark.parametrize("connectivity", [4, 8])
+@pytest.mark.parametrize("kind", ["random", "maze", "checker"])
+def test_cache_matches_flood_fill(kind, connectivity):
+    rng = np.random.default_rng(connectivity)
+    h, w = 61, 75
+
+    if kind == "random":
+        pixels = random_pixels(rng, h, w, 2)
+    elif kind == "maze":
+        pixels = maze_pixels(h, w)
+    else:
+        pixels = checker_pixels(h, w)
+
+    image = make_image(pixels)
+    points = np.column_stack([rng.integers(0, w, 40), rng.integers(0, h, 40)])
+
+    assert_same_regions(RegionCache(FillSettings(label_tile_size=16)), image, points, connectivity)
+
+
+@pytest.mark.parametrize("connectivity", [4, 8])
+def test_cache_follows_edits(connectivity):
+    rng = np.random.default_rng(1)
+    h, w = 70, 90
+    image = make_image(random_pixels(rng, h, w, 3))
+    cache = RegionCache(FillSettings(label_tile_size=16))
+    points = np.column_stack([rng.integers(0, w, 20), rng.integers(0, h, 20)])
+
+    assert_same_regions(cache, image, points, connectivity)
+
+    for _ in range(5):
+        x, y = int(rng.integers(0, w - 20)), int(rng.integers(0, h - 20))
+        rect = QRect(x, y, 20, 12)
+
+        # правка через общий буфер не меняет серийный номер изображения, поэтому плитки сбрасываются явно
+        pixels = imagebuffer.pixel_array(image)
+        pixels[y:y + 12, x:x + 20] = random_pixels(rng, 12, 20, 3)
+        cache.invalidate(rect)
+
+        assert_same_regions(cache, image, points, connectivity)
+
+    # другое изображение узнается по cacheKey и размечается целиком без invalidate
+    other = make_image(maze_pixels(h, w))
+    assert_same_regions(cache, other, points, connectivity)
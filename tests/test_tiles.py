@@ -0,0 +1,127 @@
+from PyQt6.QtGui import QImage, QColor
+from PyQt6.QtCore import QRect, QPoint
+import numpy as np
+import pytest
+import imagebuffer
+from settings import TileSettings
+from tiles import TiledImage
+
+"""Проверки плиточного хранилища: запись и чтение через границы плиток совпадают с обычным массивом,
+нетронутые плитки читаются цветом фона и не занимают места, sample берет пиксели с нужных плиток"""
+
+BACKGROUND = 0xffffffff
+
+
+@pytest.fixture
+def settings(tmp_path) -> TileSettings:
+    return TileSettings(tile_size=16, cache_tiles=4, directory=str(tmp_path))
+
+
+def random_pixels(rng: np.random.Generator, h: int, w: int) -> np.ndarray:
+    return rng.integers(0, 1 << 24, (h, w), dtype=np.uint32) | np.uint32(0xff000000)
+
+
+def test_write_and_read_across_tiles(settings):
+    rng = np.random.default_rng(0)
+    store = TiledImage(75, 50, settings)
+    expected = np.full((50, 75), BACKGROUND, np.uint32)
+
+    for x, y, w, h in [(10, 5, 30, 20), (60, 40, 15, 10), (0, 0, 1, 1), (33, 17, 20, 33)]:
+        pixels = random_pixels(rng, h, w)
+        store.write_pixels(QPoint(x, y), pixels)
+        expected[y:y + h, x:x + w] = pixels
+
+    for rect in [store.rect(), QRect(7, 3, 40, 30), QRect(15, 15, 2, 2), QRect(64, 48, 20, 20)]:
+        part = rect.intersected(store.rect())
+        image = store.read(rect)
+
+        assert (image.width(), image.height()) == (part.width(), part.height())
+        assert np.array_equal(imagebuffer.pixel_array(image),
+                              expected[part.top():part.bottom() + 1, part.left():part.right() + 1])
+
+    # плитки, в которые ничего не писали, так и остались незаведенными
+    touched = np.zeros((4, 5), bool)
+    for ty, tx in np.ndindex(touched.shape):
+        touched[ty, tx] = (expected[ty * 16:(ty + 1) * 16, tx * 16:(tx + 1) * 16] != BACKGROUND).any()
+
+    assert np.array_equal(store.materialized, touched)
+
+
+def test_write_image_clips_to_store(settings):
+    store = TiledImage(40, 30, settings)
+    image = QImage(20, 20, QImage.Format.Format_ARGB32)
+    image.fill(QColor("#ff336699"))
+
+    store.write(QPoint(30, 25), image)
+    pixels = imagebuffer.pixel_array(store.to_image())
+
+    assert (pixels[25:, 30:] == 0xff336699).all()
+    assert (pixels[:25] == BACKGROUND).all() and (pixels[:, :30] == BACKGROUND).all()
+
+
+def test_slices_stay_inside_one_tile(settings):
+    store = TiledImage(40, 40, settings, QColor("#000000"))
+
+    assert (store[16:32, 0:16] == 0xff000000).all()
+
+    store[20:24, 18:30] = 0xff112233
+    assert (store[16:32, 16:32][4:8, 2:14] == 0xff112233).all()
+    assert store.materialized.sum() == 1
+
+    with pytest.raises(IndexError):
+        store[10:20, 0:5]
+
+
+def test_align_expands_to_tile_borders(settings):
+    store = TiledImage(75, 50, settings)
+
+    assert store.align(QRect(17, 3, 5, 20)) == QRect(16, 0, 16, 32)
+    assert store.align(QRect(70, 45, 100, 100)) == QRect(64, 32, 11, 18)
+
+
+def test_sample_reads_pixels_and_background(settings):
+    store = TiledImage(75, 50, settings)
+    pixels = random_pixels(np.random.default_rng(1), 30, 40)
+    store.write_pixels(QPoint(20, 10), pixels)
+
+    expected = np.full((50, 75), BACKGROUND, np.uint32)
+    expected[10:40, 20:60] = pixels
+
+    sample = store.sample(2000, np.random.default_rng(2))
+
+    rng = np.random.default_rng(2)
+    ys, xs = rng.integers(0, 50, 2000), rng.integers(0, 75, 2000)
+
+    assert np.array_equal(sample, expected[ys, xs])
+
+    # выборка - копия: запись в нее не меняет хранилище
+    sample[:] = 0
+    assert np.array_equal(imagebuffer.pixel_array(store.to_image()), expected)
+
+
+def test_tile_images_are_cached_and_bounded(settings):
+    store = TiledImage(80, 16, settings)
+    store.write_pixels(QPoint(0, 0), np.full((16, 80), 0xff00ff00, np.uint32))
+
+    # незаведенная плитка рисуется общей плиткой фона и не попадает в кэш
+    empty = TiledImage(80, 16, settings)
+    assert empty.tile_image(0, 0) is empty.background_tile and not empty.cache
+
+    images = [store.tile_image(tx, 0) for tx in range(5)]
+
+    assert len(store.cache) == settings.cache_tiles
+    assert (0, 0) not in store.cache and store.tile_image(4, 0) is images[4]
+    assert (imagebuffer.pixel_array(images[2], readonly=True) == 0xff00ff00).all()
+
+
+def test_open_round_trips_file(settings, tmp_path):
+    image = QImage(70, 45, QImage.Format.Format_RGB32)
+    imagebuffer.pixel_array(image)[:] = random_pixels(np.random.default_rng(3), 45, 70)
+    path = str(tmp_path / "big.png")
+    assert image.save(path)
+
+    progress = []
+    store = TiledImage.open(path, settings, progress.append)
+
+    assert progress[-1] == 100
+    assert np.array_equal(imagebuffer.pixel_array(store.to_image()), imagebuffer.pixel_array(image))
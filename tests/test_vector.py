@@ -0,0 +1,150 @@
+from PyQt6.QtGui import QImage, QColor
+from PyQt6.QtCore import Qt, QPoint, QRect
+import numpy as np
+import pytest
+import imagebuffer
+from settings import VectorSettings
+from vector import SHAPE_KINDS, VectorLayer, contains, intersects
+
+"""Проверки векторного слоя: квадродерево находит те же фигуры, что полный перебор, до и после перемещений,
+выбор под курсором берет верхнюю фигуру, а частичная перерисовка после перемещения совпадает с полной"""
+
+RECT = QRect(0, 0, 300, 200)
+SETTINGS = VectorSettings(node_capacity=4, max_depth=6)
+
+
+def random_layer(rng: np.random.Generator, count: int = 150) -> VectorLayer:
+    """Фигуры разного размера, часть выходит за край слоя"""
+    layer = VectorLayer(RECT, SETTINGS)
+
+    for _ in range(count):
+        x, y = int(rng.integers(-20, 320)), int(rng.integers(-20, 220))
+        size = int(rng.choice([4, 15, 60, 250]))
+        end = QPoint(x + int(rng.integers(-size, size + 1)), y + int(rng.integers(-size, size + 1)))
+
+        layer.add(str(rng.choice(SHAPE_KINDS)), QPoint(x, y), end, QColor.fromRgb(int(rng.integers(1 << 24))),
+                  int(rng.choice([1, 3, 7])))
+
+    layer.take_edit()
+
+    return layer
+
+
+def random_boxes(rng: np.random.Generator, count: int):
+    for _ in range(count):
+        x, y = int(rng.integers(-30, 300)), int(rng.integers(-30, 200))
+        w, h = int(rng.integers(0, 80)), int(rng.integers(0, 80))
+
+        yield x, y, x + w, y + h
+
+
+def move_randomly(rng: np.random.Generator, layer: VectorLayer, count: int):
+    for shape_id in rng.choice(list(layer.shapes), count, replace=False):
+        layer.move(layer.shapes[int(shape_id)], int(rng.integers(-100, 101)), int(rng.integers(-100, 101)))
+
+
+def assert_tree_consistent(layer: VectorLayer):
+    stack = [layer.tree.root]
+    stored = set()
+
+    while stack:
+        node = stack.pop()
+
+        for shape in node.items:
+            assert shape.node is node
+            assert node is layer.tree.root or contains(node.loose, shape.box)
+
+        stored |= node.items
+        stack.extend(node.children or [])
+
+    assert stored == set(layer.shapes.values())
+
+
+def test_query_matches_brute_force():
+    rng = np.random.default_rng(0)
+    layer = random_layer(rng)
+
+    assert layer.tree.root.children is not None
+
+    for step in range(3):
+        assert_tree_consistent(layer)
+
+        for box in random_boxes(rng, 50):
+            expected = {shape for shape in layer.shapes.values() if intersects(shape.box, box)}
+
+            assert set(layer.tree.query(box)) == expected
+
+        move_randomly(rng, layer, 40)
+
+
+def test_shape_at_picks_topmost_hit():
+    rng = np.random.default_rng(1)
+    layer = random_layer(rng)
+    move_randomly(rng, layer, 30)
+
+    for x, y in rng.integers(-10, 300, (400, 2)).tolist():
+        # у эллипса расстояние приближенное, поэтому вдали от фигуры ее отсекает описанный прямоугольник
+        box = (x - layer.tolerance, y - layer.tolerance, x + layer.tolerance, y + layer.tolerance)
+        hits = [shape for shape in layer.shapes.values()
+                if intersects(shape.box, box) and shape.hit(x, y, layer.tolerance)]
+        shape = layer.shape_at(QPoint(x, y))
+
+        assert shape is (max(hits, key=lambda shape: shape.id) if hits else None)
+
+
+def test_hit_follows_outline():
+    layer = VectorLayer(RECT, SETTINGS)
+    rectangle = layer.add("rectangle", QPoint(50, 50), QPoint(150, 120), QColor("#000000"), 3)
+    line = layer.add("line", QPoint(10, 10), QPoint(40, 40), QColor("#000000"), 1)
+
+    assert layer.shape_at(QPoint(50, 80)) is rectangle
+    assert layer.shape_at(QPoint(148, 121)) is rectangle
+    # середина прямоугольника и точка в стороне от линии - мимо
+    assert layer.shape_at(QPoint(100, 85)) is None
+    assert layer.shape_at(QPoint(25, 35)) is None
+    assert layer.shape_at(QPoint(26, 25)) is line
+
+    layer.move(rectangle, 100, 50)
+
+    assert layer.shape_at(QPoint(50, 80)) is None
+    assert layer.shape_at(QPoint(150, 130)) is rectangle
+
+
+def rendered(layer: VectorLayer) -> QImage:
+    image = QImage(RECT.size(), QImage.Format.Format_ARGB32)
+    image.fill(Qt.GlobalColor.transparent)
+    layer.render(image, image.rect())
+
+    return image
+
+
+def test_move_repaints_like_full_render():
+    rng = np.random.default_rng(2)
+    layer = random_layer(rng, 60)
+    image = rendered(layer)
+
+    for shape_id in rng.choice(list(layer.shapes), 20, replace=False):
+        rect = layer.move(layer.shapes[int(shape_id)], int(rng.integers(-60, 61)), int(rng.integers(-60, 61)))
+        layer.render(image, rect)
+
+    assert np.array_equal(imagebuffer.pixel_array(image), imagebuffer.pixel_array(rendered(layer)))
+
+
+@pytest.mark.parametrize("moves", [1, 5])
+def test_edit_swap_restores_shapes(moves):
+    rng = np.random.default_rng(moves)
+    layer = random_layer(rng, 40)
+    before = {shape_id: shape.state() for shape_id, shape in layer.shapes.items()}
+
+    move_randomly(rng, layer, moves)
+    layer.add("line", QPoint(0, 0), QPoint(30, 30), QColor("#ff0000"), 5)
+    edit = layer.take_edit()
+    after = {shape_id: shape.state() for shape_id, shape in layer.shapes.items()}
+
+    edit.swap()
+    assert {shape_id: shape.state() for shape_id, shape in layer.shapes.items()} == before
+    assert_tree_consistent(layer)
+
+    edit.swap()
+    assert {shape_id: shape.state() for shape_id, shape in layer.shapes.items()} == after
+    assert_tree_consistent(layer)
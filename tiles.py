@@ -0,0 +1,225 @@
+from PyQt6.QtGui import QImage, QImageReader, QImageIOHandler, QColor
+from PyQt6.QtCore import QRect, QPoint, QSize
+from PyQt6 import sip
+from collections import OrderedDict
+import tempfile
+import numpy as np
+from settings import TileSettings
+import imagebuffer
+
+"""Это модуль плиточного хранилища для очень больших изображений
+Изображение хранится по плиткам в файле, отображенном в память (np.memmap), каждая плитка лежит в файле одним куском.
+Файл создается разреженным: пока в плитку ничего не записали, она считается залитой цветом фона и не занимает места
+ни на диске, ни в памяти. Для отрисовки плиток держится ограниченный кэш QImage, которые смотрят прямо в память файла
+без копирования, поэтому расход памяти не зависит от размера изображения
+
+Срез store[ys, xs] (как у массива NumPy) возвращает пиксели внутри одной плитки, этим пользуется история изменений"""
+
+# форматы, которые декодируют часть изображения, не разбирая файл с начала (вектор рисует только нужную часть).
+# JPEG тоже поддерживает ClipRect, но каждый раз декодирует строки с самого верха, поэтому полосами он открывался бы
+# за (число полос x изображение)
+RANDOM_ACCESS_FORMATS = frozenset({b"svg", b"svgz"})
+
+
+class TiledImage:
+    def __init__(self, width: int, height: int, settings: TileSettings, background: QColor = QColor("#ffffff")):
+        self.width = width
+        self.height = height
+        self.tile_size = settings.tile_size
+        self.cache_tiles = settings.cache_tiles
+        self.background = background.rgb()
+
+        self.rows = -(-height // self.tile_size)
+        self.cols = -(-width // self.tile_size)
+
+        self.file = tempfile.NamedTemporaryFile(prefix="paint_tiles_", suffix=".raw", dir=settings.directory)
+        self.tiles = np.memmap(self.file.name, np.uint32, "w+",
+                               shape=(self.rows, self.cols, self.tile_size, self.tile_size))
+        self.materialized = np.zeros((self.rows, self.cols), bool)
+
+        self.cache: OrderedDict[tuple[int, int], QImage] = OrderedDict()
+        self.background_tile = QImage(self.tile_size, self.tile_size, QImage.Format.Format_RGB32)
+        self.background_tile.fill(self.background)
+
+    @classmethod
+    def open(cls, path: str, settings: TileSettings, progress=lambda value: None) -> "TiledImage":
+        """Загружает изображение полосами высотой в плитку, если формат умеет декодировать часть изображения
+        без разбора файла с начала (RANDOM_ACCESS_FORMATS), иначе изображение декодируется целиком один раз
+        и раскладывается по плиткам полосами. progress получает процент загрузки"""
+        reader = QImageReader(path)
+        size = reader.size()
+
+        store = cls(size.width(), size.height(), settings)
+
+        if reader.format() in RANDOM_ACCESS_FORMATS and reader.supportsOption(QImageIOHandler.ImageOption.ClipRect):
+            for top in range(0, store.height, store.tile_size):
+                progress(top * 100 // store.height)
+
+                reader = QImageReader(path)
+                rect = QRect(0, top, store.width, min(store.tile_size, store.height - top))
+                reader.setClipRect(rect)
+
+                store.write(rect.topLeft(), reader.read())
+        else:
+            # Qt по умолчанию отказывается декодировать изображения больше 256 МБ, а это именно такие
+            needed = (store.width * store.height * 4 >> 20) + 1
+
+            if 0 < QImageReader.allocationLimit() < needed:
+                QImageReader.setAllocationLimit(needed)
+
+            image = reader.read()
+
+            if image.isNull():
+                raise OSError(reader.errorString())
+
+            if image.format() != QImage.Format.Format_RGB32:
+                image = image.convertToFormat(QImage.Format.Format_RGB32)
+
+            pixels = imagebuffer.pixel_array(image, readonly=True)
+
+            for top in range(0, store.height, store.tile_size):
+                progress(top * 100 // store.height)
+
+                store.write_pixels(QPoint(0, top), pixels[top:top + store.tile_size])
+
+        progress(100)
+
+        return store
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.height, self.width
+
+    def size(self) -> QSize:
+        return QSize(self.width, self.height)
+
+    def rect(self) -> QRect:
+        return QRect(0, 0, self.width, self.height)
+
+    def tile_rect(self, tx: int, ty: int) -> QRect:
+        return QRect(tx * self.tile_size, ty * self.tile_size, self.tile_size, self.tile_size).intersected(self.rect())
+
+    def tiles_in(self, rect: QRect):
+        rect = rect.intersected(self.rect())
+
+        if rect.isEmpty():
+            return
+
+        for ty in range(rect.top() // self.tile_size, rect.bottom() // self.tile_size + 1):
+            for tx in range(rect.left() // self.tile_size, rect.right() // self.tile_size + 1):
+                yield tx, ty
+
+    def align(self, rect: QRect) -> QRect:
+        """Расширяет прямоугольник до границ плиток"""
+        rect = rect.intersected(self.rect())
+        size = self.tile_size
+
+        left, top = rect.left() // size * size, rect.top() // size * size
+        right = min((rect.right() // size + 1) * size, self.width)
+        bottom = min((rect.bottom() // size + 1) * size, self.height)
+
+        return QRect(left, top, right - left, bottom - top)
+
+    def materialize(self, tx: int, ty: int) -> np.ndarray:
+        if not self.materialized[ty, tx]:
+            self.tiles[ty, tx] = self.background
+            self.materialized[ty, tx] = True
+
+        return self.tiles[ty, tx]
+
+    def tile_image(self, tx: int, ty: int) -> QImage:
+        """QImage, который смотрит в память плитки без копирования"""
+        if not self.materialized[ty, tx]:
+            return self.background_tile
+
+        key = (tx, ty)
+
+        if key in self.cache:
+            self.cache.move_to_end(key)
+
+            return self.cache[key]
+
+        tile = self.tiles[ty, tx]
+        image = QImage(sip.voidptr(tile.ctypes.data), self.tile_size, self.tile_size,
+                       self.tile_size * 4, QImage.Format.Format_RGB32)
+
+        self.cache[key] = image
+
+        while len(self.cache) > self.cache_tiles:
+            self.cache.popitem(last=False)
+
+        return image
+
+    def locate(self, key: tuple[slice, slice]) -> tuple[int, int, slice, slice]:
+        ys, xs = key
+        ty, tx = ys.start // self.tile_size, xs.start // self.tile_size
+        top, left = ty * self.tile_size, tx * self.tile_size
+
+        if ys.stop - top > self.tile_size or xs.stop - left > self.tile_size:
+            raise IndexError("срез должен лежать внутри одной плитки")
+
+        return tx, ty, slice(ys.start - top, ys.stop - top), slice(xs.start - left, xs.stop - left)
+
+    def __getitem__(self, key: tuple[slice, slice]) -> np.ndarray:
+        tx, ty, ys, xs = self.locate(key)
+
+        if not self.materialized[ty, tx]:
+            return np.full((ys.stop - ys.start, xs.stop - xs.start), self.background, np.uint32)
+
+        return self.tiles[ty, tx, ys, xs]
+
+    def __setitem__(self, key: tuple[slice, slice], value: np.ndarray):
+        tx, ty, ys, xs = self.locate(key)
+
+        self.materialize(tx, ty)[ys, xs] = value
+
+    def read(self, rect: QRect) -> QImage:
+        """Собирает из плиток копию прямоугольника"""
+        rect = rect.intersected(self.rect())
+
+        image = QImage(rect.size(), QImage.Format.Format_RGB32)
+        pixels = imagebuffer.pixel_array(image)
+
+        for tx, ty in self.tiles_in(rect):
+            part = self.tile_rect(tx, ty).intersected(rect)
+
+            ys = slice(part.top() - rect.top(), part.bottom() + 1 - rect.top())
+            xs = slice(part.left() - rect.left(), part.right() + 1 - rect.left())
+
+            pixels[ys, xs] = self[part.top():part.bottom() + 1, part.left():part.right() + 1]
+
+        return image
+
+    def sample(self, count: int, rng: np.random.Generator) -> np.ndarray:
+        """count случайных пикселей изображения (для построения палитры без сборки всего изображения)"""
+        ys = rng.integers(0, self.height, count)
+        xs = rng.integers(0, self.width, count)
+        ty, tx = ys // self.tile_size, xs // self.tile_size
+
+        pixels = self.tiles[ty, tx, ys % self.tile_size, xs % self.tile_size]
+        pixels[~self.materialized[ty, tx]] = self.background
+
+        return pixels
+
+    def write(self, point: QPoint, image: QImage):
+        """Раскладывает изображение по плиткам, point - положение его левого верхнего угла"""
+        if image.format() != QImage.Format.Format_RGB32:
+            image = image.convertToFormat(QImage.Format.Format_RGB32)
+
+        self.write_pixels(point, imagebuffer.pixel_array(image))
+
+    def write_pixels(self, point: QPoint, pixels: np.ndarray):
+        """То же для массива uint32 (высота, ширина)"""
+        rect = QRect(point.x(), point.y(), pixels.shape[1], pixels.shape[0])
+
+        for tx, ty in self.tiles_in(rect):
+            part = self.tile_rect(tx, ty).intersected(rect)
+
+            ys = slice(part.top() - rect.top(), part.bottom() + 1 - rect.top())
+            xs = slice(part.left() - rect.left(), part.right() + 1 - rect.left())
+
+            self[part.top():part.bottom() + 1, part.left():part.right() + 1] = pixels[ys, xs]
+
+    def to_image(self) -> QImage:
+        """Собирает изображение целиком. Для сохранения не используется: файл пишется полосами (fileio.write_image)"""
+        return self.read(self.rect())
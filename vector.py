@@ -0,0 +1,322 @@
+from PyQt6.QtGui import QImage, QPainter, QPen, QColor
+from PyQt6.QtCore import Qt, QPoint, QRect
+import math
+from settings import VectorSettings
+
+"""Это модуль векторного слоя
+Линии, прямоугольники и эллипсы на векторном слое не только рисуются, но и запоминаются как фигуры, поэтому их можно
+выбрать и передвинуть, а слой можно заново растеризовать в любом масштабе. Изображение слоя - кэш растеризации:
+после изменения фигуры перерисовывается только прямоугольник, который она занимала и занимает теперь, и в нем только
+те фигуры, которые его задевают.
+
+Фигуры хранятся в квадродереве по описанным прямоугольникам. Фигура лежит в самом глубоком узле, который вмещает ее
+целиком, поэтому поиск фигур в прямоугольнике и под курсором обходит только узлы, которые его задевают, - O(log n)
+при любом числе фигур. Дерево "свободное": границы узла расширены на половину его размера в каждую сторону, иначе
+мелкие фигуры на линиях деления застревали бы в верхних узлах и проверялись бы при каждом поиске.
+Порядок наложения - порядок создания (номер фигуры), перемещение его не меняет.
+
+Изменения фигур за штрих собираются в ShapeEdit, который история кладет в шаг вместе с плитками слоя:
+отмена возвращает и пиксели, и фигуры"""
+
+SHAPE_KINDS = ("line", "rectangle", "ellipse")
+
+
+def shape_pen(kind: str, color: QColor, width: int) -> QPen:
+    """То же перо, что у инструментов фигур: у линии круглые концы, у остальных квадратные"""
+    cap = Qt.PenCapStyle.RoundCap if kind == "line" else Qt.PenCapStyle.SquareCap
+
+    return QPen(color, width, Qt.PenStyle.SolidLine, cap, Qt.PenJoinStyle.MiterJoin)
+
+
+def draw_shape(painter: QPainter, kind: str, start: QPoint, end: QPoint):
+    if kind == "line":
+        painter.drawLine(start, end)
+    elif kind == "rectangle":
+        painter.drawRect(QRect(start, end))
+    else:
+        painter.drawEllipse(QRect(start, end))
+
+
+class Shape:
+    __slots__ = ("id", "kind", "x1", "y1", "x2", "y2", "color", "width", "box", "node")
+
+    def __init__(self, shape_id: int, kind: str, x1: int, y1: int, x2: int, y2: int, color: int, width: int):
+        self.id = shape_id
+        self.kind = kind
+        self.x1, self.y1, self.x2, self.y2 = x1, y1, x2, y2
+        self.color = color
+        self.width = width
+        self.node: Node = None
+        self.update_box()
+
+    def update_box(self):
+        """Описанный прямоугольник (left, top, right, bottom) с учетом толщины линии, границы включительно"""
+        margin = self.width // 2 + 1
+        self.box = (min(self.x1, self.x2) - margin, min(self.y1, self.y2) - margin,
+                    max(self.x1, self.x2) + margin, max(self.y1, self.y2) + margin)
+
+    def rect(self) -> QRect:
+        left, top, right, bottom = self.box
+
+        return QRect(QPoint(left, top), QPoint(right, bottom))
+
+    def state(self) -> tuple:
+        return self.kind, self.x1, self.y1, self.x2, self.y2, self.color, self.width
+
+    def draw(self, painter: QPainter):
+        painter.setPen(shape_pen(self.kind, QColor.fromRgba(self.color), self.width))
+        draw_shape(painter, self.kind, QPoint(self.x1, self.y1), QPoint(self.x2, self.y2))
+
+    def distance(self, x: float, y: float) -> float:
+        """Расстояние от точки до линии фигуры (у эллипса - приближенное)"""
+        x1, y1, x2, y2 = self.x1, self.y1, self.x2, self.y2
+
+        if self.kind == "line":
+            dx, dy = x2 - x1, y2 - y1
+            length = dx * dx + dy * dy
+            t = min(max(((x - x1) * dx + (y - y1) * dy) / length, 0), 1) if length else 0
+
+            return math.hypot(x - x1 - t * dx, y - y1 - t * dy)
+
+        left, top, right, bottom = min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)
+
+        if self.kind == "rectangle":
+            if left <= x <= right and top <= y <= bottom:
+                return min(x - left, right - x, y - top, bottom - y)
+
+            return math.hypot(max(left - x, 0, x - right), max(top - y, 0, y - bottom))
+
+        rx, ry = (right - left) / 2, (bottom - top) / 2
+        dx, dy = x - (left + right) / 2, y - (top + bottom) / 2
+
+        if min(rx, ry) < 1:
+            return max(abs(dx) - rx, abs(dy) - ry, 0)
+
+        radius = math.hypot(dx / rx, dy / ry)
+
+        return abs(radius - 1) * min(rx, ry) if radius > 0 else min(rx, ry)
+
+    def hit(self, x: float, y: float, tolerance: float) -> bool:
+        return self.distance(x, y) <= self.width / 2 + tolerance
+
+
+def intersects(a: tuple, b: tuple) -> bool:
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def contains(outer: tuple, inner: tuple) -> bool:
+    return outer[0] <= inner[0] and outer[1] <= inner[1] and inner[2] <= outer[2] and inner[3] <= outer[3]
+
+
+class Node:
+    """box - область узла, loose - она же, расширенная на половину размера: в ней должны лежать фигуры узла"""
+    __slots__ = ("box", "loose", "center", "depth", "items", "children")
+
+    def __init__(self, box: tuple, depth: int):
+        left, top, right, bottom = box
+        dx, dy = (right - left + 1) // 2, (bottom - top + 1) // 2
+
+        self.box = box
+        self.loose = (left - dx, top - dy, right + dx, bottom + dy)
+        self.center = ((left + right) // 2, (top + bottom) // 2)
+        self.depth = depth
+        self.items: set[Shape] = set()
+        self.children: list[Node] = None
+
+    def split(self):
+        left, top, right, bottom = self.box
+        x, y = self.center
+
+        self.children = [Node(box, self.depth + 1) for box in ((left, top, x, y), (x + 1, top, right, y),
+                                                                  (left, y + 1, x, bottom), (x + 1, y + 1, right, bottom))]
+
+
+class QuadTree:
+    """Фигуры, которые выходят за пределы корня, остаются в корне"""
+
+    def __init__(self, rect: QRect, settings: VectorSettings):
+        self.capacity = settings.node_capacity
+        self.max_depth = settings.max_depth
+        self.root = Node((rect.left(), rect.top(), rect.right(), rect.bottom()), 0)
+
+    def child_for(self, node: Node, box: tuple) -> Node:
+        """Дочерний узел, в область которого попадает центр фигуры, если фигура помещается в его расширенные границы"""
+        x, y = node.center
+        child = node.children[((box[0] + box[2]) // 2 > x) + 2 * ((box[1] + box[3]) // 2 > y)]
+
+        return child if contains(child.loose, box) else None
+
+    def insert(self, shape: Shape):
+        node = self.root
+
+        while node.children is not None:
+            child = self.child_for(node, shape.box)
+
+            if child is None:
+                break
+
+            node = child
+
+        node.items.add(shape)
+        shape.node = node
+
+        if node.children is None and len(node.items) > self.capacity and node.depth < self.max_depth:
+            node.split()
+
+            for item in list(node.items):
+                child = self.child_for(node, item.box)
+
+                if child is not None:
+                    node.items.remove(item)
+                    child.items.add(item)
+                    item.node = child
+
+    def remove(self, shape: Shape):
+        shape.node.items.discard(shape)
+        shape.node = None
+
+    def query(self, box: tuple):
+        """Перебирает фигуры, описанный прямоугольник которых пересекается с box"""
+        stack = [self.root]
+
+        while stack:
+            node = stack.pop()
+
+            for shape in node.items:
+                if intersects(shape.box, box):
+                    yield shape
+
+            if node.children is not None:
+                stack.extend(child for child in node.children if intersects(child.loose, box))
+
+
+class ShapeEdit:
+    """Фигуры, которые изменил штрих, и их прошлые состояния (None - фигуры не было)"""
+
+    def __init__(self, layer: "VectorLayer", states: dict[int, tuple]):
+        self.layer = layer
+        self.states = states
+
+    def swap(self):
+        """Возвращает фигурам сохраненные состояния, а текущие запоминает для обратной операции.
+        Пиксели слоя восстанавливает сама история"""
+        states = {}
+
+        for shape_id, state in self.states.items():
+            shape = self.layer.shapes.get(shape_id)
+            states[shape_id] = shape.state() if shape is not None else None
+            self.layer.set_state(shape_id, state)
+
+        self.states = states
+
+
+class VectorLayer:
+    def __init__(self, rect: QRect, settings: VectorSettings):
+        self.rect = rect
+        self.tolerance = settings.hit_tolerance
+        self.tree = QuadTree(rect, settings)
+        self.shapes: dict[int, Shape] = {}
+        self.next_id = 0
+        self.changes: dict[int, tuple] = {}
+
+    def __len__(self) -> int:
+        return len(self.shapes)
+
+    def remember(self, shape_id: int):
+        """Запоминает состояние фигуры до первого изменения в текущем штрихе"""
+        if shape_id not in self.changes:
+            shape = self.shapes.get(shape_id)
+            self.changes[shape_id] = shape.state() if shape is not None else None
+
+    def take_edit(self) -> ShapeEdit:
+        """Изменения фигур с прошлого вызова для шага истории, None - фигуры не менялись"""
+        if not self.changes:
+            return None
+
+        edit = ShapeEdit(self, self.changes)
+        self.changes = {}
+
+        return edit
+
+    def set_state(self, shape_id: int, state: tuple):
+        shape = self.shapes.pop(shape_id, None)
+
+        if shape is not None:
+            self.tree.remove(shape)
+
+        if state is not None:
+            shape = self.shapes[shape_id] = Shape(shape_id, *state)
+            self.tree.insert(shape)
+
+    def add(self, kind: str, start: QPoint, end: QPoint, color: QColor, width: int) -> Shape:
+        shape_id = self.next_id
+        self.next_id += 1
+
+        self.remember(shape_id)
+        self.set_state(shape_id, (kind, start.x(), start.y(), end.x(), end.y(), color.rgba(), width))
+
+        return self.shapes[shape_id]
+
+    def move(self, shape: Shape, dx: int, dy: int) -> QRect:
+        """Сдвигает фигуру и возвращает прямоугольник, который нужно перерисовать"""
+        old = shape.rect()
+
+        self.remember(shape.id)
+        self.tree.remove(shape)
+        shape.x1 += dx
+        shape.y1 += dy
+        shape.x2 += dx
+        shape.y2 += dy
+        shape.update_box()
+        self.tree.insert(shape)
+
+        return old.united(shape.rect())
+
+    def shape_at(self, point: QPoint) -> Shape:
+        """Верхняя фигура, линия которой проходит не дальше hit_tolerance от точки"""
+        x, y = point.x(), point.y()
+        box = (x - self.tolerance, y - self.tolerance, x + self.tolerance, y + self.tolerance)
+        hits = [shape for shape in self.tree.query(box) if shape.hit(x, y, self.tolerance)]
+
+        return max(hits, key=lambda shape: shape.id) if hits else None
+
+    def shapes_in(self, rect: QRect) -> list[Shape]:
+        """Фигуры, задевающие прямоугольник, в порядке наложения"""
+        box = (rect.left(), rect.top(), rect.right(), rect.bottom())
+
+        return sorted(self.tree.query(box), key=lambda shape: shape.id)
+
+    def render(self, image: QImage, rect: QRect):
+        """Заново растеризует прямоугольник слоя: очищает его и рисует только задевающие его фигуры"""
+        rect = rect.intersected(image.rect())
+
+        if rect.isEmpty():
+            return
+
+        painter = QPainter(image)
+        painter.setClipRect(rect)
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Source)
+        painter.fillRect(rect, Qt.GlobalColor.transparent)
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_SourceOver)
+
+        for shape in self.shapes_in(rect):
+            shape.draw(painter)
+
+        painter.end()
+
+    def rasterize(self, scale: float) -> QImage:
+        """Растеризует весь слой в другом масштабе, например для экспорта в большем разрешении"""
+        image = QImage(math.ceil(self.rect.width() * scale), math.ceil(self.rect.height() * scale),
+                       QImage.Format.Format_ARGB32_Premultiplied)
+        image.fill(Qt.GlobalColor.transparent)
+
+        painter = QPainter(image)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.scale(scale, scale)
+
+        for shape in sorted(self.shapes.values(), key=lambda shape: shape.id):
+            shape.draw(painter)
+
+        painter.end()
+
+        return image